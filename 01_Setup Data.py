@@ -32,6 +32,10 @@
 
 # COMMAND ----------
 
+# MAGIC %run ./utils/table_layout
+
+# COMMAND ----------
+
 # MAGIC %md
 # MAGIC ####Create Catalog and Schema
 
@@ -110,6 +114,9 @@ member.write.mode("append").saveAsTable(f"{catalog}.{schema}.{member_table_name}
 
 spark.sql(f"ALTER TABLE {catalog}.{schema}.{member_table_name} ADD CONSTRAINT {member_table_name}_pk PRIMARY KEY( member_id )")
 
+#cluster the rows on the primary key for lookups and joins
+apply_liquid_clustering(f"{catalog}.{schema}.{member_table_name}", lookup_table_cluster_columns[member_table_name])
+
 # COMMAND ----------
 
 # MAGIC %md
@@ -153,6 +160,9 @@ member_accumulators.write.mode("append").saveAsTable(f"{catalog}.{schema}.{membe
 
 spark.sql(f"ALTER TABLE {catalog}.{schema}.{member_accumulators_table_name} ADD CONSTRAINT {member_accumulators_table_name}_pk PRIMARY KEY( member_id)")
 
+#cluster the rows on the primary key for lookups and joins
+apply_liquid_clustering(f"{catalog}.{schema}.{member_accumulators_table_name}", lookup_table_cluster_columns[member_accumulators_table_name])
+
 # COMMAND ----------
 
 # MAGIC %md
@@ -166,11 +176,13 @@ display(spark.table(f"{catalog}.{schema}.{member_accumulators_table_name}"))
 
 # MAGIC %md
 # MAGIC #####`cpt_codes`
-# MAGIC
+# MAGIC The `id` of each CPT code is a hash of the code, so it does not change between loads of the catalog. 
+# MAGIC The codes are upserted with a `MERGE` that only inserts, updates or deletes the codes that changed. So when we switch to a new version of the catalog file, the Delta Sync vector index on this table only re-embeds the changed descriptions.
 
 # COMMAND ----------
 
-from pyspark.sql.functions import monotonically_increasing_id
+from delta.tables import DeltaTable
+from pyspark.sql.functions import xxhash64, trim, max as max_
 
 cpt_codes_file = f"{cpt_folder_path}/{cpt_file}"
 
@@ -179,31 +191,39 @@ cpt_codes_file_schema = (StructType()
     .add("description",StringType(),True)
 )
 
-cpt_codes_table_schema = (StructType()
-    .add("id",LongType(),False)
-    .add("code",StringType(),True)
-    .add("description",StringType(),True)
-)
-
-
 cpt_df = (spark
           .read
           .option("header", "false")
           .option("delimiter", "\t")
           .schema(cpt_codes_file_schema)
           .csv(cpt_codes_file)
-          .repartition(1)
-          .withColumn("id",monotonically_increasing_id())
+          .withColumn("code", trim("code"))
+          .withColumn("description", trim("description"))
+          .filter("code IS NOT NULL AND code <> '' ")
+          #some catalog files have the same code more than once
+          .groupBy("code")
+          .agg(max_("description").alias("description"))
+          .withColumn("id", xxhash64("code"))
           .select("id","code","description")
 )
 
-spark.sql(f"DROP TABLE IF EXISTS {catalog}.{schema}.{cpt_code_table_name}")
+spark.sql(f"""CREATE TABLE IF NOT EXISTS {catalog}.{schema}.{cpt_code_table_name} 
+              (id BIGINT NOT NULL, code STRING, description STRING, 
+               CONSTRAINT {cpt_code_table_name}_pk PRIMARY KEY(id)) 
+              TBLPROPERTIES (delta.enableChangeDataFeed = true)""")
 
-spark.catalog.createTable(f"{catalog}.{schema}.{cpt_code_table_name}", schema=cpt_codes_table_schema)
+#tables created by earlier versions of this notebook have arbitrary ids, they are all replaced by the first merge
+(DeltaTable.forName(spark, f"{catalog}.{schema}.{cpt_code_table_name}").alias("t")
+    .merge(cpt_df.alias("s"), "t.id = s.id")
+    .whenMatchedUpdate(condition="t.code <> s.code OR NOT (t.description <=> s.description)", 
+                       set={"code":"s.code", "description":"s.description"})
+    .whenNotMatchedInsertAll()
+    .whenNotMatchedBySourceDelete()
+    .execute())
 
-cpt_df.write.mode("append").saveAsTable(f"{catalog}.{schema}.{cpt_code_table_name}")
+# COMMAND ----------
 
-spark.sql(f"ALTER TABLE {catalog}.{schema}.{cpt_code_table_name} ADD CONSTRAINT {cpt_code_table_name}_pk PRIMARY KEY( id )")
+display(spark.sql(f"DESCRIBE HISTORY {catalog}.{schema}.{cpt_code_table_name} LIMIT 1").select("version","operationMetrics"))
 
 # COMMAND ----------
 
@@ -212,7 +232,7 @@ spark.sql(f"ALTER TABLE {catalog}.{schema}.{cpt_code_table_name} ADD CONSTRAINT
 
 # COMMAND ----------
 
-display(cpt_df)
+display(spark.table(f"{catalog}.{schema}.{cpt_code_table_name}"))
 
 # COMMAND ----------
 
@@ -223,7 +243,7 @@ display(cpt_df)
 
 # COMMAND ----------
 
-from pyspark.sql.functions import rand,round, pow, ceil,col
+import pyspark.sql.functions as F
 
 procedure_cost_schema = StructType([
     StructField("procedure_code",StringType(), nullable=False),
@@ -239,15 +259,18 @@ spark.catalog.createTable(f"{catalog}.{schema}.{procedure_cost_table_name}", sch
 procedure_cost = (
     spark
     .table(f"{catalog}.{schema}.{cpt_code_table_name}")
-    .withColumn("pow", ceil(rand(seed=1234) * 10) % 3 + 2 )
-    .withColumn("cost", round(rand(seed=2345) *  pow(10, "pow") + 20 ,2)  )
-    .select(col("code").alias("procedure_code"),"cost")
+    .withColumn("pow", F.ceil(F.rand(seed=1234) * 10) % 3 + 2 )
+    .withColumn("cost", F.round(F.rand(seed=2345) *  F.pow(10, "pow") + 20 ,2)  )
+    .select(F.col("code").alias("procedure_code"),"cost")
 )
 
 procedure_cost.write.mode("append").saveAsTable(f"{catalog}.{schema}.{procedure_cost_table_name}")
 
 spark.sql(f"ALTER TABLE {catalog}.{schema}.{procedure_cost_table_name} ADD CONSTRAINT {procedure_cost_table_name}_pk PRIMARY KEY( procedure_code )")
 
+#cluster the rows on the primary key for lookups and joins
+apply_liquid_clustering(f"{catalog}.{schema}.{procedure_cost_table_name}", lookup_table_cluster_columns[procedure_cost_table_name])
+
 
 # COMMAND ----------
 
@@ -257,3 +280,104 @@ spark.sql(f"ALTER TABLE {catalog}.{schema}.{procedure_cost_table_name} ADD CONST
 # COMMAND ----------
 
 display(spark.table(f"{catalog}.{schema}.{procedure_cost_table_name}"))
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC #### Generate Data at Scale (Optional)
+# MAGIC The tables above have a handful of rows, which tells us nothing about the lookup latency, index sizes or join performance at production scale. Set `generate_scale_data` to `True` to append synthetic rows for millions of members and thousands of clients to `member_enrolment`, `member_accumulators`, `procedure_cost` and `sbc_details`. The demo rows are kept, so the rest of the notebooks work as before and can be load-tested.
+# MAGIC
+# MAGIC The rows are range partitioned on the primary key, so that point lookups only read a few files. `sample_member_ids` can be used to pick the members of a load test with a skew of hot members.
+
+# COMMAND ----------
+
+# MAGIC %run ./utils/synthetic_data
+
+# COMMAND ----------
+
+generate_scale_data = False
+
+scale_num_members = 5000000
+scale_num_clients = 2000
+scale_num_procedures = 20000
+#members are concentrated in the first clients, higher is more skewed
+scale_client_skew = 2.0
+
+# COMMAND ----------
+
+if generate_scale_data:
+    #remove the synthetic rows of a previous run
+    spark.sql(f"DELETE FROM {catalog}.{schema}.{member_table_name} WHERE member_id LIKE 'S%'")
+    spark.sql(f"DELETE FROM {catalog}.{schema}.{member_accumulators_table_name} WHERE member_id LIKE 'S%'")
+    spark.sql(f"DELETE FROM {catalog}.{schema}.{procedure_cost_table_name} WHERE procedure_code LIKE 'X%'")
+
+    scale_member_df = generate_member_enrolment(scale_num_members, scale_num_clients, client_skew=scale_client_skew)
+    append_synthetic_rows(scale_member_df, f"{catalog}.{schema}.{member_table_name}", "member_id", scale_num_members)
+
+    #accumulators are generated from the plan of the members that were written
+    scale_member_df = spark.table(f"{catalog}.{schema}.{member_table_name}").filter(F.col("member_id").startswith("S"))
+    append_synthetic_rows(generate_member_accumulators(scale_member_df), f"{catalog}.{schema}.{member_accumulators_table_name}", "member_id", scale_num_members)
+
+    append_synthetic_rows(generate_procedure_cost(scale_num_procedures), f"{catalog}.{schema}.{procedure_cost_table_name}", "procedure_code", scale_num_procedures)
+
+    #same definition as in 02_Parsing and Chunking Summary of Benefits
+    spark.sql(f"""CREATE TABLE IF NOT EXISTS {catalog}.{schema}.{sbc_details_table_name} 
+              (id BIGINT, client STRING, content STRING) 
+              TBLPROPERTIES (delta.enableChangeDataFeed = true)""")
+    spark.sql(f"DELETE FROM {catalog}.{schema}.{sbc_details_table_name} WHERE client LIKE 'client%'")
+    scale_sbc_chunks = (len(sbc_coverage_templates) + 2) * scale_num_clients
+    append_synthetic_rows(generate_sbc_chunks(scale_num_clients), f"{catalog}.{schema}.{sbc_details_table_name}", "client", scale_sbc_chunks)
+
+# COMMAND ----------
+
+if generate_scale_data:
+    display(spark.sql(f"""SELECT client_id, count(*) AS members 
+                          FROM {catalog}.{schema}.{member_table_name} 
+                          GROUP BY client_id ORDER BY members DESC LIMIT 20"""))
+    display(spark.table(f"{catalog}.{schema}.{member_accumulators_table_name}").summary())
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC #### Optimize the Lookup Tables
+# MAGIC `member_enrolment`, `member_accumulators` and `procedure_cost` are clustered on their primary keys with liquid clustering. `OPTIMIZE` clusters the rows written since the last run, so we run it now and schedule a daily job that runs it on new data.
+# MAGIC
+# MAGIC **NOTE:** If predictive optimization is enabled for the schema, Databricks runs `OPTIMIZE` automatically and the scheduled job is not needed.
+
+# COMMAND ----------
+
+lookup_table_names = [f"{catalog}.{schema}.{t}" for t in lookup_table_cluster_columns.keys()]
+
+display(pd.DataFrame([optimize_table(t) for t in lookup_table_names]))
+
+# COMMAND ----------
+
+optimize_job_id = schedule_optimize_job(f"{catalog}_{schema}_optimize_lookup_tables", 
+                                        lookup_table_names, 
+                                        f"/{project_root_path}/utils/optimize_tables")
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ###### Benchmark the Layout (Optional)
+# MAGIC With the data generated at scale, let us compare the point lookup and batched join latency of the clustered tables with unclustered copies of them, where the rows are shuffled across files.
+
+# COMMAND ----------
+
+if generate_scale_data:
+    benchmark_member_ids = sample_member_ids(f"{catalog}.{schema}.{member_table_name}", 10000)
+    benchmark_procedure_codes = [r.procedure_code for r in spark.table(f"{catalog}.{schema}.{procedure_cost_table_name}")
+                                                             .sample(fraction=0.5, seed=42).limit(10000).collect()]
+    benchmark_keys = {member_table_name:benchmark_member_ids,
+                      member_accumulators_table_name:benchmark_member_ids,
+                      procedure_cost_table_name:benchmark_procedure_codes}
+
+    layout_benchmark = []
+    for table_name, cluster_columns in lookup_table_cluster_columns.items():
+        fq_table_name = f"{catalog}.{schema}.{table_name}"
+        unclustered_table_name = create_unclustered_copy(fq_table_name)
+        for layout, benchmark_table_name in [("unclustered", unclustered_table_name), ("clustered", fq_table_name)]:
+            layout_benchmark.append({"layout":layout, **benchmark_table_lookups(benchmark_table_name, cluster_columns[0], benchmark_keys[table_name])})
+        spark.sql(f"DROP TABLE IF EXISTS {unclustered_table_name}")
+
+    display(pd.DataFrame(layout_benchmark))
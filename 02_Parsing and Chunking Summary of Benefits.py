@@ -71,66 +71,13 @@
 # MAGIC ##### Implement pdf reading using `camelot`
 # MAGIC
 # MAGIC Let us create some utility methods to read each data sections from the Summary of Benefits and Coverage (SBC) document. 
+# MAGIC The methods are in the `./utils/sbc_parsing` notebook. They do not need Spark, so the parsing can also be benchmarked locally with `scripts/benchmark_sbc_parsing.py`.
 # MAGIC
 # MAGIC **NOTE**:These methods are kept simple for demonstration, but could be extended to generalize for different SBC formats.
 
 # COMMAND ----------
 
-import pandas as pd
-import camelot
-import pdfplumber
-
-#lets create a custom backend for camelot to convert pdf to png
-class SBCConversionBackend(object):
-    def convert(self,pdf_path, png_path):
-        pdf = pdfplumber.open(pdf_path)
-        pdf.pages[0].to_image(resolution=600).save(png_path)
-
-def get_summary(pdf_name : str) -> pd.DataFrame :
-    #assuming first page is summary
-    tables = camelot.read_pdf(pdf_name,
-                              pages="1",
-                              backend=SBCConversionBackend(),
-                              flavor="lattice")
-    summary_df = tables[0].df
-    summary_df = summary_df.tail(-1)
-    summary_df.columns= ["Questions","Answer","Why this matters"] 
-    return summary_df
-
-def format_coverage_page(page_df:pd.DataFrame,skip_lines:int) -> pd.DataFrame :
-    if len(page_df.columns) == 5:
-        page_df.columns= ["Medical Event","Service","In Network Amount","Out of Network Amount", "Limitations,Exceptions and Important Information"] 
-        page_df=page_df.mask(page_df == '')
-        page_df=page_df.fillna(method='ffill')
-        return page_df
-    else:
-        return None
-
-def get_coverage(pdf_name : str, summary_page = True) -> pd.DataFrame :
-    
-    #There are custom processing that is needed for each PDF
-    #In a production usecase, you would have algorithms detect each characteristic and process accordingly
-    #clien1 pdf has two header lines we need to skip
-    #client2 pdf has an extra example tables at the end we need to skip
-    skip_lines = 2 if "client1" in pdf_name else 1
-    skip_tables = 8 if "client2" in pdf_name else 2
-
-    tables = camelot.read_pdf(pdf_name,
-                              pages="2-end" if summary_page else "1-end",                              
-                              backend=SBCConversionBackend(),
-                              flavor="lattice")
-
-    page_df_list = [table.df for table in tables]
-    
-    #we also need to process the excluded services and other covered services differently
-    #we are ignoring them for this example
-    covered_services = page_df_list[: -skip_tables]
-
-    #format covered services
-    page_df = pd.concat([df.tail(-skip_lines) for df in covered_services])
-    page_df_formatted = format_coverage_page(page_df, skip_lines)
-    
-    return page_df_formatted
+# MAGIC %run ./utils/sbc_parsing
 
 # COMMAND ----------
 
@@ -151,50 +98,193 @@ display(get_coverage(pdf_name))
 # COMMAND ----------
 
 # MAGIC %md
-# MAGIC ##### Summarizing 
-# MAGIC Now we have the data in tabular form, we need to summarize each row into text and create a document. Then we will embed the document
+# MAGIC `get_summary` and `get_coverage` each call `camelot.read_pdf`, which opens the whole PDF again for every page it splits. `parse_sbc_pdf` does a single pass instead, opens the document once and renders each page once. Let us compare the wall time of both.
+
+# COMMAND ----------
+
+import time
+
+start_time = time.time()
+get_summary(pdf_name)
+get_coverage(pdf_name)
+two_pass_seconds = time.time() - start_time
+
+start_time = time.time()
+summary_df, coverage_df = parse_sbc_pdf(pdf_name)
+single_pass_seconds = time.time() - start_time
+
+print(f"Two pass: {two_pass_seconds:.2f} seconds, Single pass: {single_pass_seconds:.2f} seconds")
+display(coverage_df)
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC `SBCConversionBackend` caches the rendered pages on local disk, so parsing the same PDF again skips rendering. It also records the rendering time of each page and how much it raised the peak memory of the process.
+# MAGIC
+# MAGIC **NOTE:** Lower resolutions render much faster, but the ruling lines of some SBC formats are not detected reliably below 600 DPI. Verify the extracted tables before lowering `resolution` or setting `max_pixels` for a client.
+
+# COMMAND ----------
+
+backend = SBCConversionBackend(resolution=600)
+parse_sbc_pdf(pdf_name, backend)
+parse_sbc_pdf(pdf_name, backend)
+display(pd.DataFrame(backend.render_stats))
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC Many pages of an SBC do not have the covered services tables we need, like the excluded services, the coverage examples or plain prose. `prescreen_pages` classifies each page using only the text and ruling line objects from `pdfplumber`, which is much cheaper than rendering. `parse_sbc_pdf` then renders only the summary and the covered services pages. Let us see the pages rendered and the time saved for each SBC.
+
+# COMMAND ----------
+
+prescreen_stats = []
+for sbc_file_name in [f"{sbc_folder_path}/{sbc_file}" for sbc_file in sbc_files]:
+    page_types = prescreen_pages(sbc_file_name)
+
+    start_time = time.time()
+    _, all_pages_coverage_df = parse_sbc_pdf(sbc_file_name, SBCConversionBackend(cache_dir=tempfile.mkdtemp()), prescreen=False)
+    all_pages_seconds = time.time() - start_time
+
+    prescreen_backend = SBCConversionBackend(cache_dir=tempfile.mkdtemp())
+    start_time = time.time()
+    _, prescreen_coverage_df = parse_sbc_pdf(sbc_file_name, prescreen_backend, prescreen=True)
+    prescreen_seconds = time.time() - start_time
+
+    prescreen_stats.append({"sbc_file_name":sbc_file_name,
+                            "page_types":page_types,
+                            "pages":len(page_types),
+                            #counted by the backend, the pages it actually rendered
+                            "pages_rendered":prescreen_backend.pages_rendered,
+                            "seconds_saved":round(all_pages_seconds - prescreen_seconds, 2),
+                            "same_coverage":prescreen_coverage_df.equals(all_pages_coverage_df)})
+
+display(pd.DataFrame(prescreen_stats))
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC Lattice extraction is CPU bound, OpenCV line detection runs on a high resolution image of every page. On a multi-core driver, we can extract the pages in parallel processes. The tables are put back in page order before the coverage is formatted.
+
+# COMMAND ----------
+
+start_time = time.time()
+summary_df, parallel_coverage_df = parse_sbc_pdf(pdf_name, max_workers=None)
+parallel_seconds = time.time() - start_time
+
+print(f"Parallel: {parallel_seconds:.2f} seconds on {os.cpu_count()} cores")
+assert parallel_coverage_df.equals(coverage_df)
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ##### Raster free extraction with `pdfplumber`
+# MAGIC Our SBCs are text based PDFs and their ruling lines are vector objects. `PdfplumberEngine` builds the tables directly from those lines, so no page is rendered and OpenCV is not needed. Both engines return the same per page tables, so the rest of the pipeline does not change.
+# MAGIC
+# MAGIC Before switching a client to `pdfplumber`, we check the parity of the chunks with the camelot output. The chunk text is compared after normalizing the whitespace, the same way the chunk `id` is computed.
+
+# COMMAND ----------
+
+def normalize_chunk(text : str) -> str :
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+def get_engine_parity(pdf_name : str, reference_engine, candidate_engine) -> dict :
+    start_time = time.time()
+    reference_documents = pdf_to_document(pdf_name, engine=reference_engine)
+    reference_seconds = time.time() - start_time
+
+    start_time = time.time()
+    candidate_documents = pdf_to_document(pdf_name, engine=candidate_engine)
+    candidate_seconds = time.time() - start_time
+
+    reference_chunks = set(normalize_chunk(d) for d in reference_documents)
+    candidate_chunks = set(normalize_chunk(d) for d in candidate_documents)
+    return {"sbc_file_name":pdf_name,
+            "reference_engine":reference_engine.name,
+            "candidate_engine":candidate_engine.name,
+            "reference_seconds":round(reference_seconds, 2),
+            "candidate_seconds":round(candidate_seconds, 2),
+            "reference_chunks":len(reference_documents),
+            "candidate_chunks":len(candidate_documents),
+            "matching_chunks":len(reference_chunks & candidate_chunks),
+            "parity":round(len(reference_chunks & candidate_chunks) / max(1, len(reference_chunks | candidate_chunks)), 3),
+            "missing_chunks":sorted(reference_chunks - candidate_chunks),
+            "extra_chunks":sorted(candidate_chunks - reference_chunks)}
+
+engine_parity_df = pd.DataFrame([get_engine_parity(f"{sbc_folder_path}/{sbc_file}", CamelotLatticeEngine(), PdfplumberEngine()) 
+                                 for sbc_file in sbc_files])
+display(engine_parity_df)
 
 # COMMAND ----------
 
-from pyspark.sql.types import ArrayType, StringType
+# MAGIC %md
+# MAGIC The chunks that differ are worth a review, they are not always extraction errors of `pdfplumber`. Camelot can merge the text of adjacent cells when the ruling lines of a page are not detected reliably on the rendered image.
+# MAGIC
+# MAGIC The engine is selected per client. Switch a client to `pdfplumber` once its parity has been reviewed.
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ##### Cache the extracted tables
+# MAGIC While we iterate on the summarization and chunking, the PDFs do not change and there is no need to extract the tables again. `CachedExtractionEngine` persists the raw tables of each page as Parquet files in the volume, keyed by the PDF content hash, the engine and its settings. Later runs load the tables from the cache and go straight to summarization and chunking. Changing the engine settings (or the engine library version) creates a new cache key, so stale tables are never used.
 
-def clean(text):
-    return str(text).replace('\n','')
+# COMMAND ----------
 
-def summarize_summary_row(row):
-    return f" {clean(row['Questions'])}\n Answer is {clean(row['Answer'])}. Why it matters to you is because {clean(row['Why this matters'])}"
+sbc_table_cache_path = f"{sbc_folder_path}/table_cache"
 
-def get_extra_coverage_info(row):
-    extra = clean(row['Limitations,Exceptions and Important Information'])
-    return f"Also {extra}" if "none" not in extra.lower() else ""
+cached_engine = CachedExtractionEngine(CamelotLatticeEngine(), sbc_table_cache_path)
+parse_sbc_pdf(pdf_name, engine=cached_engine)
+parse_sbc_pdf(pdf_name, engine=cached_engine)
+display(pd.DataFrame(cached_engine.cache_stats))
 
-def summarize_coverage_row(row):
-    return f" {clean(row['Medical Event'])}, for {clean(row['Service'])} you will pay {clean(row['In Network Amount']) } In Network and {clean(row['Out of Network Amount'])} Out of Network. {get_extra_coverage_info(row)}"
+# COMMAND ----------
 
-def summary_to_document(summary_df):
-    return summary_df.apply(summarize_summary_row, axis=1).values.tolist()
+# MAGIC %md
+# MAGIC ##### Summarizing 
+# MAGIC Now we have the data in tabular form, we need to summarize each row into text and create a document. Then we will embed the document
+# MAGIC
+# MAGIC `summary_to_document` and `coverage_to_document` from `./utils/sbc_parsing` convert each row of the summary and coverage tables to a text chunk.
 
-def coverage_to_document(coverage_df):
-    return coverage_df.apply(summarize_coverage_row, axis=1).values.tolist()
+# COMMAND ----------
 
-@udf(returnType=ArrayType(StringType()))
-def pdf_to_document(pdf_file):
-    summary_df = get_summary(pdf_file)
-    coverage_df = get_coverage(pdf_file)
-    return summary_to_document(summary_df) + coverage_to_document(coverage_df)
+def ingest_sbc_partition(pdf_iterator):
+    """
+    `mapInPandas` function that parses the SBC files of a partition and streams out one row per chunk.
+    The extraction engines (and the page cache of the rendering backend) are initialized once per task and reused for all the files.
+    Each file is parsed with the engine named in its `extraction_engine` column, and the extracted tables are cached in `sbc_table_cache_path`.
+    """
+    engines = {CamelotLatticeEngine.name:CachedExtractionEngine(CamelotLatticeEngine(SBCConversionBackend()), sbc_table_cache_path),
+               PdfplumberEngine.name:CachedExtractionEngine(PdfplumberEngine(), sbc_table_cache_path)}
+    for pdf in pdf_iterator:
+        for client, sbc_file_name, engine_name in zip(pdf["client"], pdf["sbc_file_name"], pdf["extraction_engine"]):
+            documents = pdf_to_document(sbc_file_name, engine=engines[engine_name])
+            yield pd.DataFrame({"client":[client] * len(documents), "content":documents})
 
 
 # COMMAND ----------
 
+import json
 import pandas as pd
 
 doc_list = [f"{sbc_folder_path}/{sbc_files[0]}",f"{sbc_folder_path}/{sbc_files[1]}"]
 
+#table extraction engine of each client, camelot or pdfplumber
+sbc_extraction_engines = {client_names[0] : CamelotLatticeEngine.name,
+                          client_names[1] : CamelotLatticeEngine.name}
+
 pd_sbc_details = pd.DataFrame({
         "client" : client_names, 
-        "sbc_file_name": doc_list
+        "sbc_file_name": doc_list,
+        "extraction_engine": [sbc_extraction_engines[client] for client in client_names]
     })
 
+unknown_engines = set(pd_sbc_details["extraction_engine"]) - set(extraction_engines.keys())
+if len(unknown_engines) > 0:
+    raise ValueError(f"Unknown extraction engines {unknown_engines}. Available engines are {list(extraction_engines.keys())}")
+
+#settings of the engine as it is created in `ingest_sbc_partition`, so that a change of engine or of its settings re-ingests the file
+pd_sbc_details["extraction_engine_settings"] = pd_sbc_details["extraction_engine"].apply(
+    lambda engine_name: json.dumps(extraction_engines[engine_name]().get_settings(), sort_keys=True, default=str))
+
 
 # COMMAND ----------
 
@@ -202,37 +292,106 @@ display(pd_sbc_details)
 
 # COMMAND ----------
 
+# MAGIC %md
+# MAGIC ###Find the changed SBC files
+# MAGIC Rather than parsing every document on each run, we keep track of the content hash of each SBC file, along with the extraction engine and its settings, in the `sbc_source_files` table. Only the files that are new, whose content changed or whose client switched to another engine or engine settings since the last run are parsed again.
+
+# COMMAND ----------
+
+spark.sql(f"""CREATE TABLE IF NOT EXISTS {catalog}.{schema}.{sbc_source_files_table_name} 
+              (sbc_file_name STRING, client STRING, content_hash STRING, extraction_engine STRING, extraction_engine_settings STRING, ingested_at TIMESTAMP)""")
+
+#tables created before the engine was recorded, their files are ingested again once
+if "extraction_engine" not in spark.table(f"{catalog}.{schema}.{sbc_source_files_table_name}").columns:
+    spark.sql(f"ALTER TABLE {catalog}.{schema}.{sbc_source_files_table_name} ADD COLUMNS (extraction_engine STRING, extraction_engine_settings STRING)")
+
+pd_sbc_details["content_hash"] = pd_sbc_details["sbc_file_name"].apply(get_file_hash)
+
+change_detection_columns = ["sbc_file_name","content_hash","extraction_engine","extraction_engine_settings"]
+
+ingested_hashes = (spark
+                   .table(f"{catalog}.{schema}.{sbc_source_files_table_name}")
+                   .select(*change_detection_columns)
+                   .toPandas())
+
+#set to True to chunk all the files again, eg: after changing the summarization. The tables are loaded from the table cache
+rechunk_all_files = False
+
+if rechunk_all_files:
+    pd_changed_sbc_details = pd_sbc_details.copy()
+else:
+    pd_changed_sbc_details = pd_sbc_details.merge(ingested_hashes, on=change_detection_columns, how="left", indicator=True)
+    pd_changed_sbc_details = pd_changed_sbc_details[pd_changed_sbc_details["_merge"] == "left_only"].drop(columns="_merge")
+
+display(pd_changed_sbc_details)
+
+# COMMAND ----------
+
 # MAGIC %md
 # MAGIC Using Spark to load and chunk the PDF documents for scalability
+# MAGIC
+# MAGIC The SBC files are distributed across the executors, one file per partition up to the cluster parallelism, and parsed with `mapInPandas`. 
+# MAGIC
+# MAGIC The `id` of each chunk is derived from the client and the normalized chunk text. So an unchanged chunk keeps the same id when a document is parsed again, and the vector index only needs to embed the chunks that actually changed.
 
 # COMMAND ----------
 
-from pyspark.sql.functions import explode, array, monotonically_increasing_id
+from pyspark.sql.functions import xxhash64, lower, trim, regexp_replace
+
+num_partitions = max(1, min(len(pd_changed_sbc_details), spark.sparkContext.defaultParallelism))
 
-sbc_details = (spark
-               .createDataFrame(pd_sbc_details)               
-               .withColumn("content",pdf_to_document("sbc_file_name"))
-               .select("client", explode("content").alias("content"))
-               .repartition(1)
-               .withColumn("id", monotonically_increasing_id())
+changed_sbc_details = (spark
+               .createDataFrame(pd_changed_sbc_details[["client","sbc_file_name","extraction_engine"]], schema="client string, sbc_file_name string, extraction_engine string")
+               .repartition(num_partitions)
+               .mapInPandas(ingest_sbc_partition, schema="client string, content string")
+               .withColumn("id", xxhash64("client", lower(trim(regexp_replace("content", r"\s+", " ")))))
+               .dropDuplicates(["id"])
                .select("id","client","content")
 
 )
 
 # COMMAND ----------
 
-display(sbc_details)
+display(changed_sbc_details)
 
 # COMMAND ----------
 
 # MAGIC %md
 # MAGIC ###Save the SBC data to a Delta table in Unity Catalog
+# MAGIC The chunks of the changed documents are upserted with a `MERGE`. Chunks that no longer exist in a changed document are deleted, and the chunks of the other clients are left untouched. Change Data Feed is enabled so that the Delta Sync vector index only re-embeds the changed rows.
 
 # COMMAND ----------
 
-spark.sql(f"DROP TABLE IF EXISTS {catalog}.{schema}.{sbc_details_table_name}")
-sbc_details.write.mode("overwrite").saveAsTable(f"{catalog}.{schema}.{sbc_details_table_name}")
+from delta.tables import DeltaTable
+from pyspark.sql.functions import col, current_timestamp
+
+spark.sql(f"""CREATE TABLE IF NOT EXISTS {catalog}.{schema}.{sbc_details_table_name} 
+              (id BIGINT, client STRING, content STRING) 
+              TBLPROPERTIES (delta.enableChangeDataFeed = true)""")
+
+changed_clients = pd_changed_sbc_details["client"].unique().tolist()
+
+if len(changed_clients) > 0:
+    (DeltaTable.forName(spark, f"{catalog}.{schema}.{sbc_details_table_name}").alias("t")
+        .merge(changed_sbc_details.alias("s"), "t.id = s.id")
+        .whenMatchedUpdate(condition="t.content <> s.content", set={"content":"s.content"})
+        .whenNotMatchedInsertAll()
+        .whenNotMatchedBySourceDelete(condition=col("t.client").isin(changed_clients))
+        .execute())
+
+    #record the hashes and the extraction engines of the ingested files
+    ingested_files = (spark
+                      .createDataFrame(pd_changed_sbc_details[["sbc_file_name","client","content_hash","extraction_engine","extraction_engine_settings"]])
+                      .withColumn("ingested_at", current_timestamp()))
+    
+    (DeltaTable.forName(spark, f"{catalog}.{schema}.{sbc_source_files_table_name}").alias("t")
+        .merge(ingested_files.alias("s"), "t.sbc_file_name = s.sbc_file_name")
+        .whenMatchedUpdateAll()
+        .whenNotMatchedInsertAll()
+        .execute())
+else:
+    print("No SBC files changed since the last run.")
 
 # COMMAND ----------
 
-display(spark.table(f"{catalog}.{schema}.{sbc_details_table_name}"))
+display(spark.table(f"{catalog}.{schema}.{sbc_details_table_name}"))
\ No newline at end of file
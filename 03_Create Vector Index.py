@@ -29,6 +29,10 @@
 
 # COMMAND ----------
 
+# MAGIC %run ./utils/index_sync
+
+# COMMAND ----------
+
 # MAGIC %md
 # MAGIC ####Create a Vector Search endpoint
 # MAGIC vector Search Endpoint serves the vector search index. You can query and update the endpoint using the REST API or the SDK. Endpoints scale automatically to support the size of the index or the number of concurrent requests. See [Create a vector search endpoint](https://docs.databricks.com/en/generative-ai/create-query-vector-search.html#create-a-vector-search-endpoint) for instructions.
@@ -66,6 +70,7 @@ cpt_vector_index_name = f"{cpt_source_data_table}_index"
 from databricks.vector_search.client import VectorSearchClient
 from datetime import timedelta
 import time
+import pandas as pd
 #create the vector search endpoint if it does not exist
 #same endpoint can be used to serve both the indexes
 vsc = VectorSearchClient(disable_notice=True)
@@ -199,6 +204,81 @@ except Exception as e:
 
 # COMMAND ----------
 
+# MAGIC %md
+# MAGIC #### (Optional) Indexes with Self Managed Embeddings
+# MAGIC With `embedding_model_endpoint_name`, the sync pipeline embeds the rows for us and we have no control over how the embedding requests are batched. As the CPT catalog and the number of SBC documents grow, a full rebuild becomes slow.
+# MAGIC
+# MAGIC Alternatively, we can compute the embeddings ourselves with Spark `mapInPandas`. Each partition sends large batches of text in the `input` list of the `databricks-bge-large-en` endpoint with bounded concurrency and retries, and writes the vectors to an `embedding` column. The index then uses the `embedding` column as a self managed embedding column.
+# MAGIC
+# MAGIC After the first run, only the rows that are new or changed in the source table since the last run are embedded, read from its change data feed and merged into the embeddings table, so that the sync of the index only re-embeds those rows too.
+# MAGIC
+# MAGIC **NOTE:** Indexes with self managed embeddings are queried with a `query_vector`. Set `query_embedding_endpoint_name` in the `RetrieverConfig` of the agent to `databricks-bge-large-en` and point `vector_index_name` to these indexes to use them.
+
+# COMMAND ----------
+
+# MAGIC %run ./utils/embedding_utils
+
+# COMMAND ----------
+
+create_self_managed_indexes = False
+
+sbc_embeddings_table = f"{sbc_source_data_table}_embeddings"
+sbc_embeddings_vector_index_name = f"{sbc_embeddings_table}_index"
+cpt_embeddings_table = f"{cpt_source_data_table}_embeddings"
+cpt_embeddings_vector_index_name = f"{cpt_embeddings_table}_index"
+
+if create_self_managed_indexes:
+    embedding_stats = [
+        create_embeddings_table(sbc_source_data_table, sbc_source_data_table_text_field, sbc_embeddings_table,
+                                db_host_url, db_token, embedding_endpoint_name, id_column=sbc_source_data_table_id_field),
+        create_embeddings_table(cpt_source_data_table, cpt_source_data_table_text_field, cpt_embeddings_table,
+                                db_host_url, db_token, embedding_endpoint_name, id_column=cpt_source_data_table_id_field)
+    ]
+    #rows embedded and deleted by this run, and the throughput of the embedding job in rows per second
+    display(pd.DataFrame(embedding_stats))
+
+# COMMAND ----------
+
+if create_self_managed_indexes:
+    for embeddings_table, embeddings_index_name, id_field in [
+            (sbc_embeddings_table, sbc_embeddings_vector_index_name, sbc_source_data_table_id_field),
+            (cpt_embeddings_table, cpt_embeddings_vector_index_name, cpt_source_data_table_id_field)]:
+        try:
+            vsc.create_delta_sync_index_and_wait(
+                endpoint_name=vector_search_endpoint_name,
+                index_name=embeddings_index_name,
+                source_table_name=embeddings_table,
+                primary_key=id_field,
+                embedding_dimension=embedding_dimension,
+                embedding_vector_column=embedding_column,
+                pipeline_type="TRIGGERED",
+                verbose=True
+            )
+        except Exception as e:
+            if "already exists" in str(e):
+                print(f"Index named {embeddings_index_name} already exists.")
+            else:
+                raise e
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ##### Per Client Benefit Shards
+# MAGIC The benefit retriever always searches the SBC index with a `client` filter. As more employer clients are onboarded, this filtered search over a single shared index gets slower.
+# MAGIC
+# MAGIC We can export the SBC chunk embeddings as one shard file per client. The agent loads a client shard on demand into memory, keeps the recently used shards under a memory budget and searches them locally. The vector index is still used when there is no shard for a client.
+# MAGIC
+# MAGIC To use the shards, set `shard_path` in the benefit `RetrieverConfig` of the agent (see `sbc_details_shard_path` in `get_model_config` of the `07_Deploy the Agent` notebook). The shard files are packaged with the model as artifacts.
+
+# COMMAND ----------
+
+sbc_shard_path = f"{sbc_folder_path}/shards"
+
+if create_self_managed_indexes:
+    display(export_client_shards(sbc_embeddings_table, "client", [sbc_source_data_table_id_field, sbc_source_data_table_text_field], sbc_shard_path))
+
+# COMMAND ----------
+
 # MAGIC %md
 # MAGIC #### Quick Test of Indexes
 
@@ -231,4 +311,32 @@ else:
 
 # COMMAND ----------
 
+# MAGIC %md
+# MAGIC #### Keep the Indexes in Sync
+# MAGIC Since our indexes use the `TRIGGERED` sync mode, the index is not updated when the source tables change. Rather than syncing blindly, we sync an index only when its source table has new commits in the Delta log. This avoids paying for embeddings when nothing changed.
+# MAGIC
+# MAGIC `sync_index_if_changed` compares the Delta version of the source table with the last commit version processed by the index, triggers `index.sync()` only if there are new commits and waits with backoff for the sync to finish. Each run is recorded in the `vector_index_sync_log` table with the sync duration and the number of rows re-embedded (counted from the change data feed).
+# MAGIC
+# MAGIC **NOTE:** Schedule this section as a Databricks Job to bound the staleness of the indexes. Staleness is at most the job interval plus the sync duration.
+
+# COMMAND ----------
+
+sync_results = [
+    sync_index_if_changed(vsc, vector_search_endpoint_name, sbc_vector_index_name, sbc_source_data_table),
+    sync_index_if_changed(vsc, vector_search_endpoint_name, cpt_vector_index_name, cpt_source_data_table)
+]
+
+if create_self_managed_indexes:
+    sync_results += [
+        sync_index_if_changed(vsc, vector_search_endpoint_name, sbc_embeddings_vector_index_name, sbc_embeddings_table),
+        sync_index_if_changed(vsc, vector_search_endpoint_name, cpt_embeddings_vector_index_name, cpt_embeddings_table)
+    ]
+
+display(pd.DataFrame(sync_results))
+
+# COMMAND ----------
+
+display(spark.table(f"{catalog}.{schema}.{index_sync_log_table_name}").orderBy("synced_at", ascending=False))
+
+# COMMAND ----------
 
@@ -21,58 +21,72 @@
 # COMMAND ----------
 
 # MAGIC %md
-# MAGIC ###### Online table for `member_enrolment`
+# MAGIC ###### Online tables and feature serving endpoints for `member_enrolment`, `procedure_cost` and `member_accumulators`
+# MAGIC All the online tables, feature specs and endpoints are created concurrently. The cell then waits until every online table has synced and every endpoint is ready, and shows the time to ready of each resource.
 
 # COMMAND ----------
 
-create_online_table(f"{catalog}.{schema}.{member_table_name}", ["member_id"])
-create_feature_serving(f"{catalog}.{schema}.{member_table_name}", ["member_id"])
+online_lookup_tables = [
+    (f"{catalog}.{schema}.{member_table_name}", ["member_id"]),
+    (f"{catalog}.{schema}.{procedure_cost_table_name}", ["procedure_code"]),
+    (f"{catalog}.{schema}.{member_accumulators_table_name}", ["member_id"])
+]
+
+display(provision_online_lookups(online_lookup_tables))
 
 # COMMAND ----------
 
 # MAGIC %md
-# MAGIC ###### Online table for  `procedure_cost`
+# MAGIC ##NOTE Online table endpoints takes few minutes to be provisioned and available.
+# MAGIC The cell above returns only when all the endpoints are serving. You can also check the status in `Serving` page as below
+# MAGIC
+# MAGIC <img src="https://raw.githubusercontent.com/databricks-industry-solutions/CareCost-Compass/refs/heads/main/resources/online_endpoint.png" width="800" />
 
 # COMMAND ----------
 
-create_online_table(f"{catalog}.{schema}.{procedure_cost_table_name}", ["procedure_code"])
-create_feature_serving(f"{catalog}.{schema}.{procedure_cost_table_name}",["procedure_code"])
+# MAGIC %md
+# MAGIC ######Query the endpoints to test
 
 # COMMAND ----------
 
-# MAGIC %md
-# MAGIC ###### Online table for `member_accumulators` 
+get_data_from_online_table(f"{catalog}.{schema}.{member_table_name}", {"member_id":"1234"})
 
 # COMMAND ----------
 
-create_online_table(f"{catalog}.{schema}.{member_accumulators_table_name}", ["member_id"])
-create_feature_serving(f"{catalog}.{schema}.{member_accumulators_table_name}", ["member_id"])
+get_data_from_online_table(f"{catalog}.{schema}.{procedure_cost_table_name}", {"procedure_code":"23920"})
 
 # COMMAND ----------
 
-# MAGIC %md
-# MAGIC ##NOTE Online table endpoints takes few minutes to be provisioned and available.
-# MAGIC Please make sure that the endpoints are ready before proceeding further, by check the status in `Serving` page as below
-# MAGIC
-# MAGIC <img src="https://raw.githubusercontent.com/databricks-industry-solutions/CareCost-Compass/refs/heads/main/resources/online_endpoint.png" width="800" />
+get_data_from_online_table(f"{catalog}.{schema}.{member_accumulators_table_name}", {"member_id":"1234"})
 
 # COMMAND ----------
 
 # MAGIC %md
-# MAGIC ######Query the endpoints to test
+# MAGIC ###Offline snapshots for cold endpoints
+# MAGIC The feature serving endpoints scale to zero, so the first lookup after an idle period can take many seconds.
+# MAGIC The agent can answer the lookups from a Parquet snapshot of the same tables while the endpoint wakes up. Each snapshot records the Delta version it was taken from, which the agent reports as the freshness of the answer.
+# MAGIC
+# MAGIC To use the snapshots, set `lookup_snapshot_path` in `get_model_config` of the `07_Deploy the Agent` notebook. Re-run this cell after the tables change to refresh them.
 
 # COMMAND ----------
 
-get_data_from_online_table(f"{catalog}.{schema}.{member_table_name}", {"member_id":"1234"})
+import pandas as pd
 
-# COMMAND ----------
+lookup_snapshot_path = f"{sbc_folder_path}/lookup_snapshots"
 
-get_data_from_online_table(f"{catalog}.{schema}.{procedure_cost_table_name}", {"procedure_code":"23920"})
+display(pd.DataFrame([export_lookup_snapshot(f"{catalog}.{schema}.{t}", lookup_snapshot_path)
+                      for t in [member_table_name, procedure_cost_table_name, member_accumulators_table_name]]))
 
 # COMMAND ----------
 
-get_data_from_online_table(f"{catalog}.{schema}.{member_accumulators_table_name}", {"member_id":"1234"})
+# MAGIC %md
+# MAGIC The same snapshots, with `sbc_details` and `cpt_codes` for the vector indexes, back the local stand-ins of the endpoints in `scripts/local_standins.py`. 
+# MAGIC Set `export_local_standin_snapshots` to export them, then download the `lookup_snapshots` folder from the volume to run the agent off-platform.
 
 # COMMAND ----------
 
+export_local_standin_snapshots = False
 
+if export_local_standin_snapshots:
+    display(pd.DataFrame([export_lookup_snapshot(f"{catalog}.{schema}.{t}", lookup_snapshot_path)
+                          for t in [sbc_details_table_name, cpt_code_table_name]]))
@@ -49,10 +49,18 @@
 import mlflow
 import mlflow.deployments
 import os
+import time
+import threading
+import numpy as np
 import pandas as pd
 import requests
 import json
 
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
 from typing import Optional, Type, List, Union
 
 from pydantic import BaseModel, Field
@@ -100,6 +108,12 @@ class RetrieverConfig(BaseModel):
     vector_index_name:str
     vector_index_id_column:str
     retrieve_columns:List[str]
+    #set for indexes with self managed embeddings, the query text is embedded using this endpoint
+    query_embedding_endpoint_name:Optional[str] = None
+    #folder with per client shard files, if set the shards are searched locally before the vector index
+    shard_path:Optional[str] = None
+    shard_memory_budget_mb:int = 256
+    shard_embedding_endpoint_name:str = "databricks-bge-large-en"
 
 def build_api_chain(model_endpoint_name, prompt_template, qa_chain=False, max_tokens=500, temperature=0.01):
     client = mlflow.deployments.get_deploy_client("databricks")
@@ -132,19 +146,281 @@ def build_api_chain(model_endpoint_name, prompt_template, qa_chain=False, max_to
       raise Exception(f"Endpoint {model_endpoint_name} not available ")
 
 
-def get_data_from_online_table(fq_table_name, query_object):
+def get_query_embedding(embedding_endpoint_name:str, query_text:str) -> List[float]:
+    client = mlflow.deployments.get_deploy_client("databricks")
+    response = client.predict(endpoint=embedding_endpoint_name,
+                              inputs={"input": [query_text]})
+    return response["data"][0]["embedding"]
+
+def get_query_search_args(retriever_config:RetrieverConfig, query_text:str) -> dict:
+    """Returns query_text for managed embedding indexes and query_vector for self managed embedding indexes"""
+    if retriever_config.query_embedding_endpoint_name is None:
+        return {"query_text": query_text}
+    return {"query_vector": get_query_embedding(retriever_config.query_embedding_endpoint_name, query_text)}
+
+
+class EndpointEnvironment():
+    """
+    Points the Databricks clients at `host`, for eg: the local stand-ins of the endpoints, inside `scope()` and restores the previous
+    `DATABRICKS_HOST` and `DATABRICKS_TOKEN` when the block exits. The deployments client, the LangChain endpoints and the vector search client
+    read the workspace from the environment, so the override only lasts while the agent is loading or answering.
+    Concurrent blocks share the override, and the environment is restored when the last of them exits.
+    With `host` None, `scope()` does nothing.
+    """
+    def __init__(self, host:str=None, token:str=None):
+        self.environment = {"DATABRICKS_HOST":host, "DATABRICKS_TOKEN":token}
+        self.lock = threading.Lock()
+        self.active_scopes = 0
+        self.saved_environment = None
+
+    @contextmanager
+    def scope(self):
+        if self.environment["DATABRICKS_HOST"] is None:
+            yield
+            return
+        with self.lock:
+            if self.active_scopes == 0:
+                self.saved_environment = {k:os.environ.get(k) for k in self.environment.keys()}
+                os.environ.update(self.environment)
+            self.active_scopes += 1
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.active_scopes -= 1
+                if self.active_scopes == 0:
+                    for k, v in self.saved_environment.items():
+                        if v is None:
+                            os.environ.pop(k, None)
+                        else:
+                            os.environ[k] = v
+
+
+class HedgedRequester():
+    """
+    Sends a duplicate of a request when no response has arrived within the rolling p95 latency and returns the first response.
+    The late request is cancelled if it has not started, otherwise its response is discarded.
+    Duplicates are capped at `hedge_budget_percent` of the requests, and no request is hedged until `min_samples` latencies are recorded.
+    """
+    def __init__(self, hedge_budget_percent:float=5.0, latency_window:int=200, min_samples:int=20, max_workers:int=8):
+        self.hedge_budget_percent = hedge_budget_percent
+        self.min_samples = min_samples
+        self.latencies_ms = deque(maxlen=latency_window)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hedged_request")
+        self.lock = threading.Lock()
+        self.metrics = {"requests":0, "hedged":0, "hedge_wins":0, "budget_exhausted":0, "errors":0}
+
+    def get_hedge_delay_ms(self) -> float:
+        """Rolling p95 latency or None while there are too few samples"""
+        with self.lock:
+            if len(self.latencies_ms) < self.min_samples:
+                return None
+            return float(np.percentile(self.latencies_ms, 95))
+
+    def __take_hedge_budget(self) -> bool:
+        with self.lock:
+            if (self.metrics["hedged"] + 1) * 100 > self.metrics["requests"] * self.hedge_budget_percent:
+                self.metrics["budget_exhausted"] += 1
+                return False
+            self.metrics["hedged"] += 1
+            return True
+
+    def __timed_request(self, request_fn, started:threading.Event=None):
+        start_time = time.time()
+        if started is not None:
+            started.set()
+        response = request_fn()
+        #every completed request updates the window, including the ones whose response is discarded
+        with self.lock:
+            self.latencies_ms.append((time.time() - start_time) * 1000)
+        return response
+
+    def call(self, request_fn):
+        with self.lock:
+            self.metrics["requests"] += 1
+        hedge_delay_ms = self.get_hedge_delay_ms()
+
+        primary_started = threading.Event()
+        primary = self.executor.submit(self.__timed_request, request_fn, primary_started)
+        hedge = None
+        if hedge_delay_ms is not None:
+            #the delay counts from when the request starts, the time queued behind other requests in the pool is not latency of the endpoint
+            primary_started.wait()
+            done, _ = wait([primary], timeout=hedge_delay_ms / 1000)
+            if len(done) == 0 and self.__take_hedge_budget():
+                hedge = self.executor.submit(self.__timed_request, request_fn)
+
+        pending = [f for f in [primary, hedge] if f is not None]
+        while True:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            #both requests can complete in the same wait, prefer a successful response and then the primary
+            winner = sorted(done, key=lambda f: (f.exception() is not None, f is not primary))[0]
+            #if the first response is an error, wait for the other request
+            if winner.exception() is None or len(pending) == 0:
+                break
+        for f in pending:
+            f.cancel()
+
+        with self.lock:
+            if winner is hedge:
+                self.metrics["hedge_wins"] += 1
+            if winner.exception() is not None:
+                self.metrics["errors"] += 1
+        return winner.result()
+
+    def get_metrics(self) -> dict:
+        hedge_delay_ms = self.get_hedge_delay_ms()
+        with self.lock:
+            metrics = dict(self.metrics)
+        metrics["hedge_percent"] = round(metrics["hedged"] * 100 / metrics["requests"], 2) if metrics["requests"] > 0 else 0.0
+        metrics["hedge_delay_ms"] = round(hedge_delay_ms, 1) if hedge_delay_ms is not None else None
+        return metrics
+
+
+class OfflineLookupBackend():
+    """
+    Answers the online table lookups from an offline copy of the Delta tables when the feature serving endpoint
+    does not respond within `latency_budget_ms`, for eg: while it is scaling up from zero.
+    The copy is either a Parquet snapshot of each table, `<snapshot_path>/<table_name>` with its Delta version in `<snapshot_path>/<table_name>.json`,
+    or a SQL statement on the `warehouse_id` SQL warehouse. The snapshot is tried first.
+    The online request is not cancelled, so that the endpoint keeps warming up.
+    Each response is tagged with a `data_freshness` that tells where the row came from and as of when.
+    """
+    def __init__(self, latency_budget_ms:float=2000, snapshot_path:str=None, warehouse_id:str=None, max_workers:int=8):
+        self.latency_budget_ms = latency_budget_ms
+        self.snapshot_path = snapshot_path
+        self.warehouse_id = warehouse_id
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="online_lookup")
+        self.snapshots = {}
+        self.lock = threading.Lock()
+        self.metrics = {}
+
+    def __count(self, fq_table_name:str, metric:str):
+        with self.lock:
+            table_metrics = self.metrics.setdefault(fq_table_name, {"requests":0, "online":0, "snapshot":0, "warehouse":0, "fallback_misses":0, "online_errors":0})
+            table_metrics[metric] += 1
+
+    def __load_snapshot(self, fq_table_name:str, key_columns:[str]) -> dict:
+        table_name = fq_table_name.split(".")[-1]
+        snapshot_dir = os.path.join(self.snapshot_path, table_name)
+        if not os.path.exists(snapshot_dir):
+            return None
+        with open(f"{snapshot_dir}.json", "r") as f:
+            snapshot_info = json.load(f)
+        rows = pd.read_parquet(snapshot_dir).set_index(key_columns, drop=False)
+        return {"rows":rows, "as_of":snapshot_info["as_of"], "delta_version":snapshot_info["delta_version"]}
+
+    def __get_snapshot(self, fq_table_name:str, key_columns:[str]) -> dict:
+        #snapshots are loaded on first use and kept, they hold the same tables as the online tables
+        with self.lock:
+            if fq_table_name in self.snapshots:
+                return self.snapshots[fq_table_name]
+        snapshot = self.__load_snapshot(fq_table_name, key_columns)
+        with self.lock:
+            self.snapshots[fq_table_name] = snapshot
+        return snapshot
+
+    def lookup_snapshot(self, fq_table_name:str, query_object:dict) -> dict:
+        if self.snapshot_path is None:
+            return None
+        key_columns = list(query_object.keys())
+        snapshot = self.__get_snapshot(fq_table_name, key_columns)
+        if snapshot is None:
+            return None
+        key = tuple(query_object[k] for k in key_columns)
+        try:
+            row = snapshot["rows"].loc[key if len(key) > 1 else key[0]]
+        except KeyError:
+            return None
+        if isinstance(row, pd.DataFrame):
+            row = row.iloc[0]
+        output = {k:(None if pd.isna(v) else v.item() if hasattr(v, "item") else v) for k, v in row.items()}
+        return {"outputs":[output],
+                "data_freshness":{"source":"snapshot", "as_of":snapshot["as_of"], "delta_version":snapshot["delta_version"]}}
+
+    def lookup_warehouse(self, fq_table_name:str, query_object:dict) -> dict:
+        if self.warehouse_id is None:
+            return None
+        from databricks.sdk import WorkspaceClient
+        from databricks.sdk.service.sql import StatementParameterListItem, StatementState
+        where_clause = " AND ".join([f"{k} = :{k}" for k in query_object.keys()])
+        response = WorkspaceClient().statement_execution.execute_statement(
+            statement=f"SELECT * FROM {fq_table_name} WHERE {where_clause} LIMIT 1",
+            warehouse_id=self.warehouse_id,
+            parameters=[StatementParameterListItem(name=k, value=str(v)) for k, v in query_object.items()],
+            wait_timeout="30s")
+        if response.status.state != StatementState.SUCCEEDED:
+            raise Exception(f"Statement on warehouse {self.warehouse_id} failed with {response.status.state}, {response.status.error}")
+        if response.result is None or not response.result.data_array:
+            return None
+        #the values are returned as strings
+        numeric_types = ["BYTE", "SHORT", "INT", "LONG", "FLOAT", "DOUBLE", "DECIMAL"]
+        output = {c.name:(float(v) if v is not None and c.type_name.value in numeric_types else v)
+                  for c, v in zip(response.manifest.schema.columns, response.result.data_array[0])}
+        return {"outputs":[output],
+                "data_freshness":{"source":"warehouse", "as_of":datetime.now(timezone.utc).isoformat(timespec="seconds"), "delta_version":None}}
+
+    def call(self, fq_table_name:str, query_object:dict, request_fn) -> dict:
+        self.__count(fq_table_name, "requests")
+        online_request = self.executor.submit(request_fn)
+        done, _ = wait([online_request], timeout=self.latency_budget_ms / 1000)
+        if len(done) > 0 and online_request.exception() is None:
+            self.__count(fq_table_name, "online")
+            return {**online_request.result(), "data_freshness":{"source":"online", "as_of":None, "delta_version":None}}
+        if len(done) > 0:
+            self.__count(fq_table_name, "online_errors")
+
+        for source, lookup_fn in [("snapshot", self.lookup_snapshot), ("warehouse", self.lookup_warehouse)]:
+            try:
+                response = lookup_fn(fq_table_name, query_object)
+            except Exception as e:
+                log_print(f"{source} lookup of {fq_table_name} failed: {e}")
+                response = None
+            if response is not None:
+                self.__count(fq_table_name, source)
+                return response
+
+        #the row is not in the offline copies, for eg: a member added after the snapshot
+        self.__count(fq_table_name, "fallback_misses")
+        response = online_request.result()
+        self.__count(fq_table_name, "online")
+        return {**response, "data_freshness":{"source":"online", "as_of":None, "delta_version":None}}
+
+    def get_metrics(self) -> dict:
+        with self.lock:
+            metrics = {t:dict(m) for t, m in self.metrics.items()}
+        for m in metrics.values():
+            fallbacks = m["snapshot"] + m["warehouse"]
+            m["fallback_percent"] = round(fallbacks * 100 / m["requests"], 2) if m["requests"] > 0 else 0.0
+        return metrics
+
+
+def get_data_from_online_table(fq_table_name, query_object, hedged_requester:HedgedRequester=None, offline_backend:OfflineLookupBackend=None):
     catalog_name , schema_name, table_name = fq_table_name.split(".")
     online_table_name = f"{fq_table_name}_online"
     endpoint_name = f"{table_name}_endpoint".replace('_','-')
 
+    def request_fn():
+        client = mlflow.deployments.get_deploy_client("databricks")
+        return client.predict(
+          endpoint = endpoint_name,
+          inputs = {
+            "dataframe_records": [query_object]
+          }
+        )
 
-    client = mlflow.deployments.get_deploy_client("databricks")
-    response = client.predict(
-      endpoint = endpoint_name,
-      inputs = {
-        "dataframe_records": [query_object]
-      }
-    )
+    def online_request_fn():
+        if hedged_requester is None:
+            return request_fn()
+        return hedged_requester.call(request_fn)
+
+    if offline_backend is None:
+        return online_request_fn()
+
+    response = offline_backend.call(fq_table_name, query_object, online_request_fn)
+    span = mlflow.get_current_active_span()
+    if span is not None:
+        span.set_attribute("data_freshness", response["data_freshness"])
     return response
 
 # COMMAND ----------
@@ -248,14 +524,88 @@ class QuestionClassifier(BaseCareCostToolBuilder):
 
 # COMMAND ----------
 
+class BenefitShardCache():
+    """
+    An in-process cache of per client benefit shards.
+    Each shard holds the SBC chunks and their normalized embeddings for one client and is loaded on demand 
+    from `<shard_path>/<client_id>.npz`. Least recently used shards are evicted to stay under the memory budget.
+    """
+    def __init__(self, shard_path:str, memory_budget_mb:int):
+        self.shard_path = shard_path
+        self.memory_budget_bytes = memory_budget_mb * 1024 * 1024
+        self.shards = OrderedDict()
+        self.shard_sizes = {}
+        self.size_bytes = 0
+        self.lock = threading.Lock()
+        self.metrics = {"hits":0, "loads":0, "misses":0, "evictions":0}
+
+    def __load_shard(self, client_id:str) -> dict:
+        shard_file = os.path.join(self.shard_path, f"{client_id}.npz")
+        if not os.path.exists(shard_file):
+            return None
+        with np.load(shard_file, allow_pickle=False) as npz:
+            shard = {name:npz[name] for name in npz.files}
+        embeddings = shard["embedding"].astype(np.float32)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        shard["embedding"] = embeddings / np.where(norms == 0, 1, norms)
+        return shard
+
+    def has_shard(self, client_id:str) -> bool:
+        """Whether the client has a shard, without loading it"""
+        with self.lock:
+            if client_id in self.shards:
+                return True
+        return os.path.exists(os.path.join(self.shard_path, f"{client_id}.npz"))
+
+    def get(self, client_id:str) -> dict:
+        with self.lock:
+            if client_id in self.shards:
+                self.shards.move_to_end(client_id)
+                self.metrics["hits"] += 1
+                return self.shards[client_id]
+
+        shard = self.__load_shard(client_id)
+
+        with self.lock:
+            if shard is None:
+                self.metrics["misses"] += 1
+                return None
+            self.metrics["loads"] += 1
+            shard_size = sum(a.nbytes for a in shard.values())
+            if client_id not in self.shards:
+                self.shards[client_id] = shard
+                self.shard_sizes[client_id] = shard_size
+                self.size_bytes += shard_size
+            #evict least recently used shards, but always keep the one just loaded
+            while self.size_bytes > self.memory_budget_bytes and len(self.shards) > 1:
+                evicted_client_id, _ = self.shards.popitem(last=False)
+                self.size_bytes -= self.shard_sizes.pop(evicted_client_id)
+                self.metrics["evictions"] += 1
+            return self.shards[client_id]
+
+    def search(self, client_id:str, query_vector:List[float], columns:List[str], num_results:int) -> dict:
+        """Searches the client shard and returns results in the same format as the vector search index or None if there is no shard"""
+        shard = self.get(client_id)
+        if shard is None:
+            return None
+        query = np.asarray(query_vector, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1)
+        scores = shard["embedding"] @ query
+        top_indices = np.argsort(-scores)[:num_results]
+        data_array = [[shard[c][i].item() for c in columns] + [float(scores[i])] for i in top_indices]
+        return {"result": {"row_count": len(data_array), "data_array": data_array}}
+
+
 class BenefitsRetriever():    
     """A retriever class to do Vector Index Search"""
     retriever_config: RetrieverConfig = None
     vector_index: VectorSearchIndex = None
+    shard_cache: BenefitShardCache = None
 
-    def __init__(self, retriever_config: RetrieverConfig):
+    def __init__(self, retriever_config: RetrieverConfig, shard_cache: BenefitShardCache = None):
         super().__init__()
         self.retriever_config = retriever_config
+        self.shard_cache = shard_cache
         
         vsc = VectorSearchClient()
         
@@ -264,8 +614,18 @@ class BenefitsRetriever():
 
     @mlflow.trace(name="get_benefit_retriever", span_type="func")
     def get_benefits(self, client_id:str, question:str):
+        #the query is only embedded for the shard when the client has one
+        if self.shard_cache is not None and self.shard_cache.has_shard(client_id):
+            query_vector = get_query_embedding(self.retriever_config.shard_embedding_endpoint_name, question)
+            query_results = self.shard_cache.search(client_id, query_vector,
+                                                    columns=self.retriever_config.retrieve_columns,
+                                                    num_results=1)
+            if query_results is not None:
+                return query_results
+
+        #no local shard for the client, fallback to the vector index
         query_results = self.vector_index.similarity_search(
-            query_text=question,
+            **get_query_search_args(self.retriever_config, question),
             filters={"client":client_id},
             columns=self.retriever_config.retrieve_columns,
             num_results=1)
@@ -293,6 +653,7 @@ class BenefitsRAG(BaseCareCostToolBuilder):
     args_schema : Type[BaseModel] = BenefitsRAGInput
     model_endpoint_name:str = None
     retriever_config: RetrieverConfig = None    
+    shard_cache: BenefitShardCache = None
     retrieved_documents:List[Document] = None
     prompt_coverage_qa:str = "Get the member medical coverage benefits from the input sentence at the end:\
         The output should only contain the formatted JSON instance that conforms to the JSON schema below.\
@@ -307,11 +668,15 @@ class BenefitsRAG(BaseCareCostToolBuilder):
         super().__init__()
         self.model_endpoint_name = model_endpoint_name
         self.retriever_config = retriever_config
+        if self.retriever_config.shard_path is not None:
+            #shards are kept across requests
+            self.shard_cache = BenefitShardCache(self.retriever_config.shard_path,
+                                                 self.retriever_config.shard_memory_budget_mb)
         
     @mlflow.trace(name="get_benefits", span_type="func")
     def execute(self, client_id:str, question:str) -> str:
 
-        retriever = BenefitsRetriever(self.retriever_config)        
+        retriever = BenefitsRetriever(self.retriever_config, self.shard_cache)        
         self.retrieved_documents = None
         query_results = retriever.get_benefits(client_id, question)
         
@@ -366,7 +731,7 @@ class ProcedureRetriever(BaseCareCostToolBuilder):
     @mlflow.trace(name="get_procedure_details", span_type="func")
     def execute(self, question:str) -> (str,str):
         query_results = self.vector_index.similarity_search(
-            query_text=question,
+            **get_query_search_args(self.retriever_config, question),
             columns=self.retriever_config.retrieve_columns,
             num_results=1)
 
@@ -396,15 +761,21 @@ class ClientIdLookup(BaseCareCostToolBuilder):
     description : str = "useful for retrieving a client id given a member id"
     args_schema : Type[BaseModel] = ClientIdLookupInput
     fq_member_table_name:str = None
+    hedged_requester:HedgedRequester = None
+    offline_backend:OfflineLookupBackend = None
 
-    def __init__(self, fq_member_table_name:str):
+    def __init__(self, fq_member_table_name:str, hedged_requester:HedgedRequester=None, offline_backend:OfflineLookupBackend=None):
         super().__init__()
         self.fq_member_table_name = fq_member_table_name
+        self.hedged_requester = hedged_requester
+        self.offline_backend = offline_backend
     
     @mlflow.trace(name="get_client_id", span_type="func")
     def execute(self, member_id:str) -> str:
         member_data = get_data_from_online_table(self.fq_member_table_name, 
-                                                 {"member_id":member_id})
+                                                 {"member_id":member_id},
+                                                 self.hedged_requester,
+                                                 self.offline_backend)
         print(member_data)
         return member_data["outputs"][0]["client_id"]
 
@@ -430,15 +801,21 @@ class ProcedureCostLookup(BaseCareCostToolBuilder):
     description : str = "useful for retrieving the cost of a procedure given the procedure code"
     args_schema : Type[BaseModel] = ProcedureCostLookupInput
     fq_procedure_cost_table_name:str = None
+    hedged_requester:HedgedRequester = None
+    offline_backend:OfflineLookupBackend = None
 
-    def __init__(self, fq_procedure_cost_table_name:str):
+    def __init__(self, fq_procedure_cost_table_name:str, hedged_requester:HedgedRequester=None, offline_backend:OfflineLookupBackend=None):
         super().__init__()
         self.fq_procedure_cost_table_name = fq_procedure_cost_table_name
+        self.hedged_requester = hedged_requester
+        self.offline_backend = offline_backend
     
     @mlflow.trace(name="get_procedure_cost", span_type="func")
     def execute(self, procedure_code:str) -> float:
         procedure_cost_data = get_data_from_online_table(self.fq_procedure_cost_table_name,
-                                                         {"procedure_code":procedure_code})
+                                                         {"procedure_code":procedure_code},
+                                                         self.hedged_requester,
+                                                         self.offline_backend)
         return procedure_cost_data["outputs"][0]["cost"]
 
 
@@ -462,15 +839,21 @@ class MemberAccumulatorsLookup(BaseCareCostToolBuilder):
     description : str = "useful for retrieving the accumulators like deductibles given a member id"
     args_schema : Type[BaseModel] = MemberAccumulatorsLookupInput
     fq_member_accumulators_table_name:str = None
+    hedged_requester:HedgedRequester = None
+    offline_backend:OfflineLookupBackend = None
 
-    def __init__(self, fq_member_accumulators_table_name:str):
+    def __init__(self, fq_member_accumulators_table_name:str, hedged_requester:HedgedRequester=None, offline_backend:OfflineLookupBackend=None):
         super().__init__()
         self.fq_member_accumulators_table_name = fq_member_accumulators_table_name
+        self.hedged_requester = hedged_requester
+        self.offline_backend = offline_backend
     
     @mlflow.trace(name="get_member_accumulators", span_type="func")
     def execute(self, member_id:str) -> dict[str, Union[float,str] ]:
         accumulator_data = get_data_from_online_table(self.fq_member_accumulators_table_name,
-                                                      {"member_id":member_id})
+                                                      {"member_id":member_id},
+                                                      self.hedged_requester,
+                                                      self.offline_backend)
         return accumulator_data["outputs"][0]
 
 
@@ -701,6 +1084,12 @@ class CareCostCompassAgent(PythonModel):
 
     #get the config from context
     model_config = context.model_config
+
+    #local stand-ins of the Databricks endpoints for performance tests, see scripts/local_standins.py
+    #the endpoint and vector search calls of the agent go to the stand-ins, only while the agent loads its tools or answers a request
+    self.local_endpoint_url = model_config["local_endpoint_url"]
+    self.endpoint_environment = EndpointEnvironment(host=self.local_endpoint_url,
+                                                    token="local" if self.local_endpoint_url is not None else None)
     
     #instrumentation for feedback app as it does not let you post multiple messages
     #below variables are so that we can use it for review app
@@ -710,31 +1099,73 @@ class CareCostCompassAgent(PythonModel):
     self.question_classifier_model_endpoint_name = model_config["question_classifier_model_endpoint_name"]
     self.benefit_retriever_model_endpoint_name = model_config["benefit_retriever_model_endpoint_name"]
     self.benefit_retriever_config = RetrieverConfig(**model_config["benefit_retriever_config"])
+    if context.artifacts is not None and "benefit_shards" in context.artifacts:
+      #shards packaged with the model
+      self.benefit_retriever_config.shard_path = context.artifacts["benefit_shards"]
     self.procedure_code_retriever_config = RetrieverConfig(**model_config["procedure_code_retriever_config"])
     self.summarizer_model_endpoint_name = model_config["summarizer_model_endpoint_name"]
     self.member_table_name = model_config["member_table_name"]
     self.procedure_cost_table_name = model_config["procedure_cost_table_name"]
     self.member_accumulators_table_name = model_config["member_accumulators_table_name"]
-
-    #Start instantiating tools                                    
-    self.question_classifier = QuestionClassifier(model_endpoint_name=self.question_classifier_model_endpoint_name,
-                            categories_and_description=self.invalid_question_category).get()
+    self.lookup_hedge_budget_percent = model_config["lookup_hedge_budget_percent"]
+
+    #one requester per feature serving endpoint, as each endpoint has its own latency distribution
+    self.lookup_hedged_requesters = {
+      "ClientIdLookup": HedgedRequester(hedge_budget_percent=self.lookup_hedge_budget_percent),
+      "ProcedureCostLookup": HedgedRequester(hedge_budget_percent=self.lookup_hedge_budget_percent),
+      "MemberAccumulatorsLookup": HedgedRequester(hedge_budget_percent=self.lookup_hedge_budget_percent)
+    }
+    self.lookup_table_names = {
+      "ClientIdLookup": self.member_table_name,
+      "ProcedureCostLookup": self.procedure_cost_table_name,
+      "MemberAccumulatorsLookup": self.member_accumulators_table_name
+    }
+
+    #offline copies of the lookup tables, used when the feature serving endpoints are slow or cold
+    self.lookup_snapshot_path = model_config["lookup_snapshot_path"]
+    if context.artifacts is not None and "lookup_snapshots" in context.artifacts:
+      #snapshots packaged with the model
+      self.lookup_snapshot_path = context.artifacts["lookup_snapshots"]
+    self.lookup_warehouse_id = model_config["lookup_warehouse_id"]
+    self.lookup_offline_backend = None
+    if self.lookup_snapshot_path is not None or self.lookup_warehouse_id is not None:
+      self.lookup_offline_backend = OfflineLookupBackend(latency_budget_ms=model_config["lookup_latency_budget_ms"],
+                                                         snapshot_path=self.lookup_snapshot_path,
+                                                         warehouse_id=self.lookup_warehouse_id)
+
+    with self.endpoint_environment.scope():
+      #Start instantiating tools                                    
+      self.question_classifier = QuestionClassifier(model_endpoint_name=self.question_classifier_model_endpoint_name,
+                              categories_and_description=self.invalid_question_category).get()
     
-    self.client_id_lookup = ClientIdLookup(fq_member_table_name=self.member_table_name).get()
+      self.client_id_lookup = ClientIdLookup(fq_member_table_name=self.member_table_name,
+                                             hedged_requester=self.lookup_hedged_requesters["ClientIdLookup"],
+                                             offline_backend=self.lookup_offline_backend).get()
     
-    self.benefit_rag = BenefitsRAG(model_endpoint_name=self.benefit_retriever_model_endpoint_name,
-                              retriever_config=self.benefit_retriever_config).get()
+      self.benefit_rag = BenefitsRAG(model_endpoint_name=self.benefit_retriever_model_endpoint_name,
+                                retriever_config=self.benefit_retriever_config).get()
     
-    self.procedure_code_retriever = ProcedureRetriever(retriever_config=self.procedure_code_retriever_config).get()
+      self.procedure_code_retriever = ProcedureRetriever(retriever_config=self.procedure_code_retriever_config).get()
 
-    self.procedure_cost_lookup = ProcedureCostLookup(fq_procedure_cost_table_name=self.procedure_cost_table_name).get()
+      self.procedure_cost_lookup = ProcedureCostLookup(fq_procedure_cost_table_name=self.procedure_cost_table_name,
+                                                       hedged_requester=self.lookup_hedged_requesters["ProcedureCostLookup"],
+                                                       offline_backend=self.lookup_offline_backend).get()
 
-    self.member_accumulator_lookup = MemberAccumulatorsLookup(fq_member_accumulators_table_name=self.member_accumulators_table_name).get()
+      self.member_accumulator_lookup = MemberAccumulatorsLookup(fq_member_accumulators_table_name=self.member_accumulators_table_name,
+                                                                hedged_requester=self.lookup_hedged_requesters["MemberAccumulatorsLookup"],
+                                                                offline_backend=self.lookup_offline_backend).get()
 
-    self.member_cost_calculator = MemberCostCalculator().get()
+      self.member_cost_calculator = MemberCostCalculator().get()
 
-    self.summarizer = ResponseSummarizer(model_endpoint_name=self.summarizer_model_endpoint_name).get()
+      self.summarizer = ResponseSummarizer(model_endpoint_name=self.summarizer_model_endpoint_name).get()
   
+  def get_lookup_metrics(self) -> dict:
+    """Hedging and offline fallback metrics of the online table lookups"""
+    fallback_metrics = self.lookup_offline_backend.get_metrics() if self.lookup_offline_backend is not None else {}
+    return {name:{**requester.get_metrics(),
+                  **{f"fallback_{k}":v for k, v in fallback_metrics.get(self.lookup_table_names[name], {}).items()}}
+            for name, requester in self.lookup_hedged_requesters.items()}
+
   #we will create three flows that can run parallely
   async def __benefit_flow(self, member_id:str, question:str) -> Benefit:
       ##########################################
@@ -805,6 +1236,10 @@ class CareCostCompassAgent(PythonModel):
     Returns:
         Predicted answer: string
     """
+    with self.endpoint_environment.scope():
+      return self.__answer(model_input)
+
+  def __answer(self, model_input: pd.DataFrame) -> StringResponse:
     try:
 
       log_print("Inside predict")
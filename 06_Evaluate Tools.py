@@ -20,6 +20,21 @@
 
 # COMMAND ----------
 
+# MAGIC %run ./utils/eval_runner
+
+# COMMAND ----------
+
+# MAGIC %run ./utils/eval_cache
+
+# COMMAND ----------
+
+#the tool outputs and the judge evaluations are cached in the volume, so re-running an unchanged evaluation makes no endpoint calls
+#set refresh_evaluation_cache to call the endpoints again, for eg: after the vector index or the online tables change
+refresh_evaluation_cache = False
+evaluation_cache = EvaluationCache(f"{sbc_folder_path}/eval_cache", refresh=refresh_evaluation_cache)
+
+# COMMAND ----------
+
 # MAGIC %md
 # MAGIC ### Lets evaluate all the tools we built to select appropriate parameters
 # MAGIC
@@ -106,6 +121,25 @@ with mlflow.start_run(experiment_id=experiment.experiment_id,
 
     models_to_evaluate = ["databricks-meta-llama-3-3-70b-instruct", "databricks-claude-3-7-sonnet"]
 
+    #each question is classified once per model and prompt version, later runs read it from the cache
+    qc_prompt_version = get_prompt_version(QuestionClassifier.prompt)
+
+    def get_question_classifier_row_fn(model_name:str):
+        qc = QuestionClassifier(model_endpoint_name=model_name, 
+                                categories_and_description=categories_and_description).get()
+        def run_question_classifier(row):
+            response, cache_hit = evaluation_cache.call_with_cache_hit("QuestionClassifier", model_name, qc_prompt_version,
+                                                                       {"question":row["questions"], "categories":categories_and_description},
+                                                                       lambda: qc.run({"questions":[row["questions"]]})[0])
+            #the cache hits are left out of the latency metrics of the runner
+            return {"response":response, "cache_hit":cache_hit}
+        return run_question_classifier
+
+    #all the models classify all the questions at the same time, with at most 4 questions in flight per model endpoint
+    qc_sweep = run_model_sweep({model_name:get_question_classifier_row_fn(model_name) for model_name in models_to_evaluate},
+                               eval_data,
+                               max_concurrency_per_endpoint=4)
+
     results = []
     for model_name in models_to_evaluate:
         
@@ -114,22 +148,22 @@ with mlflow.start_run(experiment_id=experiment.experiment_id,
             run_name=model_name,
             nested=True) as run:
 
-            qc = QuestionClassifier(model_endpoint_name=model_name, 
-                                    categories_and_description=categories_and_description).get()
-            
-            eval_fn = lambda data : qc.run({"questions":data["questions"].tolist()})
-
             result = mlflow.evaluate(
-                eval_fn,
-                eval_data,
+                data=eval_data.assign(prediction=qc_sweep[model_name].results["response"]),
+                predictions="prediction",
                 targets="ground_truth",
                 model_type="question-answering",
             )
+            qc_sweep[model_name].log_results()
+
             results.append({"model":model_name,
                             "result":result,
                             "experiment_id":experiment.experiment_id,
                             "run_id":run.info.run_id})
 
+#accuracy, latency and throughput of each model, the rows read from the evaluation cache are not timed against the endpoints
+display(get_sweep_report(results, qc_sweep))
+
 # COMMAND ----------
 
 best_result = sorted(results, key=lambda x: x["result"].metrics["exact_match/v1"], reverse=True)[0]
@@ -212,6 +246,39 @@ with mlflow.start_run(experiment_id=experiment.experiment_id,
     
     models_to_evaluate = ["databricks-meta-llama-3-3-70b-instruct", "databricks-claude-3-7-sonnet"]
 
+    retriever_config = RetrieverConfig(vector_search_endpoint_name="care_cost_vs_endpoint",
+                        vector_index_name=f"{catalog}.{schema}.{sbc_details_table_name}_index",
+                        vector_index_id_column="id",
+                        retrieve_columns=["id","content"])
+    
+    tool_input_columns = ["question","client_id"]
+
+    br_prompt_version = get_prompt_version(BenefitsRAG.prompt_coverage_qa)
+
+    def get_benefits_rag_row_fn(model_name:str):
+        def run_benefits_rag(row):
+            input_dict = { col:row[col] for col in tool_input_columns}
+
+            def run_tool():
+                #a tool per row, since the tool keeps the documents retrieved by its last run
+                br = BenefitsRAG(model_endpoint_name=model_name, retriever_config=retriever_config)
+                print(f"Running tool with input: {input_dict}")
+                response = br.get().run(input_dict)
+                return {"response":response,
+                        "retrieved_context":[{"content":doc.page_content} for doc in br.retrieved_documents]}
+
+            output, cache_hit = evaluation_cache.call_with_cache_hit("BenefitsRAG", model_name, br_prompt_version,
+                                                                     {**input_dict, "vector_index_name":retriever_config.vector_index_name},
+                                                                     run_tool)
+            return {**output, "cache_hit":cache_hit}
+        return run_benefits_rag
+
+    #all the (model, question) pairs run at the same time, with at most 4 rows in flight per model endpoint
+    #the results of each model are in the order of eval_data
+    br_sweep = run_model_sweep({model_name:get_benefits_rag_row_fn(model_name) for model_name in models_to_evaluate},
+                               eval_data,
+                               max_concurrency_per_endpoint=4)
+
     results = []
     for model_name in models_to_evaluate:
         
@@ -220,46 +287,39 @@ with mlflow.start_run(experiment_id=experiment.experiment_id,
             run_name=model_name,
             nested=True) as run:
 
-            retriever_config = RetrieverConfig(vector_search_endpoint_name="care_cost_vs_endpoint",
-                                vector_index_name=f"{catalog}.{schema}.{sbc_details_table_name}_index",
-                                vector_index_id_column="id",
-                                retrieve_columns=["id","content"])
-            
-            br = BenefitsRAG(model_endpoint_name=model_name, retriever_config=retriever_config)
-            br_tool = br.get()
-            
-            tool_input_columns = ["question","client_id"]
-            tool_result = []
-            tool_output= []
-            for index, row in eval_data.iterrows():
-                input_dict = { col:row[col] for col in tool_input_columns}
-                print(f"Running tool with input: {input_dict}")
-                tool_result.append(br_tool.run(input_dict))
-                tool_output.append(br.retrieved_documents)
-
-            retrieved_documents = [
-                    [{"content":doc.page_content} for doc in doclist]  
-                for doclist in tool_output ]
+            eval_runner_results = br_sweep[model_name].results
 
             #Let us create the eval_df structure
             eval_df = pd.DataFrame({
                 "request":eval_data["question"], #<<Request that was sent
-                "response":tool_result, #<<Response from RAG
-                "retrieved_context": retrieved_documents, #<< Retrieved documents from retriever
+                "response":eval_runner_results["response"], #<<Response from RAG
+                "retrieved_context": eval_runner_results["retrieved_context"], #<< Retrieved documents from retriever
                 "expected_response":eval_data["expected_response"] #<<Expected correct response
             })
 
             #here we will use the Mosaic AI Agent Evaluation framework to evaluate the RAG model
-            result = mlflow.evaluate(
+            #the judges are only called when the responses or the judge versions changed since the cached evaluation
+            result = evaluation_cache.evaluate(
+                "databricks-agent",
+                model_name,
                 data=eval_df,
                 model_type="databricks-agent"
             )
+            br_sweep[model_name].log_results()
 
             results.append({"model":model_name,
                             "result":result,
                             "experiment_id":experiment.experiment_id,
                             "run_id":run.info.run_id})
 
+#agent judge metrics, latency and throughput of each model
+display(get_sweep_report(results, br_sweep))
+
+# COMMAND ----------
+
+#the hits did not call any endpoint
+display(evaluation_cache.get_metrics())
+
 # COMMAND ----------
 
 # MAGIC %md
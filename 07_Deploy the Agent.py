@@ -53,7 +53,14 @@ def get_model_config(environment:str,
                        benefit_retriever_model_endpoint_name:str,
                        summarizer_model_endpoint_name:str,
 
-                       default_parameter_json_string:str) -> dict:
+                       default_parameter_json_string:str,
+                       
+                       sbc_details_shard_path:str=None,
+                       lookup_hedge_budget_percent:float=5.0,
+                       lookup_latency_budget_ms:float=2000,
+                       lookup_snapshot_path:str=None,
+                       lookup_warehouse_id:str=None,
+                       local_endpoint_url:str=None) -> dict:
     
     fq_member_table_name = f"{catalog}.{schema}.{member_table_name}"
     fq_procedure_cost_table_name = f"{catalog}.{schema}.{procedure_cost_table_name}"
@@ -62,7 +69,8 @@ def get_model_config(environment:str,
     benefit_rag_retriever_config = RetrieverConfig(vector_search_endpoint_name=vector_search_endpoint_name,
                                 vector_index_name=f"{catalog}.{schema}.{sbc_details_table_name}_index",
                                 vector_index_id_column=sbc_details_id_column, 
-                                retrieve_columns=sbc_details_retrieve_columns)
+                                retrieve_columns=sbc_details_retrieve_columns,
+                                shard_path=sbc_details_shard_path)
 
     proc_code_retriever_config = RetrieverConfig(vector_search_endpoint_name=vector_search_endpoint_name,
                                 vector_index_name=f"{catalog}.{schema}.{cpt_code_table_name}_index",
@@ -82,7 +90,15 @@ def get_model_config(environment:str,
         "summarizer_model_endpoint_name":summarizer_model_endpoint_name,
         "member_table_online_endpoint_name":f"{member_table_name}_endpoint".replace('_','-'),
         "procedure_cost_table_online_endpoint_name":f"{procedure_cost_table_name}_endpoint".replace('_','-'),
-        "member_accumulators_table_online_endpoint_name":f"{member_accumulators_table_name}_endpoint".replace('_','-')
+        "member_accumulators_table_online_endpoint_name":f"{member_accumulators_table_name}_endpoint".replace('_','-'),
+        #percentage of the online table lookups that can be sent twice when the first request is slower than the rolling p95
+        "lookup_hedge_budget_percent":lookup_hedge_budget_percent,
+        #the lookups are answered from the snapshots or the SQL warehouse when an endpoint does not respond within the budget
+        "lookup_latency_budget_ms":lookup_latency_budget_ms,
+        "lookup_snapshot_path":lookup_snapshot_path,
+        "lookup_warehouse_id":lookup_warehouse_id,
+        #url of the local stand-ins for performance tests, for eg: http://127.0.0.1:8080, never set for a deployed model
+        "local_endpoint_url":local_endpoint_url
 
     }
 
@@ -152,6 +168,24 @@ display_results(model_output_bad["content"])
 
 # COMMAND ----------
 
+# MAGIC %md
+# MAGIC The online table lookups are hedged: when a lookup has not answered within the rolling p95 latency of its endpoint, a duplicate request is sent and the first answer is used. 
+# MAGIC This cuts the tail latency caused by slow replicas and scale to zero wake ups of the feature serving endpoints. The duplicates are capped by `lookup_hedge_budget_percent`.
+# MAGIC Hedging starts once enough latencies are recorded, so the metrics below are only meaningful after a number of requests.
+
+# COMMAND ----------
+
+display(pd.DataFrame.from_dict(test_model.get_lookup_metrics(), orient="index"))
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC Since the feature serving endpoints scale to zero, the first lookup after an idle period can take many seconds. 
+# MAGIC When `lookup_snapshot_path` (see `export_lookup_snapshot` in `04_Create Online Tables`) or `lookup_warehouse_id` is set, a lookup that does not respond within `lookup_latency_budget_ms` is answered from the Parquet snapshot of the table or from a SQL warehouse query. 
+# MAGIC The `data_freshness` of each lookup is recorded in its trace and the `fallback_` metrics above count how often the fallback was used.
+
+# COMMAND ----------
+
 # MAGIC %md
 # MAGIC ### Model Evaluation
 # MAGIC Now we know that our model is working, let us evaluate the Agent as a whole against our initial evaluation dataframe.
@@ -217,12 +251,21 @@ eval_df = pd.DataFrame(
 
 # COMMAND ----------
 
+# MAGIC %run ./utils/eval_runner
+
+# COMMAND ----------
+
 import json
 
-def execute_with_model(agent_pyfunc : PythonModel):
+def execute_with_model(agent_pyfunc : PythonModel, max_workers:int=4) -> ConcurrentEvaluationRunner:
     #creating a helper function to run evaluation on a pd dataframe
-    return (lambda data: 
-                data.apply(lambda row: agent_pyfunc.predict(None,pd.read_json(row["inputs"], orient='split'),None)["content"], axis=1))
+    #the rows run concurrently and the runner keeps the latency and the retrieved benefits of each row
+    def row_fn(row):
+        with mlflow.start_span(name="evaluate_row") as span:
+            response = agent_pyfunc.predict(None,pd.read_json(row["inputs"], orient='split'),None)
+        return {"response":response["content"],
+                "retrieved_context":get_retrieved_context(mlflow.get_trace(span.request_id))}
+    return ConcurrentEvaluationRunner(row_fn, max_workers=max_workers)
 
 
 
@@ -241,8 +284,9 @@ with mlflow.start_run(
     run_name=f"01_evaluate_agent_{time_str}",
     nested=True) as run:    
 
+    agent_eval_runner = execute_with_model(test_model)
     results = mlflow.evaluate(
-        execute_with_model(test_model),
+        agent_eval_runner,
         eval_df,
         targets="ground_truth",  # specify which column corresponds to the expected output
         model_type="question-answering",  # model type indicates which metrics are relevant for this task
@@ -253,7 +297,9 @@ with mlflow.start_run(
             }
         }
     )
+    agent_eval_runner.log_results()
 
+display(agent_eval_runner.results)
 results.metrics
 
 # COMMAND ----------
@@ -284,7 +330,7 @@ signature_new = ModelSignature(
 
 import mlflow
 from datetime import datetime
-from mlflow.models.resources import DatabricksServingEndpoint, DatabricksVectorSearchIndex
+from mlflow.models.resources import DatabricksServingEndpoint, DatabricksVectorSearchIndex, DatabricksSQLWarehouse
 
 model_name = "carecost_compass_agent"
 
@@ -316,10 +362,25 @@ with mlflow.start_run(experiment_id=experiment.experiment_id,
                     summarizer_model_endpoint_name="databricks-claude-3-7-sonnet",                       
                     default_parameter_json_string='{"member_id":"1234"}')
 
+    #package the per client benefit shards and the lookup snapshots with the model, if used
+    model_artifacts = {}
+    if model_config["benefit_retriever_config"]["shard_path"] is not None:
+        model_artifacts["benefit_shards"] = model_config["benefit_retriever_config"]["shard_path"]
+    if model_config["lookup_snapshot_path"] is not None:
+        model_artifacts["lookup_snapshots"] = model_config["lookup_snapshot_path"]
+
+    #the SQL warehouse for the lookup fallback, if used
+    #the model also needs SELECT on the lookup tables
+    warehouse_resources = [DatabricksSQLWarehouse(warehouse_id=model_config["lookup_warehouse_id"])] if model_config["lookup_warehouse_id"] is not None else []
+
+    #the embedding endpoint of the benefit shard queries, if shards are used
+    shard_resources = ([DatabricksServingEndpoint(endpoint_name=model_config["benefit_retriever_config"]["shard_embedding_endpoint_name"])]
+                       if model_config["benefit_retriever_config"]["shard_path"] is not None else [])
+
     mlflow.pyfunc.log_model(
         artifact_path="model",
         python_model=f"/Workspace/{project_root_path}/05_Create All Tools and Model",
-        artifacts={},
+        artifacts=model_artifacts,
         model_config=model_config,
         pip_requirements=["mlflow==2.16.2",
                           "langchain==0.3.0",
@@ -348,7 +409,7 @@ with mlflow.start_run(experiment_id=experiment.experiment_id,
             #vector indexes
             DatabricksVectorSearchIndex(index_name=model_config["benefit_retriever_config"]["vector_index_name"]),  
             DatabricksVectorSearchIndex(index_name=model_config["procedure_code_retriever_config"]["vector_index_name"])            
-        ])
+        ] + warehouse_resources + shard_resources)
 
     run_id = run.info.run_id
 
@@ -436,6 +497,151 @@ display_results(result["predictions"]["content"])
 
 # COMMAND ----------
 
+# MAGIC %md
+# MAGIC ###Keep the endpoints warm during business hours
+# MAGIC The agent endpoint and the three feature serving endpoints scale to zero, so the first request after an idle period pays a cold start.
+# MAGIC A scheduled job sends a cheap synthetic query to each endpoint during business hours, at an interval below the idle timeout:
+# MAGIC * a lookup of a known `member_id` or `procedure_code` for the feature serving endpoints
+# MAGIC * an irrelevant question for the agent, which is rejected by the question classifier after a single LLM call. It is tagged with the `keep_warm_client_request_id`, and `create_potential_evaluation_set` in `08` leaves the tagged requests out of the evaluation set
+# MAGIC
+# MAGIC The pings are logged to the `endpoint_keep_warm_log` table, and the report below compares the cold start latency avoided with the cost of keeping the endpoints up.
+# MAGIC At most one cold start is avoided per idle timeout window, so the avoided latency is counted per window with a warm ping, not per ping.
+
+# COMMAND ----------
+
+# MAGIC %run ./utils/keep_warm
+
+# COMMAND ----------
+
+keep_warm_schedules = {
+    model_config["member_table_online_endpoint_name"]: get_business_hours_schedule({"dataframe_records":[{"member_id":"1234"}]}),
+    model_config["procedure_cost_table_online_endpoint_name"]: get_business_hours_schedule({"dataframe_records":[{"procedure_code":"23920"}]}),
+    model_config["member_accumulators_table_online_endpoint_name"]: get_business_hours_schedule({"dataframe_records":[{"member_id":"1234"}]}),
+    #tagged, so that 08 leaves the pings out of the evaluation set candidates
+    deployment.endpoint_name: get_business_hours_schedule({"dataframe_records":[{"messages":[{"content":"ping","role":"user"}]}],
+                                                           "client_request_id":keep_warm_client_request_id})
+}
+
+keep_warm_job_id = schedule_keep_warm_job(f"{catalog}_{schema}_keep_warm_endpoints",
+                                          keep_warm_schedules,
+                                          f"{catalog}.{schema}.{keep_warm_log_table_name}",
+                                          f"/{project_root_path}/utils/keep_warm_endpoints",
+                                          timezone_id=timezone_for_logging)
+
+# COMMAND ----------
+
+#TODO:
+####CHANGE ME
+#cost of keeping each endpoint up for an hour, the DBUs per hour of the endpoint size times your DBU price
+keep_warm_cost_per_hour = {endpoint_name:0.0 for endpoint_name in keep_warm_schedules.keys()}
+
+if spark.catalog.tableExists(f"{catalog}.{schema}.{keep_warm_log_table_name}"):
+    display(get_keep_warm_report(f"{catalog}.{schema}.{keep_warm_log_table_name}", keep_warm_cost_per_hour))
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ###Load test the agent (Optional)
+# MAGIC How many requests per second does one replica of the agent sustain, and which stage dominates the latency under concurrency?
+# MAGIC The load test sends a mix of questions and member ids to the agent, either in-process through `predict` or over REST to the serving endpoint, and reports:
+# MAGIC * the throughput, the p50/p95/p99 latency, and the error and declined rates
+# MAGIC * the latency of each traced stage: the question classifier, the lookups, the retrievers, the benefit LLM call and the summarizer
+# MAGIC
+# MAGIC With `use_local_standins`, the in-process agent calls the local stand-ins of the endpoints in `scripts/local_standins.py`, started on the driver over the snapshots exported by `04_Create Online Tables`.
+# MAGIC The stand-ins answer with deterministic outputs and injected latencies, so the results measure the agent itself and are comparable between runs.
+# MAGIC
+# MAGIC The load test needs the synthetic members of `01_Setup Data` (`generate_scale_data`), so it only runs with `run_agent_load_test` set to `True`.
+
+# COMMAND ----------
+
+# MAGIC %run ./utils/load_test
+
+# COMMAND ----------
+
+# MAGIC %run ./utils/synthetic_data
+
+# COMMAND ----------
+
+from contextlib import nullcontext
+
+#TODO:
+####CHANGE ME
+#set to True after appending the synthetic members with `generate_scale_data` in `01_Setup Data`
+run_agent_load_test = False
+use_local_standins = True
+local_standin_port = 8080
+load_test_num_requests = 200
+load_test_concurrency = 8
+#the hot and cold member mix needs many more members than the handful of demo members,
+#append the synthetic members with `generate_scale_data` in `01_Setup Data` and export the snapshots again in `04_Create Online Tables`
+load_test_min_members = 10000
+
+local_standin_args = ["--snapshot-path", f"{sbc_folder_path}/lookup_snapshots",
+                      "--lookup-latency-ms", "5", "--vector-search-latency-ms", "30", "--latency-sigma", "0.3",
+                      "--llm-latency", "lognormal:400,0.3", "--llm-token-ms", "10"]
+
+#the agent points the Databricks clients at the stand-ins only while it loads or answers, the rest of the notebook keeps the workspace
+load_test_model_config = {**test_model_config,
+                          #outside of dev and test, the member id is read from the system message of each request
+                          "environment":"load_test",
+                          "local_endpoint_url":f"http://127.0.0.1:{local_standin_port}" if use_local_standins else None}
+
+load_test_questions = [
+    "I need to do a shoulder xray. How much will it cost me?",
+    "How much will a shoulder MRI cost?",
+    "What is the cost of a knee surgery?",
+    "How much do I have to pay for a blood test?",
+    "How many stars are there in universe?"
+]
+if run_agent_load_test:
+    load_test_inputs = get_load_test_inputs(load_test_questions,
+                                            sample_member_ids(f"{catalog}.{schema}.{member_table_name}", load_test_num_requests,
+                                                              min_members=load_test_min_members),
+                                            load_test_num_requests)
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC The stand-ins run in a subprocess for the duration of the cell, and are stopped even if the load test fails.
+# MAGIC
+# MAGIC The first load test keeps `load_test_concurrency` requests in flight. The next ones send the requests with an `arrival_rate`, at a fixed rate whether or not the earlier ones are answered, like real traffic. 
+# MAGIC Increase the rate until the p99 latency and the `queue_p95_ms` grow quickly: the throughput just below is what one replica sustains.
+
+# COMMAND ----------
+
+if run_agent_load_test:
+    with (local_standins(f"/Workspace/{project_root_path}/scripts/local_standins.py", local_standin_port, local_standin_args)
+          if use_local_standins else nullcontext()):
+        load_test_model = CareCostCompassAgent()
+        load_test_model.load_context(PythonModelContext(artifacts={}, model_config=load_test_model_config))
+
+        load_test_records = run_load_test(predict_in_process(load_test_model), load_test_inputs, concurrency=load_test_concurrency)
+
+        display(pd.DataFrame([get_load_test_report(load_test_records)]))
+        display(get_stage_report(load_test_records))
+        display(get_error_report(load_test_records))
+
+        for arrival_rate in [1, 2, 4]:
+            display(pd.DataFrame([{"arrival_rate":arrival_rate,
+                                   **get_load_test_report(run_load_test(predict_in_process(load_test_model), load_test_inputs, arrival_rate=arrival_rate))}]))
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC The same load test against the serving endpoint, over the REST invocation used by `score_model`. The endpoint returns the trace of each request for the stage breakdown.
+# MAGIC Keep the load low, the endpoint calls the real LLM and feature serving endpoints.
+
+# COMMAND ----------
+
+if run_agent_load_test:
+    rest_load_test_records = run_load_test(predict_over_rest(deployment.query_endpoint, db_token, return_trace=True),
+                                           load_test_inputs[:20], concurrency=2)
+
+    display(pd.DataFrame([get_load_test_report(rest_load_test_records)]))
+    display(get_stage_report(rest_load_test_records))
+
+# COMMAND ----------
+
 # MAGIC %md
 # MAGIC ###Gather Feedback
 # MAGIC Now that you have deployed the agent as an endpoint, you can use the review app to gather feedback from your stake-holders. 
@@ -0,0 +1,149 @@
+"""
+Benchmarks the parsing of the Summary of Benefits and Coverage (SBC) PDF files locally, without Spark or Databricks.
+
+Runs `get_summary`, `get_coverage`, `summary_to_document` and `coverage_to_document` from `utils/sbc_parsing.py`
+over the SBC files in `resources` and over synthetic scaled copies of them, where the covered services pages are repeated.
+For each stage it records the wall time, the pages per second and the peak resident memory of the process.
+It also checks the chunk count parity of the scaled copies: the summary chunks should not change and
+the coverage chunks should grow with the number of copies of the covered services pages.
+
+Each file is benchmarked in its own process with an empty page cache, and the report is written as JSON
+so that it can be diffed between parser versions.
+
+Usage:
+    python scripts/benchmark_sbc_parsing.py --scales 1 2 4 --output sbc_parsing_benchmark.json
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import resource
+import tempfile
+import importlib.util
+import multiprocessing
+from datetime import datetime
+from importlib.metadata import version, PackageNotFoundError
+from concurrent.futures import ProcessPoolExecutor
+
+repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+default_sbc_files = [os.path.join(repo_root, "resources", f) for f in ["SBC_client1.pdf", "SBC_client2.pdf"]]
+
+def load_sbc_parsing():
+    """Loads the `utils/sbc_parsing` notebook as a module, it is plain python without `spark`"""
+    spec = importlib.util.spec_from_file_location("sbc_parsing", os.path.join(repo_root, "utils", "sbc_parsing.py"))
+    sbc_parsing = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(sbc_parsing)
+    return sbc_parsing
+
+def get_package_version(package_name:str) -> str:
+    try:
+        return version(package_name)
+    except PackageNotFoundError:
+        return None
+
+def get_peak_rss_mb() -> float:
+    #ru_maxrss is in KB on linux and in bytes on mac
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak_rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def create_scaled_copy(pdf_name:str, scale:int, output_dir:str) -> str:
+    """
+    Writes a copy of the SBC with the covered services pages repeated `scale` times.
+    The file name keeps the client name, since the coverage formatting depends on it.
+    """
+    from pypdf import PdfReader, PdfWriter
+    sbc_parsing = load_sbc_parsing()
+    covered_pages = [p for p, page_type in sbc_parsing.prescreen_pages(pdf_name).items() if page_type == "covered_services"]
+    if len(covered_pages) == 0:
+        raise ValueError(f"No covered services pages found in {pdf_name}")
+
+    reader = PdfReader(pdf_name)
+    page_numbers = list(range(1, covered_pages[0]))
+    page_numbers += covered_pages * scale
+    page_numbers += list(range(covered_pages[-1] + 1, len(reader.pages) + 1))
+
+    writer = PdfWriter()
+    for page_number in page_numbers:
+        writer.add_page(reader.pages[page_number - 1])
+    name, extension = os.path.splitext(os.path.basename(pdf_name))
+    scaled_pdf_name = os.path.join(output_dir, f"{name}_x{scale}{extension}")
+    with open(scaled_pdf_name, "wb") as f:
+        writer.write(f)
+    return scaled_pdf_name
+
+def run_stage(stage_fn, pages:int) -> (object, dict):
+    start_time = time.perf_counter()
+    result = stage_fn()
+    seconds = time.perf_counter() - start_time
+    return result, {"seconds":round(seconds, 3),
+                    "pages":pages,
+                    "pages_per_second":round(pages / seconds, 2) if seconds > 0 else None,
+                    "peak_rss_mb":get_peak_rss_mb()}
+
+def benchmark_file(pdf_name:str) -> dict:
+    """Runs in a separate process, so that the peak memory and the page cache are not shared between files"""
+    #empty page cache for every run
+    tempfile.tempdir = tempfile.mkdtemp(prefix="sbc_benchmark_")
+    sbc_parsing = load_sbc_parsing()
+    with sbc_parsing.pdfplumber.open(pdf_name) as pdf:
+        pages = len(pdf.pages)
+
+    stages = {}
+    summary_df, stages["get_summary"] = run_stage(lambda: sbc_parsing.get_summary(pdf_name), 1)
+    coverage_df, stages["get_coverage"] = run_stage(lambda: sbc_parsing.get_coverage(pdf_name), pages - 1)
+    summary_documents, stages["summary_to_document"] = run_stage(lambda: sbc_parsing.summary_to_document(summary_df), 1)
+    coverage_documents, stages["coverage_to_document"] = run_stage(lambda: sbc_parsing.coverage_to_document(coverage_df), pages - 1)
+
+    return {"pages":pages,
+            "stages":stages,
+            "total_seconds":round(sum(s["seconds"] for s in stages.values()), 3),
+            "chunks":{"summary":len(summary_documents), "coverage":len(coverage_documents)}}
+
+def run_benchmark(sbc_files:[str], scales:[int]) -> dict:
+    scales = sorted(set([1] + scales))
+    results = []
+    with tempfile.TemporaryDirectory() as scaled_dir:
+        for sbc_file in sbc_files:
+            base_chunks = None
+            for scale in scales:
+                pdf_name = sbc_file if scale == 1 else create_scaled_copy(sbc_file, scale, scaled_dir)
+                print(f"Benchmarking {os.path.basename(pdf_name)}", flush=True)
+                with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+                    result = executor.submit(benchmark_file, pdf_name).result()
+
+                if scale == 1:
+                    base_chunks = result["chunks"]
+                expected_chunks = {"summary":base_chunks["summary"], "coverage":base_chunks["coverage"] * scale}
+                results.append({"sbc_file_name":os.path.basename(sbc_file),
+                                "scale":scale,
+                                **result,
+                                "expected_chunks":expected_chunks,
+                                "chunk_parity":result["chunks"] == expected_chunks})
+
+    return {"created_at":datetime.now().isoformat(timespec="seconds"),
+            "environment":{"python":platform.python_version(),
+                           "platform":platform.platform(),
+                           "cpu_count":os.cpu_count(),
+                           "packages":{p:get_package_version(p) for p in ["camelot-py", "pdfplumber", "pypdf", "opencv-python", "opencv-python-headless", "pandas"]}},
+            "scales":scales,
+            "results":results}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the SBC PDF parsing without Spark")
+    parser.add_argument("--sbc-files", nargs="+", default=default_sbc_files, help="SBC PDF files to benchmark")
+    parser.add_argument("--scales", nargs="+", type=int, default=[1, 2, 4], help="number of copies of the covered services pages")
+    parser.add_argument("--output", default="sbc_parsing_benchmark.json", help="path of the JSON report")
+    args = parser.parse_args()
+
+    report = run_benchmark(args.sbc_files, args.scales)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+    for r in report["results"]:
+        print(f"{r['sbc_file_name']} x{r['scale']}: {r['pages']} pages in {r['total_seconds']}s, chunks {r['chunks']}, parity {r['chunk_parity']}")
+    print(f"Report written to {args.output}")
+    if not all(r["chunk_parity"] for r in report["results"]):
+        sys.exit(1)
@@ -0,0 +1,459 @@
+"""
+Local stand-ins for the Databricks endpoints that the agent calls, so that its hot paths can be performance tested without a workspace.
+
+- Feature serving: `POST /serving-endpoints/<table-name>-endpoint/invocations` with `dataframe_records` is answered from the
+  Parquet snapshots written by `export_lookup_snapshot` in `utils/utils.py`, in the same format as the feature serving endpoints.
+- Vector search: `GET /api/2.0/vector-search/endpoints/<endpoint>/indexes/<index>` and `.../query` answer `VectorSearchIndex.similarity_search`
+  from an in-memory NumPy index over the `sbc_details` and `cpt_codes` snapshots. The `<table>_index` index is served from the `<table>` snapshot.
+- Embeddings: `POST /serving-endpoints/<endpoint>/invocations` with `input` returns embeddings.
+- LLMs: `GET /api/2.0/serving-endpoints` and `POST /serving-endpoints/<endpoint>/invocations` with `messages` or `prompt` answer like the
+  chat and completions foundation model endpoints called by `ChatDatabricks` and `Databricks`, including token streaming with `"stream": true`.
+  The answers are canned and deterministic for each prompt family of the agent: the question category, the Benefit JSON parsed from the
+  SBC chunk in the prompt, and a summary of the calculation notes.
+
+The texts are embedded with a deterministic hashing of their words, so no embedding model is needed and the search only matches on shared words.
+Each response is delayed by an injected latency, sampled from a log-normal distribution around the given median when `--latency-sigma` is above 0.
+The LLM latency is the time to the first token, from the `--llm-latency` distribution, plus `--llm-token-ms` for each token:
+- `fixed:<ms>`
+- `lognormal:<median ms>,<sigma>`
+- `bimodal:<median ms>,<sigma>,<cold probability>,<cold ms>`, a log-normal latency with occasional cold starts
+
+Point the agent at the stand-ins by setting `local_endpoint_url` in the model config (see `get_model_config` in `07_Deploy the Agent`).
+The snapshots of the five tables can be exported with `export_lookup_snapshot` in `04_Create Online Tables` and downloaded from the volume.
+
+Usage:
+    python scripts/local_standins.py --snapshot-path ./lookup_snapshots --port 8080 --lookup-latency-ms 5 --vector-search-latency-ms 30 \
+        --llm-latency bimodal:400,0.3,0.02,15000 --llm-token-ms 15
+"""
+
+import os
+import re
+import json
+import math
+import time
+import random
+import hashlib
+import argparse
+import threading
+import numpy as np
+import pandas as pd
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+#text column embedded for the vector index of each table
+default_index_text_columns = {"sbc_details":"content", "cpt_codes":"description"}
+hash_embedding_dimension = 512
+
+def hash_embeddings(texts:[str], dimension:int=hash_embedding_dimension) -> np.ndarray:
+    """Normalized bag of words embeddings, each word is hashed to a dimension with a sign"""
+    embeddings = np.zeros((len(texts), dimension), dtype=np.float32)
+    for i, text in enumerate(texts):
+        for word in re.findall(r"[a-z0-9]+", str(text).lower()):
+            #plurals match their singular, for eg: MRIs and MRI
+            word = word[:-1] if len(word) > 3 and word.endswith("s") else word
+            digest = int(hashlib.md5(word.encode("utf-8")).hexdigest()[:8], 16)
+            embeddings[i, digest % dimension] += 1.0 if (digest >> 16) % 2 == 0 else -1.0
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.where(norms == 0, 1, norms)
+
+def to_python(value):
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    if hasattr(value, "item"):
+        return to_python(value.item())
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return value
+
+class InjectedLatency():
+    """
+    Latency around `median_ms`, log-normal with `sigma` or fixed when `sigma` is 0.
+    With `cold_probability` above 0, that share of the requests take `cold_ms` instead, like a cold start.
+    """
+    def __init__(self, median_ms:float, sigma:float=0.0, seed:int=42, cold_probability:float=0.0, cold_ms:float=0.0):
+        self.median_ms = median_ms
+        self.sigma = sigma
+        self.cold_probability = cold_probability
+        self.cold_ms = cold_ms
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def sample_ms(self) -> float:
+        with self.lock:
+            if self.cold_probability > 0 and self.random.random() < self.cold_probability:
+                return self.cold_ms
+            return self.median_ms * math.exp(self.random.gauss(0, 1) * self.sigma) if self.sigma > 0 else self.median_ms
+
+    def sleep(self):
+        if self.median_ms <= 0 and self.cold_probability <= 0:
+            return
+        time.sleep(self.sample_ms() / 1000)
+
+def parse_latency(spec:str, seed:int=42) -> InjectedLatency:
+    """`fixed:<ms>`, `lognormal:<median ms>,<sigma>` or `bimodal:<median ms>,<sigma>,<cold probability>,<cold ms>`"""
+    kind, _, values = spec.partition(":")
+    values = [float(v) for v in values.split(",")]
+    if kind == "fixed" and len(values) == 1:
+        return InjectedLatency(values[0], seed=seed)
+    if kind == "lognormal" and len(values) == 2:
+        return InjectedLatency(values[0], values[1], seed=seed)
+    if kind == "bimodal" and len(values) == 4:
+        return InjectedLatency(values[0], values[1], seed=seed, cold_probability=values[2], cold_ms=values[3])
+    raise ValueError(f"Invalid latency {spec}, expected fixed:<ms>, lognormal:<median ms>,<sigma> or bimodal:<median ms>,<sigma>,<cold probability>,<cold ms>")
+
+class LookupSnapshots():
+    """The Parquet snapshots of `<snapshot_path>/<table_name>` by the name of their feature serving endpoint"""
+    def __init__(self, snapshot_path:str):
+        self.tables = {}
+        for table_name in sorted(os.listdir(snapshot_path)):
+            table_dir = os.path.join(snapshot_path, table_name)
+            if os.path.isdir(table_dir) and os.path.exists(f"{table_dir}.json"):
+                self.tables[table_name] = pd.read_parquet(table_dir)
+        self.endpoint_tables = {f"{t}_endpoint".replace('_','-'):t for t in self.tables}
+        self.indexed_rows = {}
+
+    def lookup(self, endpoint_name:str, records:[dict]) -> dict:
+        table_name = self.endpoint_tables.get(endpoint_name)
+        if table_name is None:
+            return None
+        rows = self.tables[table_name]
+        outputs = []
+        for record in records:
+            key_columns = sorted(record.keys())
+            index_key = (table_name, tuple(key_columns))
+            if index_key not in self.indexed_rows:
+                self.indexed_rows[index_key] = rows.set_index(key_columns, drop=False)
+            key = tuple(str(record[k]) for k in key_columns)
+            try:
+                row = self.indexed_rows[index_key].loc[key if len(key) > 1 else key[0]]
+                if isinstance(row, pd.DataFrame):
+                    row = row.iloc[0]
+                outputs.append({k:to_python(v) for k, v in row.items()})
+            except KeyError:
+                #like a feature lookup of a missing key, the features are null
+                outputs.append({c:record.get(c) for c in rows.columns})
+        return {"outputs":outputs}
+
+class VectorIndex():
+    """Brute force cosine similarity over the hashed embeddings of `text_column`, with equality filters"""
+    def __init__(self, rows:pd.DataFrame, text_column:str):
+        self.rows = rows.reset_index(drop=True)
+        self.embeddings = hash_embeddings(self.rows[text_column].tolist())
+
+    def search(self, columns:[str], num_results:int, query_text:str=None, query_vector:[float]=None, filters:dict=None) -> dict:
+        if query_vector is not None and len(query_vector) == self.embeddings.shape[1]:
+            query = np.asarray(query_vector, dtype=np.float32)
+            query = query / (np.linalg.norm(query) or 1)
+        else:
+            query = hash_embeddings([query_text or ""])[0]
+        scores = self.embeddings @ query
+
+        mask = np.ones(len(self.rows), dtype=bool)
+        for column, value in (filters or {}).items():
+            values = value if isinstance(value, list) else [value]
+            mask &= self.rows[column].isin(values).to_numpy()
+        candidates = np.flatnonzero(mask)
+        top_indices = candidates[np.argsort(-scores[candidates])][:num_results]
+        data_array = [[to_python(self.rows[c].iloc[i]) for c in columns] + [float(scores[i])] for i in top_indices]
+        return {"manifest":{"column_count":len(columns) + 1, "columns":[{"name":c} for c in columns] + [{"name":"score"}]},
+                "result":{"row_count":len(data_array), "data_array":data_array},
+                "next_page_token":None}
+
+class FakeLLM():
+    """
+    Deterministic answers for the prompt families of the agent, recognized by the instructions of their prompt templates in
+    `05_Create All Tools and Model`. Any other prompt is answered with `OK`.
+    """
+    cost_words = ["cost", "price", "pay", "how much", "charge", "expensive", "afford"]
+    rude_words = ["rob", "stupid", "idiot", "hate"]
+    profanity_words = ["vulgar", "damn", "hell"]
+
+    def __init__(self, latency:InjectedLatency, token_ms:float=0.0):
+        self.latency = latency
+        self.token_ms = token_ms
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_text_after(prompt:str, marker:str) -> str:
+        return prompt.split(marker, 1)[1].strip() if marker in prompt else prompt
+
+    @staticmethod
+    def get_cost_sharing(text:str) -> (float, float):
+        """Copay and coinsurance of one network of an SBC chunk, -1 when not applicable"""
+        if "not covered" in text.lower():
+            return -1.0, -1.0
+        copay = re.search(r"\$\s*([0-9][0-9,]*(\.[0-9]+)?)\s*copay", text, re.IGNORECASE)
+        coinsurance = re.search(r"([0-9]+(\.[0-9]+)?)\s*%\s*coinsurance", text, re.IGNORECASE)
+        if copay is not None:
+            return float(copay.group(1).replace(",", "")), -1.0
+        if coinsurance is not None:
+            return -1.0, float(coinsurance.group(1))
+        #no charge
+        return 0.0, 0.0
+
+    def classify(self, prompt:str) -> str:
+        question = self.get_text_after(prompt, "Question:").lower()
+        if any(w in question for w in self.profanity_words):
+            return "PROFANITY"
+        if any(w in question for w in self.rude_words):
+            return "RUDE"
+        if any(w in question for w in self.cost_words):
+            return "GOOD"
+        return "IRRELEVANT"
+
+    def get_benefit(self, prompt:str) -> str:
+        context = self.get_text_after(prompt, "Input Sentence:")
+        in_network, _, out_network = context.partition("In Network")
+        in_network_copay, in_network_coinsurance = self.get_cost_sharing(in_network)
+        out_network_copay, out_network_coinsurance = self.get_cost_sharing(out_network.partition("Out of Network")[0])
+        return json.dumps({"text":context,
+                           "in_network_copay":in_network_copay,
+                           "in_network_coinsurance":in_network_coinsurance,
+                           "out_network_copay":out_network_copay,
+                           "out_network_coinsurance":out_network_coinsurance})
+
+    def summarize(self, prompt:str) -> str:
+        notes = [n.strip() for n in self.get_text_after(prompt, "Notes:").split("\n") if n.strip() != ""]
+        return "Here is the summary of your estimated cost. " + " ".join(notes)
+
+    def get_member_id(self, prompt:str) -> str:
+        member_id = re.search(r"[0-9]{3,}", self.get_text_after(prompt, "Question:"))
+        return member_id.group(0) if member_id is not None else "None"
+
+    def get_answer(self, prompt:str) -> (str, str):
+        """Returns the prompt family and its answer"""
+        for family, instruction, answer_fn in [("classification", "Classify the question", self.classify),
+                                               ("benefit", "Get the member medical coverage benefits", self.get_benefit),
+                                               ("summary", "Summarize the below notes", self.summarize),
+                                               ("member_id", "Extract the member id", self.get_member_id)]:
+            if instruction in prompt:
+                return family, answer_fn(prompt)
+        return "other", "OK"
+
+    @staticmethod
+    def get_prompt(body:dict) -> str:
+        if "messages" in body:
+            return "\n".join([str(m.get("content", "")) for m in body["messages"]])
+        return str(body.get("prompt", ""))
+
+    @staticmethod
+    def get_tokens(answer:str) -> [str]:
+        return re.findall(r"\S+\s*|\s+", answer)
+
+    def count(self, family:str, stream:bool):
+        with self.lock:
+            self.metrics[family] = self.metrics.get(family, 0) + 1
+            if stream:
+                self.metrics["streams"] = self.metrics.get("streams", 0) + 1
+
+    def complete(self, endpoint_name:str, body:dict) -> dict:
+        family, answer = self.get_answer(self.get_prompt(body))
+        self.count(family, stream=False)
+        tokens = self.get_tokens(answer)
+        time.sleep((self.latency.sample_ms() + self.token_ms * len(tokens)) / 1000)
+        usage = {"prompt_tokens":len(self.get_tokens(self.get_prompt(body))), "completion_tokens":len(tokens)}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        if "messages" in body:
+            return {"id":f"{family}-{len(answer)}", "object":"chat.completion", "model":endpoint_name,
+                    "choices":[{"index":0, "message":{"role":"assistant", "content":answer}, "finish_reason":"stop"}],
+                    "usage":usage}
+        return {"id":f"{family}-{len(answer)}", "object":"text_completion", "model":endpoint_name,
+                "choices":[{"index":0, "text":answer, "finish_reason":"stop"}],
+                "usage":usage}
+
+    def stream(self, endpoint_name:str, body:dict):
+        """Yields the chunks of the answer, one token each"""
+        family, answer = self.get_answer(self.get_prompt(body))
+        self.count(family, stream=True)
+        time.sleep(self.latency.sample_ms() / 1000)
+        tokens = self.get_tokens(answer)
+        for i, token in enumerate(tokens):
+            if i > 0:
+                time.sleep(self.token_ms / 1000)
+            finish_reason = "stop" if i == len(tokens) - 1 else None
+            if "messages" in body:
+                yield {"id":f"{family}-{len(answer)}", "object":"chat.completion.chunk", "model":endpoint_name,
+                       "choices":[{"index":0, "delta":{"role":"assistant", "content":token}, "finish_reason":finish_reason}]}
+            else:
+                yield {"id":f"{family}-{len(answer)}", "object":"text_completion", "model":endpoint_name,
+                       "choices":[{"index":0, "text":token, "finish_reason":finish_reason}]}
+
+class StandinServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, snapshot_path:str, index_text_columns:dict, lookup_latency:InjectedLatency, vector_search_latency:InjectedLatency,
+                 fake_llm:FakeLLM=None, llm_endpoint_tasks:dict=None):
+        super().__init__(address, StandinRequestHandler)
+        self.snapshots = LookupSnapshots(snapshot_path)
+        self.vector_indexes = {t:VectorIndex(self.snapshots.tables[t], c) for t, c in index_text_columns.items() if t in self.snapshots.tables}
+        self.lookup_latency = lookup_latency
+        self.vector_search_latency = vector_search_latency
+        self.fake_llm = fake_llm
+        #task of each fake LLM endpoint, llm/v1/chat or llm/v1/completions
+        self.llm_endpoint_tasks = llm_endpoint_tasks or {}
+        self.metrics = {"lookups":0, "vector_searches":0, "embeddings":0, "not_found":0}
+        self.metrics_lock = threading.Lock()
+
+    def count(self, metric:str):
+        with self.metrics_lock:
+            self.metrics[metric] += 1
+
+    def get_serving_endpoint(self, endpoint_name:str) -> dict:
+        """The endpoint as described by the serving endpoints API, None for an unknown endpoint"""
+        if endpoint_name in self.llm_endpoint_tasks:
+            return {"name":endpoint_name, "task":self.llm_endpoint_tasks[endpoint_name], "endpoint_type":"FOUNDATION_MODEL_API",
+                    "state":{"ready":"READY", "config_update":"NOT_UPDATING"}}
+        if endpoint_name in self.snapshots.endpoint_tables:
+            return {"name":endpoint_name, "state":{"ready":"READY", "config_update":"NOT_UPDATING"}}
+        return None
+
+    def get_vector_index(self, index_name:str) -> VectorIndex:
+        table_name = index_name.split(".")[-1]
+        if table_name.endswith("_index"):
+            table_name = table_name[:-len("_index")]
+        return self.vector_indexes.get(table_name)
+
+    def invoke(self, endpoint_name:str, body:dict) -> dict:
+        """Feature serving lookups and embeddings, returns None for an unknown endpoint"""
+        if "dataframe_records" in body:
+            self.lookup_latency.sleep()
+            self.count("lookups")
+            return self.snapshots.lookup(endpoint_name, body["dataframe_records"])
+        if "input" in body:
+            self.lookup_latency.sleep()
+            self.count("embeddings")
+            texts = body["input"] if isinstance(body["input"], list) else [body["input"]]
+            return {"object":"list",
+                    "model":endpoint_name,
+                    "data":[{"object":"embedding", "index":i, "embedding":e.tolist()} for i, e in enumerate(hash_embeddings(texts))]}
+        return None
+
+class StandinRequestHandler(BaseHTTPRequestHandler):
+    serving_route = re.compile(r"^/serving-endpoints/(?P<endpoint>[^/]+)/invocations$")
+    endpoint_route = re.compile(r"^/api/2.0/serving-endpoints/?(?P<endpoint>[^/]+)?$")
+    index_route = re.compile(r"^/api/2.0/vector-search/(endpoints/(?P<endpoint>[^/]+)/)?indexes/(?P<index>[^/]+)(?P<query>/query)?$")
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_body(self) -> dict:
+        content_length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(content_length)) if content_length > 0 else {}
+
+    def send_json(self, status_code:int, data:dict):
+        response = json.dumps(data).encode("utf-8")
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def send_stream(self, chunks):
+        """Server sent events, like a streaming serving endpoint"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        for chunk in chunks:
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+        self.close_connection = True
+
+    def send_not_found(self, message:str):
+        self.server.count("not_found")
+        self.send_json(404, {"error_code":"RESOURCE_DOES_NOT_EXIST", "message":message})
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        if path == "/metrics":
+            return self.send_json(200, {**self.server.metrics, "llm":self.server.fake_llm.metrics if self.server.fake_llm is not None else {}})
+
+        match = self.endpoint_route.match(path)
+        if match is not None:
+            if match.group("endpoint") is None:
+                endpoint_names = list(self.server.llm_endpoint_tasks.keys()) + list(self.server.snapshots.endpoint_tables.keys())
+                return self.send_json(200, {"endpoints":[self.server.get_serving_endpoint(e) for e in endpoint_names]})
+            endpoint = self.server.get_serving_endpoint(match.group("endpoint"))
+            if endpoint is None:
+                return self.send_not_found(f"Endpoint {match.group('endpoint')} not found")
+            return self.send_json(200, endpoint)
+
+        match = self.index_route.match(path)
+        if match is None:
+            return self.send_not_found(f"No stand-in for GET {path}")
+        index_name = match.group("index")
+        vector_index = self.server.get_vector_index(index_name)
+        if vector_index is None:
+            return self.send_not_found(f"Index {index_name} not found")
+
+        if match.group("query") is None:
+            return self.send_json(200, {"name":index_name,
+                                        "endpoint_name":match.group("endpoint") or "local",
+                                        "status":{"detailed_state":"ONLINE_NO_PENDING_UPDATE", "ready":True, "index_url":None}})
+
+        #similarity_search sends the query as the JSON body of a GET
+        body = self.read_body()
+        self.server.vector_search_latency.sleep()
+        self.server.count("vector_searches")
+        self.send_json(200, vector_index.search(columns=body["columns"],
+                                                num_results=body.get("num_results", 5),
+                                                query_text=body.get("query_text"),
+                                                query_vector=body.get("query_vector"),
+                                                filters=json.loads(body["filters_json"]) if body.get("filters_json") else None))
+
+    def do_POST(self):
+        path = self.path.split("?")[0]
+        match = self.serving_route.match(path)
+        if match is None:
+            return self.send_not_found(f"No stand-in for POST {path}")
+        endpoint_name = match.group("endpoint")
+        body = self.read_body()
+        if endpoint_name in self.server.llm_endpoint_tasks and self.server.fake_llm is not None:
+            if body.get("stream", False):
+                return self.send_stream(self.server.fake_llm.stream(endpoint_name, body))
+            return self.send_json(200, self.server.fake_llm.complete(endpoint_name, body))
+
+        response = self.server.invoke(endpoint_name, body)
+        if response is None:
+            return self.send_not_found(f"Endpoint {match.group('endpoint')} not found")
+        self.send_json(200, response)
+
+def parse_index_text_columns(values:[str]) -> dict:
+    index_text_columns = dict(default_index_text_columns)
+    for value in values or []:
+        table_name, text_column = value.split("=")
+        index_text_columns[table_name] = text_column
+    return index_text_columns
+
+def add_standin_arguments(parser:argparse.ArgumentParser):
+    parser.add_argument("--snapshot-path", required=True, help="folder with the Parquet snapshots written by export_lookup_snapshot")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--index", nargs="*", help="vector indexes as TABLE=TEXT_COLUMN, in addition to sbc_details=content and cpt_codes=description")
+    parser.add_argument("--lookup-latency-ms", type=float, default=5.0, help="median injected latency of the lookups and embeddings")
+    parser.add_argument("--vector-search-latency-ms", type=float, default=30.0, help="median injected latency of the vector searches")
+    parser.add_argument("--latency-sigma", type=float, default=0.0, help="log-normal sigma of the injected latencies, 0 for fixed latencies")
+    parser.add_argument("--llm-endpoints", nargs="*", default=["databricks-meta-llama-3-3-70b-instruct", "databricks-claude-3-7-sonnet"],
+                        help="names of the fake chat endpoints")
+    parser.add_argument("--llm-completions-endpoints", nargs="*", default=[], help="names of the fake completions endpoints")
+    parser.add_argument("--llm-latency", default="lognormal:400,0.3", help="time to first token of the fake LLMs: fixed:<ms>, lognormal:<median ms>,<sigma> or bimodal:<median ms>,<sigma>,<cold probability>,<cold ms>")
+    parser.add_argument("--llm-token-ms", type=float, default=10.0, help="latency of each generated token of the fake LLMs")
+
+def create_standin_server(args) -> StandinServer:
+    llm_endpoint_tasks = {**{e:"llm/v1/chat" for e in args.llm_endpoints}, **{e:"llm/v1/completions" for e in args.llm_completions_endpoints}}
+    return StandinServer((args.host, args.port), args.snapshot_path, parse_index_text_columns(args.index),
+                         lookup_latency=InjectedLatency(args.lookup_latency_ms, args.latency_sigma),
+                         vector_search_latency=InjectedLatency(args.vector_search_latency_ms, args.latency_sigma, seed=43),
+                         fake_llm=FakeLLM(parse_latency(args.llm_latency, seed=44), args.llm_token_ms),
+                         llm_endpoint_tasks=llm_endpoint_tasks)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-ins for the feature serving, vector search and LLM endpoints")
+    add_standin_arguments(parser)
+    args = parser.parse_args()
+
+    server = create_standin_server(args)
+    print(f"Serving lookups for {list(server.snapshots.endpoint_tables.keys())}, indexes for {list(server.vector_indexes.keys())} "
+          f"and LLMs {list(server.llm_endpoint_tasks.keys())} at http://{args.host}:{args.port}")
+    server.serve_forever()
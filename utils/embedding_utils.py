@@ -0,0 +1,213 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC ##### Batched embeddings for self managed vector indexes
+# MAGIC
+# MAGIC Utility methods to compute embeddings for a Delta table using Spark `mapInPandas`.
+# MAGIC Each partition sends batches of texts in the `input` list of the embedding endpoint, with a bounded number of concurrent requests and retries with backoff.
+# MAGIC The embeddings are written to an `embedding` column that can be consumed by a Delta Sync index with self managed embeddings.
+# MAGIC
+# MAGIC The embeddings table is updated incrementally: only the rows inserted or updated in the source table since the last run are embedded, read from its change data feed,
+# MAGIC and merged on the id column. Unchanged rows are not rewritten, so the change data feed of the embeddings table, used by `sync_index_if_changed`, only has the rows that changed.
+# MAGIC
+# MAGIC **NOTE:** Expects `spark` to be defined by `./init`
+
+# COMMAND ----------
+
+# MAGIC %run ./index_sync
+
+# COMMAND ----------
+
+import time
+import json
+import requests
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from delta.tables import DeltaTable
+from pyspark.sql import DataFrame, Window
+from pyspark.sql import functions as F
+from pyspark.sql.types import StructType, StructField, ArrayType, FloatType
+
+#embedding size of databricks-bge-large-en
+embedding_dimension = 1024
+embedding_column = "embedding"
+#table property of the embeddings table with the last source table version that was embedded
+embeddings_source_version_property = "embeddings.source_version"
+
+def get_embeddings(texts:[str], host_url:str, token:str, endpoint_name:str, max_retries:int=5, initial_wait_seconds:float=1.0) -> [[float]]:
+    """Calls the embedding endpoint with a batch of texts and retries on throttling and server errors"""
+    request_url = f"{host_url}/serving-endpoints/{endpoint_name}/invocations"
+    request_headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+    wait_seconds = initial_wait_seconds
+    for attempt in range(max_retries + 1):
+        try:
+            response = requests.request(method='POST', headers=request_headers, url=request_url, data=json.dumps({"input": texts}))
+        except requests.exceptions.RequestException as e:
+            response = None
+            error = repr(e)
+        if response is not None:
+            if response.status_code == 200:
+                data = sorted(response.json()["data"], key=lambda d: d["index"])
+                return [d["embedding"] for d in data]
+            error = f"status {response.status_code}, {response.text}"
+            if response.status_code != 429 and response.status_code < 500:
+                break
+        if attempt < max_retries:
+            time.sleep(wait_seconds)
+            wait_seconds = wait_seconds * 2
+    raise Exception(f"Embedding request failed with {error}")
+
+def get_embedding_partition_fn(host_url:str, token:str, endpoint_name:str, text_column:str, batch_size:int=150, max_concurrency:int=4, max_retries:int=5):
+    """Returns a function for `mapInPandas` that adds the embedding column to each pandas DataFrame"""
+    def embed_partition(pdf_iterator):
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            for pdf in pdf_iterator:
+                texts = pdf[text_column].fillna("").astype(str).tolist()
+                batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+                #executor.map preserves the order of the batches
+                embeddings = executor.map(lambda batch: get_embeddings(batch, host_url, token, endpoint_name, max_retries), batches)
+                pdf[embedding_column] = [e for batch_embeddings in embeddings for e in batch_embeddings]
+                yield pdf
+    return embed_partition
+
+def get_embeddings_source_version(target_table_name:str) -> int:
+    """The source table version embedded by the last run or None"""
+    properties = {r["key"]:r["value"] for r in spark.sql(f"SHOW TBLPROPERTIES {target_table_name}").collect()}
+    source_version = properties.get(embeddings_source_version_property)
+    return int(source_version) if source_version is not None else None
+
+def get_source_changes(source_table_name:str, id_column:str, from_version:int, to_version:int) -> (DataFrame, DataFrame):
+    """
+    Returns the rows inserted or updated in the source table after `from_version` up to `to_version`, and the ids of the deleted rows,
+    from the change data feed. Only the latest change of each id is kept.
+    """
+    latest_change_first = Window.partitionBy(id_column).orderBy(F.col("_commit_version").desc(),
+                                                               #an overwrite deletes and inserts the same id in one commit
+                                                               (F.col("_change_type") == "delete").asc())
+    changes_df = (spark
+                  .sql(f"SELECT * FROM table_changes('{source_table_name}', {from_version + 1}, {to_version})")
+                  .where(F.col("_change_type") != "update_preimage")
+                  .withColumn("change_rank", F.row_number().over(latest_change_first))
+                  .where(F.col("change_rank") == 1))
+    source_columns = spark.table(source_table_name).columns
+    return (changes_df.where(F.col("_change_type") != "delete").select(*source_columns),
+            changes_df.where(F.col("_change_type") == "delete").select(id_column))
+
+def create_embeddings_table(source_table_name:str, text_column:str, target_table_name:str,
+                            host_url:str, token:str, endpoint_name:str, id_column:str="id",
+                            num_partitions:int=None, batch_size:int=150, max_concurrency:int=4, max_retries:int=5) -> dict:
+    """
+    Computes the embeddings of `text_column` for the source table and writes them with the source columns to the target table.
+    The first run embeds all the rows. The next runs embed only the rows whose text is new or changed since the last run,
+    from the change data feed of the source table, and merge them on `id_column`, the rows deleted in the source are deleted too.
+    If the change data feed does not cover the versions since the last run, the source is compared with the target instead.
+    Returns the rows embedded and deleted and the throughput in rows per second.
+    """
+    source_version = get_table_version(source_table_name)
+    source_df = spark.read.option("versionAsOf", source_version).table(source_table_name)
+    if num_partitions is None:
+        num_partitions = spark.sparkContext.defaultParallelism
+
+    target_schema = StructType(source_df.schema.fields + [StructField(embedding_column, ArrayType(FloatType()), nullable=True)])
+
+    def embed(df:DataFrame) -> DataFrame:
+        return (df
+                .repartition(num_partitions)
+                .mapInPandas(get_embedding_partition_fn(host_url, token, endpoint_name, text_column,
+                                                        batch_size=batch_size,
+                                                        max_concurrency=max_concurrency,
+                                                        max_retries=max_retries),
+                             schema=target_schema))
+
+    if not spark.catalog.tableExists(target_table_name):
+        mode = "full"
+        start_time = time.time()
+        embed(source_df).write.saveAsTable(target_table_name)
+        elapsed_seconds = time.time() - start_time
+        spark.sql(f"ALTER TABLE {target_table_name} SET TBLPROPERTIES (delta.enableChangeDataFeed = true) ")
+        rows_embedded = spark.table(target_table_name).count()
+        rows_deleted = 0
+    elif get_embeddings_source_version(target_table_name) == source_version:
+        print(f"{target_table_name} is up to date with {source_table_name} version {source_version}. Skipping embedding.")
+        mode, rows_embedded, rows_deleted, elapsed_seconds = "skipped", 0, 0, 0.0
+    else:
+        target_df = spark.table(target_table_name)
+        embedded_version = get_embeddings_source_version(target_table_name)
+        upserts_df, deletes_df = None, None
+        if embedded_version is not None:
+            try:
+                upserts_df, deletes_df = get_source_changes(source_table_name, id_column, embedded_version, source_version)
+                #fails here if the change data feed does not cover the versions
+                upserts_df.limit(1).collect()
+                mode = "change_data_feed"
+            except Exception as e:
+                #eg: the table was recreated or the change data feed was enabled after the last run
+                print(f"Change data feed not available for {source_table_name} from version {embedded_version + 1}: {e}")
+                upserts_df, deletes_df = None, None
+        if upserts_df is None:
+            mode = "compare"
+            upserts_df = source_df
+            deletes_df = target_df.select(id_column).join(source_df.select(id_column), on=id_column, how="left_anti")
+
+        #rows whose text did not change keep their embedding, eg: when the source table was overwritten with the same rows
+        changed_df = (upserts_df
+                      .join(target_df.select(id_column, F.col(text_column).alias("embedded_text")), on=id_column, how="left")
+                      .where(F.col("embedded_text").isNull() | (F.col("embedded_text") != F.col(text_column)))
+                      .select(*source_df.columns))
+
+        #the embeddings are written to a staging table, so that the merge does not call the endpoint again when it reads its source twice
+        staging_table_name = f"{target_table_name}_staging"
+        start_time = time.time()
+        embed(changed_df).write.mode("overwrite").option("overwriteSchema", "true").saveAsTable(staging_table_name)
+        elapsed_seconds = time.time() - start_time
+        rows_embedded = spark.table(staging_table_name).count()
+        deleted_ids_df = deletes_df.distinct()
+        rows_deleted = deleted_ids_df.count()
+
+        target_table = DeltaTable.forName(spark, target_table_name)
+        (target_table.alias("t")
+            .merge(spark.table(staging_table_name).alias("s"), f"t.{id_column} = s.{id_column}")
+            .whenMatchedUpdateAll()
+            .whenNotMatchedInsertAll()
+            .execute())
+        if rows_deleted > 0:
+            (target_table.alias("t")
+                .merge(deleted_ids_df.alias("s"), f"t.{id_column} = s.{id_column}")
+                .whenMatchedDelete()
+                .execute())
+        spark.sql(f"DROP TABLE IF EXISTS {staging_table_name}")
+
+    spark.sql(f"ALTER TABLE {target_table_name} SET TBLPROPERTIES ('{embeddings_source_version_property}' = '{source_version}')")
+
+    return {"table_name":target_table_name,
+            "mode":mode,
+            "source_version":source_version,
+            "rows_embedded":rows_embedded,
+            "rows_deleted":rows_deleted,
+            "seconds":round(elapsed_seconds, 2),
+            "rows_per_second":round(rows_embedded / elapsed_seconds, 2) if elapsed_seconds > 0 else None}
+
+# COMMAND ----------
+
+import os
+import numpy as np
+
+def export_client_shards(embeddings_table_name:str, client_column:str, columns:[str], shard_path:str) -> pd.DataFrame:
+    """
+    Writes one shard file per client, `<shard_path>/<client>.npz`, with the given columns and the embeddings.
+    The shards are loaded on demand by the `BenefitShardCache` of the agent.
+    """
+    os.makedirs(shard_path, exist_ok=True)
+
+    def write_shard(pdf):
+        client_id = pdf[client_column].iloc[0]
+        shard_arrays = {c:pdf[c].to_numpy() if pdf[c].dtype != object else pdf[c].astype(str).to_numpy(dtype=str) for c in columns}
+        shard_arrays[embedding_column] = np.array(pdf[embedding_column].tolist(), dtype=np.float32)
+        np.savez(os.path.join(shard_path, f"{client_id}.npz"), **shard_arrays)
+        return pd.DataFrame({client_column:[client_id], "rows":[len(pdf)], "bytes":[sum(a.nbytes for a in shard_arrays.values())]})
+
+    return (spark
+            .table(embeddings_table_name)
+            .select(*dict.fromkeys(columns + [client_column, embedding_column]))
+            .groupBy(client_column)
+            .applyInPandas(write_shard, schema=f"{client_column} string, rows long, bytes long")
+            .toPandas())
@@ -0,0 +1,138 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC ##### Evaluation cache
+# MAGIC
+# MAGIC `EvaluationCache` keeps the outputs of the tool calls and of the judge evaluations on disk, for eg: in a Volume, so that re-running an unchanged evaluation makes no endpoint calls.
+# MAGIC Each output is content addressed: its key is the hash of the tool or judge name, the model endpoint, the prompt version and the inputs.
+# MAGIC Changing the prompt of a tool, the evaluated model, the evaluation data or the version of the judges gives new keys, and only those are computed.
+# MAGIC - `call` caches a single tool call, `call_with_cache_hit` also tells whether the output was read from the cache, for eg: to leave the hits out of the latency metrics
+# MAGIC - `evaluate` caches a whole `mlflow.evaluate` of static data, like the `databricks-agent` evaluation whose judges run inside `mlflow.evaluate`, and logs the cached metrics and results to the active run on a hit
+# MAGIC
+# MAGIC The cache does not see the data behind the tools, clear it (or use a new `cache_path`) after the vector indexes or the lookup tables change.
+# MAGIC
+# MAGIC **NOTE:** Plain python, does not need `spark`
+
+# COMMAND ----------
+
+import os
+import json
+import uuid
+import hashlib
+import threading
+import mlflow
+import pandas as pd
+from io import StringIO
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from importlib.metadata import version, PackageNotFoundError
+
+def get_prompt_version(prompt:str) -> str:
+    """Short hash of a prompt template, so that editing the prompt invalidates the cached outputs"""
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:12]
+
+def get_judge_version(package_names:[str]=["databricks-agents", "mlflow"]) -> str:
+    """Versions of the packages that implement the judges, the judge prompts change with them"""
+    def get_package_version(package_name:str) -> str:
+        try:
+            return version(package_name)
+        except PackageNotFoundError:
+            return None
+    return ",".join([f"{p}=={get_package_version(p)}" for p in package_names])
+
+def get_cache_key(name:str, model_endpoint_name:str, prompt_version:str, inputs:dict) -> str:
+    key_json = json.dumps({"name":name,
+                           "model_endpoint_name":model_endpoint_name,
+                           "prompt_version":prompt_version,
+                           "inputs":inputs}, sort_keys=True, default=str)
+    return hashlib.sha256(key_json.encode("utf-8")).hexdigest()
+
+@dataclass
+class CachedEvaluationResult():
+    """The `metrics` and `tables` of an `mlflow.evaluate` result, computed or read from the cache"""
+    metrics:dict
+    tables:dict
+
+class EvaluationCache():
+    """
+    Outputs of tool calls and judge evaluations, one JSON file per key under `cache_path/<name>/`.
+    With `refresh`, the cached outputs are ignored and overwritten.
+    """
+    def __init__(self, cache_path:str, refresh:bool=False):
+        self.cache_path = cache_path
+        self.refresh = refresh
+        self.lock = threading.Lock()
+        self.metrics = {}
+
+    def __count(self, name:str, metric:str):
+        with self.lock:
+            name_metrics = self.metrics.setdefault(name, {"hits":0, "misses":0})
+            name_metrics[metric] += 1
+
+    def __get_entry_path(self, name:str, key:str) -> str:
+        return os.path.join(self.cache_path, name, f"{key}.json")
+
+    def get(self, name:str, key:str) -> dict:
+        entry_path = self.__get_entry_path(name, key)
+        if self.refresh or not os.path.exists(entry_path):
+            return None
+        with open(entry_path, "r") as f:
+            return json.load(f)
+
+    def put(self, name:str, key:str, entry:dict):
+        entry_path = self.__get_entry_path(name, key)
+        os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+        #written to a temporary file first, so that concurrent rows never read a partial entry
+        temp_path = f"{entry_path}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump({**entry, "created":datetime.now(timezone.utc).isoformat()}, f, default=str)
+        os.replace(temp_path, entry_path)
+
+    def call_with_cache_hit(self, name:str, model_endpoint_name:str, prompt_version:str, inputs:dict, fn) -> (object, bool):
+        """Returns the output of `call` and whether it was read from the cache"""
+        key = get_cache_key(name, model_endpoint_name, prompt_version, inputs)
+        entry = self.get(name, key)
+        if entry is not None:
+            self.__count(name, "hits")
+            return entry["output"], True
+
+        self.__count(name, "misses")
+        output = fn()
+        self.put(name, key, {"name":name, "model_endpoint_name":model_endpoint_name, "prompt_version":prompt_version,
+                             "inputs":inputs, "output":output})
+        return output, False
+
+    def call(self, name:str, model_endpoint_name:str, prompt_version:str, inputs:dict, fn):
+        """Returns the cached output of the tool call with these inputs, or calls `fn` and caches its JSON serializable output"""
+        output, _ = self.call_with_cache_hit(name, model_endpoint_name, prompt_version, inputs, fn)
+        return output
+
+    def evaluate(self, name:str, model_endpoint_name:str, data:pd.DataFrame, judge_version:str=None, **evaluate_kwargs) -> CachedEvaluationResult:
+        """
+        Returns the metrics and tables of `mlflow.evaluate(data=data, **evaluate_kwargs)`, from the cache when the same data was
+        evaluated by the same judges. On a hit, the metrics and the result tables are logged to the active run as `mlflow.evaluate` would.
+        """
+        judge_version = judge_version if judge_version is not None else get_judge_version()
+        inputs = {"data":data.to_json(orient="split", default_handler=str),
+                  "evaluate_kwargs":json.dumps(evaluate_kwargs, sort_keys=True, default=str)}
+        key = get_cache_key(name, model_endpoint_name, judge_version, inputs)
+        entry = self.get(name, key)
+        if entry is not None:
+            self.__count(name, "hits")
+            result = CachedEvaluationResult(metrics=entry["output"]["metrics"],
+                                            tables={t:pd.read_json(StringIO(table_json), orient="split") for t, table_json in entry["output"]["tables"].items()})
+            mlflow.log_metrics(result.metrics)
+            for table_name, table in result.tables.items():
+                mlflow.log_table(table, f"{table_name}.json")
+            return result
+
+        self.__count(name, "misses")
+        evaluation = mlflow.evaluate(data=data, **evaluate_kwargs)
+        result = CachedEvaluationResult(metrics=evaluation.metrics, tables=evaluation.tables)
+        self.put(name, key, {"name":name, "model_endpoint_name":model_endpoint_name, "prompt_version":judge_version,
+                             "output":{"metrics":result.metrics,
+                                       "tables":{t:table.to_json(orient="split", default_handler=str) for t, table in result.tables.items()}}})
+        return result
+
+    def get_metrics(self) -> pd.DataFrame:
+        """Hits and misses of each tool and judge in this session, each miss is one or more endpoint calls"""
+        return pd.DataFrame.from_dict(self.metrics, orient="index")
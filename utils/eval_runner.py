@@ -0,0 +1,125 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC ##### Concurrent evaluation runner
+# MAGIC
+# MAGIC `ConcurrentEvaluationRunner` runs a tool or the agent on the rows of an evaluation dataframe with bounded parallelism, instead of one row after the other,
+# MAGIC so that the wall time of an evaluation is close to that of its slowest rows instead of the sum of all the rows.
+# MAGIC The outputs are returned in the order of the rows, with the latency, the retrieved context, the error and the cache hit of each row.
+# MAGIC The rows answered from the `EvaluationCache` take no time, so the latency and throughput metrics are over the other rows only.
+# MAGIC The runner can be passed as the model of `mlflow.evaluate`, or its results used as the static `response` and `retrieved_context` of a `databricks-agent` evaluation.
+# MAGIC
+# MAGIC `run_model_sweep` runs the rows for several candidate model endpoints at the same time, with a cap on the rows in flight for each endpoint,
+# MAGIC so that adding a candidate to a comparison does not make it take linearly longer.
+# MAGIC
+# MAGIC **NOTE:** Plain python, does not need `spark`
+
+# COMMAND ----------
+
+import time
+import contextvars
+import mlflow
+import numpy as np
+import pandas as pd
+from mlflow.entities import Trace
+from concurrent.futures import ThreadPoolExecutor
+
+class ConcurrentEvaluationRunner():
+    """
+    Runs `row_fn` on each row of the evaluation data with at most `max_workers` rows in flight.
+    `row_fn` takes a row and returns a dict with the `response` of the row and optionally its `retrieved_context` and whether it was a `cache_hit`.
+    A row that fails gets an empty response and its `error`, so that one failure does not lose the other rows.
+    """
+    def __init__(self, row_fn, max_workers:int=4):
+        self.row_fn = row_fn
+        self.max_workers = max_workers
+        self.results = None
+        self.wall_seconds = None
+
+    def __run_row(self, row:pd.Series) -> dict:
+        start_time = time.time()
+        try:
+            output = self.row_fn(row)
+            error = None
+        except Exception as e:
+            output = {"response":""}
+            error = repr(e)
+        return {"response":output["response"],
+                "retrieved_context":output.get("retrieved_context"),
+                "latency_ms":round((time.time() - start_time) * 1000, 1),
+                "error":error,
+                "cache_hit":bool(output.get("cache_hit", False))}
+
+    def run(self, data:pd.DataFrame) -> pd.DataFrame:
+        """Returns the `response`, `retrieved_context`, `latency_ms`, `error` and `cache_hit` of each row, with the index of `data`"""
+        rows = [row for _, row in data.iterrows()]
+        #each row runs in a copy of the caller's context, so that its traces are attached to the active run or evaluation
+        contexts = [contextvars.copy_context() for _ in rows]
+        start_time = time.time()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            outputs = list(executor.map(lambda c, r: c.run(self.__run_row, r), contexts, rows))
+        self.wall_seconds = round(time.time() - start_time, 2)
+        self.results = pd.DataFrame(outputs, index=data.index)
+        return self.results
+
+    def __call__(self, data:pd.DataFrame) -> pd.Series:
+        """The responses of the rows, for `mlflow.evaluate`"""
+        return self.run(data)["response"]
+
+    def get_latency_metrics(self) -> dict:
+        """
+        Row counts and, over the rows that were not cache hits, the latency and throughput.
+        When all the rows were cache hits, nothing was measured and only the counts are returned.
+        """
+        misses = self.results[~self.results["cache_hit"]]
+        metrics = {"eval_runner/rows":len(self.results),
+                   "eval_runner/errors":int(self.results["error"].notna().sum()),
+                   "eval_runner/cache_hits":len(self.results) - len(misses)}
+        if len(misses) == 0:
+            return metrics
+        latencies_ms = misses["latency_ms"]
+        metrics = {**metrics,
+                   "eval_runner/wall_seconds":self.wall_seconds,
+                   #the wall time of running the rows one after the other
+                   "eval_runner/serial_seconds":round(float(latencies_ms.sum()) / 1000, 2),
+                   "eval_runner/row_latency_p50_ms":round(float(np.percentile(latencies_ms, 50)), 1),
+                   "eval_runner/row_latency_p95_ms":round(float(np.percentile(latencies_ms, 95)), 1)}
+        #left out rather than None, mlflow only logs numeric metrics
+        if self.wall_seconds > 0:
+            metrics["eval_runner/throughput_rows_per_second"] = round(len(misses) / self.wall_seconds, 2)
+        return metrics
+
+    def log_results(self, artifact_file:str="eval_runner_results.json"):
+        """Logs the latency metrics and the per row results to the active run, the `cache_hit` column tells which rows were not measured"""
+        mlflow.log_metrics(self.get_latency_metrics())
+        mlflow.log_table(self.results.assign(retrieved_context=self.results["retrieved_context"].astype(str)), artifact_file)
+
+def run_model_sweep(row_fns:dict, data:pd.DataFrame, max_concurrency_per_endpoint:int=4, endpoint_max_concurrency:dict={}) -> dict:
+    """
+    Runs the rows of `data` for every model endpoint of `row_fns`, a dict of model endpoint name to its row function, and returns a dict of
+    model endpoint name to its `ConcurrentEvaluationRunner` with the results. All the (model, row) pairs run together, with at most
+    `max_concurrency_per_endpoint` rows in flight per endpoint, or the cap of the endpoint in `endpoint_max_concurrency`,
+    so that a slow or rate limited endpoint does not hold back the others.
+    """
+    runners = {model_endpoint_name:ConcurrentEvaluationRunner(row_fn, max_workers=endpoint_max_concurrency.get(model_endpoint_name, max_concurrency_per_endpoint))
+               for model_endpoint_name, row_fn in row_fns.items()}
+    with ThreadPoolExecutor(max_workers=len(runners)) as executor:
+        #each endpoint runs its rows with its own bounded pool
+        sweeps = [executor.submit(contextvars.copy_context().run, runner.run, data) for runner in runners.values()]
+        for sweep in sweeps:
+            sweep.result()
+    return runners
+
+def get_sweep_report(results:[dict], runners:dict) -> pd.DataFrame:
+    """The evaluation metrics of each model next to its latency and throughput, `results` are the `model` and `result` of each model"""
+    return pd.DataFrame([{"model":r["model"], **r["result"].metrics, **runners[r["model"]].get_latency_metrics()} for r in results])
+
+def get_retrieved_context(trace:Trace, span_name:str="get_benefit_retriever", content_index:int=1) -> [dict]:
+    """
+    The documents retrieved in the `span_name` spans of the trace, in the `retrieved_context` format of `databricks-agent` evaluations.
+    The span outputs are vector search results and `content_index` is the position of the content in their rows.
+    """
+    if trace is None:
+        return []
+    return [{"content":row[content_index]}
+            for span in trace.data.spans if span.name == span_name and isinstance(span.outputs, dict)
+            for row in span.outputs.get("result", {}).get("data_array", [])]
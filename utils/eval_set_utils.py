@@ -214,7 +214,9 @@ def identify_potential_eval_set_records(raw_requests_with_feedback_df):
 
 # COMMAND ----------
 
-def create_potential_evaluation_set(request_log_df, assessment_log_df):
+def create_potential_evaluation_set(request_log_df, assessment_log_df, excluded_client_request_ids:List[str]=[keep_warm_client_request_id]):
+    # Synthetic requests, like the keep-warm pings of the endpoint, are not evaluation set candidates
+    request_log_df = request_log_df.where(F.col("client_request_id").isNull() | ~F.col("client_request_id").isin(excluded_client_request_ids))
     raw_requests_with_feedback_df = attach_ground_truth(request_log_df, assessment_log_df)
     requests_with_feedback_df = identify_potential_eval_set_records(raw_requests_with_feedback_df)
     return requests_with_feedback_df
@@ -0,0 +1,107 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC ##### Change aware sync of `TRIGGERED` vector indexes
+# MAGIC
+# MAGIC Utility methods to sync a Delta Sync vector index only when its source table has new commits.
+# MAGIC The Delta version of the source table is compared with the last commit version processed by the index.
+# MAGIC If there are new commits, `index.sync()` is triggered and we wait (with backoff) for the index to catch up.
+# MAGIC Every attempt is recorded in the `vector_index_sync_log` table along with the sync duration and the number of rows re-embedded, including the syncs that fail or time out, with the `FAILED` status.
+# MAGIC
+# MAGIC **NOTE:** Expects `spark`, `catalog` and `schema` to be defined by `./init`
+
+# COMMAND ----------
+
+import time
+from datetime import datetime
+from pyspark.sql.types import StructType, StructField, StringType, LongType, DoubleType, TimestampType
+
+index_sync_log_table_name = "vector_index_sync_log"
+
+index_sync_log_schema = StructType([
+    StructField("index_name",StringType(), nullable=False),
+    StructField("source_table_name",StringType(), nullable=False),
+    StructField("from_version",LongType(), nullable=True),
+    StructField("to_version",LongType(), nullable=False),
+    StructField("rows_reembedded",LongType(), nullable=True),
+    StructField("sync_seconds",DoubleType(), nullable=True),
+    StructField("status",StringType(), nullable=False),
+    StructField("synced_at",TimestampType(), nullable=False),
+])
+
+def get_table_version(fq_table_name:str) -> int:
+    """Returns the latest Delta commit version of the table"""
+    return spark.sql(f"DESCRIBE HISTORY {fq_table_name} LIMIT 1").collect()[0]["version"]
+
+def get_index_processed_version(index) -> int:
+    """Returns the last source commit version processed by the index or None if it was never synced"""
+    status = index.describe().get("status", {})
+    return status.get("triggered_update_status", {}).get("last_processed_commit_version")
+
+def get_changed_row_count(fq_table_name:str, from_version:int, to_version:int) -> int:
+    """Counts the rows that need to be embedded again using the change data feed of the table"""
+    if from_version is None:
+        return spark.table(fq_table_name).count()
+    try:
+        return (spark
+                .sql(f"SELECT 1 FROM table_changes('{fq_table_name}', {from_version + 1}, {to_version}) \
+                       WHERE _change_type IN ('insert','update_postimage')")
+                .count())
+    except Exception as e:
+        #change data feed is not available for the whole range, eg: table was recreated
+        #the index will have to do a full sync in this case
+        print(f"Change data feed not available for {fq_table_name} from version {from_version + 1}: {e}")
+        return spark.table(fq_table_name).count()
+
+def wait_for_index_sync(index, target_version:int, timeout_seconds:int=3600, initial_wait_seconds:float=5.0, max_wait_seconds:float=60.0):
+    """Waits with exponential backoff until the index has processed the target commit version"""
+    start_time = time.time()
+    wait_seconds = initial_wait_seconds
+    while True:
+        status = index.describe().get("status", {})
+        processed_version = status.get("triggered_update_status", {}).get("last_processed_commit_version")
+        if status.get("ready", False) and processed_version is not None and processed_version >= target_version:
+            return
+        if "FAILED" in status.get("detailed_state", ""):
+            raise Exception(f"Index sync failed: {status.get('message')}")
+        if time.time() - start_time > timeout_seconds:
+            raise Exception(f"Index did not reach version {target_version} in {timeout_seconds} seconds. Current status: {status.get('detailed_state')}")
+        time.sleep(wait_seconds)
+        wait_seconds = min(wait_seconds * 2, max_wait_seconds)
+
+def log_index_sync(index_name:str, source_table_name:str, from_version:int, to_version:int, rows_reembedded:int, sync_seconds:float, status:str):
+    log_df = spark.createDataFrame([(index_name, source_table_name, from_version, to_version, rows_reembedded, sync_seconds, status, datetime.now())],
+                                   schema=index_sync_log_schema)
+    log_df.write.mode("append").saveAsTable(f"{catalog}.{schema}.{index_sync_log_table_name}")
+
+def sync_index_if_changed(vsc, vector_search_endpoint_name:str, index_name:str, source_table_name:str, timeout_seconds:int=3600) -> dict:
+    """
+    Triggers a sync of a TRIGGERED Delta Sync index only if the source table has new commits.
+    Waits for the sync to complete and records the sync duration and rows re-embedded.
+    """
+    index = vsc.get_index(vector_search_endpoint_name, index_name)
+    source_version = get_table_version(source_table_name)
+    processed_version = get_index_processed_version(index)
+
+    if processed_version is not None and processed_version >= source_version:
+        print(f"Index {index_name} is up to date with {source_table_name} version {source_version}. Skipping sync.")
+        log_index_sync(index_name, source_table_name, processed_version, source_version, 0, 0.0, "SKIPPED")
+        return {"index_name":index_name, "status":"SKIPPED", "rows_reembedded":0, "sync_seconds":0.0}
+
+    rows_reembedded = get_changed_row_count(source_table_name, processed_version, source_version)
+    print(f"Syncing index {index_name} from version {processed_version} to {source_version}. Rows to embed: {rows_reembedded}")
+
+    start_time = time.time()
+    try:
+        index.sync()
+        wait_for_index_sync(index, source_version, timeout_seconds=timeout_seconds)
+    except Exception as e:
+        #record the failed attempt with the time spent before it failed or timed out
+        sync_seconds = round(time.time() - start_time, 2)
+        print(f"Index {index_name} sync failed after {sync_seconds} seconds: {e}")
+        log_index_sync(index_name, source_table_name, processed_version, source_version, rows_reembedded, sync_seconds, "FAILED")
+        raise
+    sync_seconds = round(time.time() - start_time, 2)
+
+    print(f"Index {index_name} synced in {sync_seconds} seconds")
+    log_index_sync(index_name, source_table_name, processed_version, source_version, rows_reembedded, sync_seconds, "SYNCED")
+    return {"index_name":index_name, "status":"SYNCED", "rows_reembedded":rows_reembedded, "sync_seconds":sync_seconds}
@@ -45,7 +45,7 @@ client_names = ["sugarshack","chillystreet"]
 #Imaginary Payor name
 payor_name = "LemonDrop"
 
-#cpt code file name
+#cpt code file name. Change to a newer catalog version, eg: cpt_codes1.txt, and run 01_Setup Data to merge the changes
 cpt_file = "cpt_codes.txt"
 #Data table names
 member_table_name = "member_enrolment"
@@ -53,6 +53,11 @@ member_accumulators_table_name = "member_accumulators"
 cpt_code_table_name = "cpt_codes"
 procedure_cost_table_name = "procedure_cost"
 sbc_details_table_name = "sbc_details"
+sbc_source_files_table_name = "sbc_source_files"
+#keep-warm pings of the serving endpoints
+keep_warm_log_table_name = "endpoint_keep_warm_log"
+#client request id of the keep-warm pings of the agent endpoint, so that they are left out of the evaluation set candidates
+keep_warm_client_request_id = "keep-warm-ping"
 
 #MLflow experiment tag
 experiment_tag = f"carecost_compass_agent"
@@ -0,0 +1,149 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC ##### Keep-warm for scale to zero serving endpoints
+# MAGIC
+# MAGIC Utility methods to keep the feature serving endpoints and the agent endpoint warm during business hours.
+# MAGIC A scheduled job sends a cheap synthetic query to each endpoint at an interval below the scale to zero idle timeout, so that customers do not hit a cold start.
+# MAGIC Each ping is logged with its latency. Pings slower than the cold start threshold found the endpoint scaled to zero, which gives the cold start latency.
+# MAGIC `get_keep_warm_report` compares the cold start latency avoided by the warm pings against the compute cost of keeping the endpoints up.
+# MAGIC
+# MAGIC **NOTE:** Expects `spark`, `db_host_url` and `db_token` to be defined by `./init`
+
+# COMMAND ----------
+
+import json
+import time
+import requests
+import pytz
+from datetime import datetime
+from databricks.sdk import WorkspaceClient
+from databricks.sdk.service import jobs
+from pyspark.sql import functions as F
+
+quartz_days = ["MON", "TUE", "WED", "THU", "FRI", "SAT", "SUN"]
+
+def get_business_hours_schedule(request:dict, start_hour:int=8, end_hour:int=18, days:[str]=quartz_days[:5],
+                                timezone_id:str="US/Eastern", interval_minutes:int=15) -> dict:
+    """
+    Keep-warm schedule of an endpoint, the `request` is sent every `interval_minutes` from `start_hour` to `end_hour` on `days`.
+    Keep `interval_minutes` below the scale to zero idle timeout of the endpoint (30 minutes for model serving).
+    """
+    return {"request":request,
+            "start_hour":start_hour,
+            "end_hour":end_hour,
+            "days":days,
+            "timezone_id":timezone_id,
+            "interval_minutes":interval_minutes}
+
+def is_within_business_hours(schedule:dict, now:datetime) -> bool:
+    local_now = now.astimezone(pytz.timezone(schedule["timezone_id"]))
+    return (quartz_days[local_now.weekday()] in schedule["days"]
+            and schedule["start_hour"] <= local_now.hour < schedule["end_hour"])
+
+def send_keep_warm_request(endpoint_name:str, request:dict, timeout_seconds:int=300) -> dict:
+    request_url = f"{db_host_url}/serving-endpoints/{endpoint_name}/invocations"
+    request_headers = {"Authorization": f"Bearer {db_token}", "Content-Type": "application/json"}
+    start_time = time.time()
+    try:
+        response = requests.request(method='POST', headers=request_headers, url=request_url, data=json.dumps(request), timeout=timeout_seconds)
+        status_code = response.status_code
+    except requests.exceptions.RequestException as e:
+        status_code = None
+    return {"endpoint_name":endpoint_name,
+            "ping_time":datetime.now(pytz.utc),
+            "latency_ms":round((time.time() - start_time) * 1000, 1),
+            "status_code":status_code}
+
+def get_last_ping_times(fq_log_table_name:str) -> dict:
+    if not spark.catalog.tableExists(fq_log_table_name):
+        return {}
+    return {r.endpoint_name:r.last_ping_time for r in
+            spark.table(fq_log_table_name).groupBy("endpoint_name").agg(F.max("ping_time").alias("last_ping_time")).collect()}
+
+def run_keep_warm(keep_warm_schedules:dict, fq_log_table_name:str) -> [dict]:
+    """
+    Pings the endpoints that are within business hours and whose last ping is older than their interval,
+    and appends the pings to the log table.
+    """
+    now = datetime.now(pytz.utc)
+    last_ping_times = get_last_ping_times(fq_log_table_name)
+    pings = []
+    for endpoint_name, schedule in keep_warm_schedules.items():
+        if not is_within_business_hours(schedule, now):
+            continue
+        last_ping_time = last_ping_times.get(endpoint_name)
+        #a minute of slack, so that a job triggered at the interval is not skipped
+        if last_ping_time is not None and (now - last_ping_time.astimezone(pytz.utc)).total_seconds() < (schedule["interval_minutes"] - 1) * 60:
+            continue
+        pings.append(send_keep_warm_request(endpoint_name, schedule["request"]))
+
+    if len(pings) > 0:
+        (spark
+         .createDataFrame(pings, schema="endpoint_name string, ping_time timestamp, latency_ms double, status_code int")
+         .write
+         .mode("append")
+         .saveAsTable(fq_log_table_name))
+    return pings
+
+def schedule_keep_warm_job(job_name:str, keep_warm_schedules:dict, fq_log_table_name:str, notebook_path:str,
+                           timezone_id:str="US/Eastern", existing_cluster_id:str=None) -> int:
+    """
+    Creates or updates a job that runs the `keep_warm_endpoints` notebook during the union of the business hours of the endpoints,
+    at the shortest interval. Each run only pings the endpoints that are due.
+    If the schedules are not all in `timezone_id`, the job runs at every hour of the days and the notebook skips the endpoints outside their hours.
+    Without `existing_cluster_id` the job runs on serverless compute.
+    """
+    interval_minutes = min([s["interval_minutes"] for s in keep_warm_schedules.values()])
+    start_hour = min([s["start_hour"] for s in keep_warm_schedules.values()])
+    end_hour = max([s["end_hour"] for s in keep_warm_schedules.values()])
+    hours = f"{start_hour}-{end_hour - 1}" if all(s["timezone_id"] == timezone_id for s in keep_warm_schedules.values()) else "*"
+    days = [d for d in quartz_days if any(d in s["days"] for s in keep_warm_schedules.values())]
+    quartz_cron_expression = f"0 0/{interval_minutes} {hours} ? * {','.join(days)}"
+
+    workspace = WorkspaceClient()
+    job_settings = jobs.JobSettings(
+        name=job_name,
+        tasks=[jobs.Task(task_key="keep_warm_endpoints",
+                         notebook_task=jobs.NotebookTask(notebook_path=notebook_path,
+                                                         base_parameters={"keep_warm_schedules":json.dumps(keep_warm_schedules),
+                                                                          "log_table_name":fq_log_table_name}),
+                         existing_cluster_id=existing_cluster_id)],
+        schedule=jobs.CronSchedule(quartz_cron_expression=quartz_cron_expression, timezone_id=timezone_id),
+        max_concurrent_runs=1)
+
+    existing_jobs = list(workspace.jobs.list(name=job_name))
+    if len(existing_jobs) > 0:
+        job_id = existing_jobs[0].job_id
+        workspace.jobs.reset(job_id=job_id, new_settings=job_settings)
+        print(f"Keep-warm job {job_name} updated with schedule {quartz_cron_expression}.")
+    else:
+        job_id = workspace.jobs.create(name=job_settings.name, tasks=job_settings.tasks, schedule=job_settings.schedule,
+                                       max_concurrent_runs=job_settings.max_concurrent_runs).job_id
+        print(f"Keep-warm job {job_name} created with schedule {quartz_cron_expression}.")
+    return job_id
+
+def get_keep_warm_report(fq_log_table_name:str, cost_per_hour:dict, cold_start_threshold_ms:float=10000, idle_timeout_minutes:int=30):
+    """
+    Summarizes the pings of each endpoint.
+    - `cold_pings` found the endpoint scaled to zero and `cold_start_ms` is their mean latency
+    - `idle_windows_kept_warm` counts the `idle_timeout_minutes` windows with a warm ping. Without the pings, the endpoint could have scaled to zero once per window,
+      so at most one cold start is avoided per window, however many pings it has
+    - `cold_start_seconds_avoided` is an upper bound: one cold start per window kept warm, as if a customer request arrived in each of them
+    - `warm_hours` counts the distinct hours with a ping and `keep_warm_cost` prices them with `cost_per_hour` of the endpoint, for eg: DBUs per hour of the workload size times the DBU price
+    """
+    cost_df = spark.createDataFrame([(k, float(v)) for k, v in cost_per_hour.items()], schema="endpoint_name string, cost_per_hour double")
+    return (spark
+            .table(fq_log_table_name)
+            .withColumn("is_cold", F.col("latency_ms") >= cold_start_threshold_ms)
+            .groupBy("endpoint_name")
+            .agg(F.count("*").alias("pings"),
+                 F.sum(F.when(F.col("is_cold"), 1).otherwise(0)).alias("cold_pings"),
+                 F.avg(F.when(F.col("is_cold"), F.col("latency_ms"))).alias("cold_start_ms"),
+                 F.avg(F.when(~F.col("is_cold"), F.col("latency_ms"))).alias("warm_ms"),
+                 F.countDistinct(F.date_trunc("hour", F.col("ping_time"))).alias("warm_hours"),
+                 F.countDistinct(F.when(~F.col("is_cold"), F.floor(F.unix_timestamp("ping_time") / (idle_timeout_minutes * 60)))).alias("idle_windows_kept_warm"),
+                 F.min("ping_time").alias("first_ping_time"),
+                 F.max("ping_time").alias("last_ping_time"))
+            .withColumn("cold_start_seconds_avoided", F.col("idle_windows_kept_warm") * F.col("cold_start_ms") / 1000)
+            .join(cost_df, on="endpoint_name", how="left")
+            .withColumn("keep_warm_cost", F.col("warm_hours") * F.col("cost_per_hour")))
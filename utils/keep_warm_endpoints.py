@@ -0,0 +1,27 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC ##### Keep the serving endpoints warm
+# MAGIC
+# MAGIC Sends the keep-warm request to each endpoint of the `keep_warm_schedules` JSON parameter that is within its business hours and due, and logs the pings to the `log_table_name` table.
+# MAGIC This notebook is scheduled by `schedule_keep_warm_job` in `./keep_warm`.
+
+# COMMAND ----------
+
+# MAGIC %run ./init
+
+# COMMAND ----------
+
+# MAGIC %run ./keep_warm
+
+# COMMAND ----------
+
+dbutils.widgets.text("keep_warm_schedules", "{}")
+dbutils.widgets.text("log_table_name", "")
+
+# COMMAND ----------
+
+keep_warm_schedules = json.loads(dbutils.widgets.get("keep_warm_schedules"))
+log_table_name = dbutils.widgets.get("log_table_name")
+
+for ping in run_keep_warm(keep_warm_schedules, log_table_name):
+    print(f"Pinged {ping['endpoint_name']}: status {ping['status_code']} in {ping['latency_ms']} ms")
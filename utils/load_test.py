@@ -0,0 +1,217 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC ##### Load test of the agent
+# MAGIC
+# MAGIC Utility methods to drive `CareCostCompassAgent` with concurrent requests and report where the latency goes.
+# MAGIC - `predict_in_process` calls `predict` of a loaded agent and `predict_over_rest` posts to the serving endpoint like `score_model`
+# MAGIC - `run_load_test` sends the requests with a fixed `concurrency` (closed loop) or at an `arrival_rate` of requests per second with Poisson arrivals (open loop)
+# MAGIC - `local_standins` runs the local stand-ins of the endpoints in a subprocess for the duration of a block
+# MAGIC - `get_load_test_report` gives the throughput, the p50/p95/p99 latency and the error rates, and `get_stage_report` the latency of each traced stage of the agent
+# MAGIC
+# MAGIC In the open loop, the latency of a request is measured from its scheduled arrival, so the time spent queued behind slow requests is counted.
+# MAGIC Point the agent at the local stand-ins of the endpoints (`scripts/local_standins.py`) to measure the agent itself without the noise of the real endpoints.
+# MAGIC
+# MAGIC **NOTE:** Plain python, does not need `spark`
+# MAGIC
+
+# COMMAND ----------
+
+import sys
+import json
+import time
+import random
+import tempfile
+import threading
+import subprocess
+import requests
+import mlflow
+import numpy as np
+import pandas as pd
+from mlflow.entities import Trace
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+#the agent answers with this prefix when it rejects a question or a tool fails
+declined_response_prefix = "Sorry, I cannot answer that question"
+
+def wait_for_standins(process:subprocess.Popen, stderr_file, port:int, timeout_seconds:float=120):
+    """Polls the `/metrics` route of the stand-ins until they answer, the stand-ins load the snapshots and build the vector indexes before listening"""
+    start_time = time.time()
+    while True:
+        if process.poll() is not None:
+            stderr_file.seek(0)
+            raise Exception(f"The local stand-ins exited with code {process.returncode}:\n{stderr_file.read().decode('utf-8', errors='replace')}")
+        try:
+            if requests.get(f"http://127.0.0.1:{port}/metrics", timeout=1).status_code == 200:
+                return
+        except requests.exceptions.RequestException:
+            pass
+        if time.time() - start_time > timeout_seconds:
+            raise TimeoutError(f"The local stand-ins did not answer on port {port} within {timeout_seconds} seconds")
+        time.sleep(0.5)
+
+@contextmanager
+def local_standins(script_path:str, port:int, standin_args:[str], timeout_seconds:float=120):
+    """
+    Starts `scripts/local_standins.py` on `port` in a subprocess and waits until it answers. The subprocess is killed when the block exits,
+    including on errors. The stderr of the stand-ins goes to a temporary file, so that it is reported if they fail to start and never fills a pipe.
+    """
+    stderr_file = tempfile.TemporaryFile()
+    process = subprocess.Popen([sys.executable, script_path, "--port", str(port), *standin_args],
+                               stdout=subprocess.DEVNULL, stderr=stderr_file)
+    try:
+        wait_for_standins(process, stderr_file, port, timeout_seconds)
+        yield process
+    finally:
+        process.kill()
+        process.wait()
+        stderr_file.close()
+
+def get_load_test_inputs(questions:[str], member_ids:[str], num_requests:int, seed:int=42) -> [pd.DataFrame]:
+    """
+    Returns `num_requests` model inputs, each pairing a random question with the next member id.
+    The member id is passed in the system message, which the agent reads outside of the dev and test environments.
+    Use `sample_member_ids` in `./synthetic_data` for a realistic mix of hot and cold members.
+    """
+    rng = random.Random(seed)
+    return [pd.DataFrame([{"messages":[{"content":json.dumps({"member_id":member_ids[i % len(member_ids)]}), "role":"system"},
+                                       {"content":rng.choice(questions), "role":"user"}]}])
+            for i in range(num_requests)]
+
+def get_stage_latencies(trace:Trace) -> dict:
+    """Milliseconds spent in each span of the trace, summed when a span name repeats"""
+    stage_ms = {}
+    if trace is None:
+        return stage_ms
+    for span in trace.data.spans:
+        if span.end_time_ns is not None:
+            stage_ms[span.name] = stage_ms.get(span.name, 0.0) + (span.end_time_ns - span.start_time_ns) / 1e6
+    return stage_ms
+
+def predict_in_process(agent):
+    """
+    Returns a request function that calls `predict` of the loaded agent.
+    Each call runs in its own span, so that its trace can be read back from the in-memory buffer of MLflow for the stage latencies.
+    The traces are also logged to the experiment when the span ends, set `MLFLOW_ENABLE_ASYNC_LOGGING=true` to keep the logging out of the measured latency.
+    """
+    def request_fn(model_input:pd.DataFrame) -> (str, dict):
+        with mlflow.start_span(name="load_test_request") as span:
+            response = agent.predict(None, model_input, None)
+        stage_ms = get_stage_latencies(mlflow.get_trace(span.request_id))
+        stage_ms.pop("load_test_request", None)
+        return response["content"], stage_ms
+    return request_fn
+
+def predict_over_rest(serving_endpoint_url:str, token:str, return_trace:bool=False, timeout_seconds:int=300):
+    """
+    Returns a request function that posts to the serving endpoint, in the same format as `score_model`.
+    With `return_trace`, the agent endpoint returns the trace of each request and the stage latencies are read from it.
+    """
+    session = requests.Session()
+    session.headers.update({"Authorization": f"Bearer {token}", "Content-Type": "application/json"})
+
+    def request_fn(model_input:pd.DataFrame) -> (str, dict):
+        request = {"dataframe_split": model_input.to_dict(orient="split")}
+        if return_trace:
+            request["databricks_options"] = {"return_trace": True}
+        response = session.post(serving_endpoint_url, data=json.dumps(request), timeout=timeout_seconds)
+        if response.status_code != 200:
+            raise Exception(f"Request failed with status {response.status_code}, {response.text}")
+        response_json = response.json()
+        trace_dict = response_json.get("databricks_output", {}).get("trace")
+        return response_json["predictions"]["content"], get_stage_latencies(Trace.from_dict(trace_dict) if trace_dict is not None else None)
+    return request_fn
+
+def run_load_test(request_fn, model_inputs:[pd.DataFrame], concurrency:int=8, arrival_rate:float=None,
+                  max_workers:int=64, seed:int=42) -> [dict]:
+    """
+    Sends each of the `model_inputs` once with `request_fn` and returns one record per request.
+    - Closed loop (default): `concurrency` workers each send their next request as soon as the previous one is answered
+    - Open loop: with `arrival_rate`, the requests arrive at that many requests per second with exponential gaps,
+      whether or not the previous ones are answered, and up to `max_workers` are in flight
+    """
+    def timed_request(i:int, scheduled_time:float) -> dict:
+        start_time = time.time()
+        record = {"request":i, "queue_ms":(start_time - scheduled_time) * 1000, "error":None, "declined":False, "stage_ms":{}}
+        try:
+            content, record["stage_ms"] = request_fn(model_inputs[i])
+            record["declined"] = content.startswith(declined_response_prefix)
+        except Exception as e:
+            record["error"] = repr(e)
+        end_time = time.time()
+        record["latency_ms"] = (end_time - scheduled_time) * 1000
+        record["service_ms"] = (end_time - start_time) * 1000
+        record["end_time"] = end_time
+        return record
+
+    load_test_start_time = time.time()
+    if arrival_rate is None:
+        next_request = iter(range(len(model_inputs)))
+        lock = threading.Lock()
+
+        def worker() -> [dict]:
+            records = []
+            while True:
+                with lock:
+                    i = next(next_request, None)
+                if i is None:
+                    return records
+                records.append(timed_request(i, time.time()))
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            workers = [executor.submit(worker) for _ in range(concurrency)]
+            records = [r for w in workers for r in w.result()]
+    else:
+        rng = random.Random(seed)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = []
+            scheduled_time = load_test_start_time
+            for i in range(len(model_inputs)):
+                scheduled_time += rng.expovariate(arrival_rate)
+                time.sleep(max(0.0, scheduled_time - time.time()))
+                futures.append(executor.submit(timed_request, i, scheduled_time))
+            records = [f.result() for f in futures]
+
+    for record in records:
+        record["end_time"] -= load_test_start_time
+    return sorted(records, key=lambda r: r["request"])
+
+def get_latency_percentiles(latencies_ms:[float]) -> dict:
+    if len(latencies_ms) == 0:
+        return {"p50_ms":None, "p95_ms":None, "p99_ms":None, "mean_ms":None}
+    return {"p50_ms":round(float(np.percentile(latencies_ms, 50)), 1),
+            "p95_ms":round(float(np.percentile(latencies_ms, 95)), 1),
+            "p99_ms":round(float(np.percentile(latencies_ms, 99)), 1),
+            "mean_ms":round(float(np.mean(latencies_ms)), 1)}
+
+def get_load_test_report(records:[dict]) -> dict:
+    """
+    Throughput and latency of the load test. The latency percentiles are over the answered requests,
+    `error_rate` counts the failed requests and `declined_rate` the questions the agent declined to answer.
+    """
+    duration_seconds = max([r["end_time"] for r in records])
+    answered = [r for r in records if r["error"] is None]
+    return {"requests":len(records),
+            "duration_seconds":round(duration_seconds, 2),
+            "throughput_rps":round(len(answered) / duration_seconds, 2),
+            "error_rate":round(1 - len(answered) / len(records), 4),
+            "declined_rate":round(sum([1 for r in answered if r["declined"]]) / len(records), 4),
+            **get_latency_percentiles([r["latency_ms"] for r in answered]),
+            "queue_p95_ms":round(float(np.percentile([r["queue_ms"] for r in records], 95)), 1)}
+
+def get_stage_report(records:[dict]) -> pd.DataFrame:
+    """
+    Latency percentiles of each traced stage of the agent over the answered requests.
+    The benefit, procedure and member accumulator flows run in parallel, so the stages do not add up to the request latency.
+    """
+    stage_latencies = {}
+    for record in records:
+        for stage, stage_ms in record["stage_ms"].items():
+            stage_latencies.setdefault(stage, []).append(stage_ms)
+    return (pd.DataFrame([{"stage":stage, "requests":len(latencies_ms), **get_latency_percentiles(latencies_ms)}
+                          for stage, latencies_ms in stage_latencies.items()])
+            .sort_values("p50_ms", ascending=False, ignore_index=True) if len(stage_latencies) > 0 else pd.DataFrame())
+
+def get_error_report(records:[dict]) -> pd.DataFrame:
+    errors = [r["error"] for r in records if r["error"] is not None]
+    return pd.Series(errors, dtype="object").value_counts().rename_axis("error").reset_index(name="requests")
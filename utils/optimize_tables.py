@@ -0,0 +1,18 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC ##### Optimize the lookup tables
+# MAGIC
+# MAGIC Runs `OPTIMIZE` on each table of the comma separated `table_names` parameter, so that the rows written since the last run are clustered.
+# MAGIC This notebook is scheduled by `schedule_optimize_job` in `./table_layout`.
+
+# COMMAND ----------
+
+dbutils.widgets.text("table_names", "")
+
+# COMMAND ----------
+
+table_names = [t.strip() for t in dbutils.widgets.get("table_names").split(",") if t.strip() != ""]
+
+for table_name in table_names:
+    metrics = spark.sql(f"OPTIMIZE {table_name}").collect()[0]["metrics"]
+    print(f"Optimized {table_name}: {metrics['numFilesAdded']} files added, {metrics['numFilesRemoved']} files removed")
@@ -0,0 +1,482 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC ##### Parsing of Summary of Benefits and Coverage (SBC) documents
+# MAGIC
+# MAGIC Utility methods to extract the summary and coverage tables from the SBC PDF files and to convert them to text chunks.
+# MAGIC The tables are extracted with a table extraction engine, camelot lattice on rendered pages or pdfplumber on the vector ruling lines.
+# MAGIC
+# MAGIC **NOTE:** These methods do not need `spark`, so that they can also be run outside of Databricks, eg: by `scripts/benchmark_sbc_parsing.py`
+
+# COMMAND ----------
+
+import os
+import re
+import json
+import time
+import shutil
+import hashlib
+import resource
+import tempfile
+import pandas as pd
+import camelot
+import pdfplumber
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from tempfile import TemporaryDirectory
+from pypdf import PdfReader, PdfWriter
+from camelot.parsers import Lattice
+
+def get_file_hash(file_path : str) -> str :
+    sha256 = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+#lets create a custom backend for camelot to convert pdf to png
+class SBCConversionBackend(object):
+    """
+    Renders the page requested by camelot to png using `pdfplumber`.
+    Rendered pages are cached on local disk keyed by (pdf hash, page, dpi) so that re-runs do not render again.
+    If `max_pixels` is set, the resolution is lowered for large pages so that the image stays under that size.
+    """
+    def __init__(self, resolution:int=600, max_pixels:int=None, cache_dir:str=None):
+        self.resolution = resolution
+        self.max_pixels = max_pixels
+        self.cache_dir = cache_dir if cache_dir is not None else os.path.join(tempfile.gettempdir(), "sbc_page_cache")
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.pdf = None
+        self.pdf_hash = None
+        self.page_number = 1
+        self.render_stats = []
+        #pages rasterized by this backend, the pages read from the page cache are not counted
+        self.pages_rendered = 0
+
+    def get_settings(self) -> dict:
+        return {"resolution":self.resolution, "max_pixels":self.max_pixels, "cache_dir":self.cache_dir}
+
+    def bind_document(self, pdf, pdf_hash:str):
+        """Render pages from an already opened document instead of opening the single page pdf from camelot"""
+        self.pdf = pdf
+        self.pdf_hash = pdf_hash
+
+    def get_resolution(self, page) -> int:
+        if self.max_pixels is None:
+            return self.resolution
+        page_pixels_at_72_dpi = float(page.width) * float(page.height)
+        adaptive_resolution = int(72 * (self.max_pixels / page_pixels_at_72_dpi) ** 0.5)
+        return min(self.resolution, adaptive_resolution)
+
+    def render(self, page, pdf_hash:str, page_number:int, png_path:str):
+        start_time = time.time()
+        #ru_maxrss is the peak resident memory of the process so far, in KB on linux
+        start_peak_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        resolution = self.get_resolution(page)
+        cached_png_path = os.path.join(self.cache_dir, f"{pdf_hash}_{page_number}_{resolution}.png")
+        cache_hit = os.path.exists(cached_png_path)
+        if cache_hit:
+            shutil.copyfile(cached_png_path, png_path)
+        else:
+            page_image = page.to_image(resolution=resolution)
+            page_image.save(png_path)
+            page_image.original.close()
+            self.pages_rendered += 1
+            #copy and rename so that a partially written png is never read, the workers of other processes can render the same page
+            temp_png_path = f"{cached_png_path}.{os.getpid()}.tmp"
+            shutil.copyfile(png_path, temp_png_path)
+            os.replace(temp_png_path, cached_png_path)
+
+        self.render_stats.append({"pdf_hash":pdf_hash,
+                                  "page":page_number,
+                                  "dpi":resolution,
+                                  "cache_hit":cache_hit,
+                                  "render_seconds":round(time.time() - start_time, 3),
+                                  #how much this render raised the peak resident memory, 0 if it stayed under an earlier peak
+                                  "peak_rss_growth_mb":round((resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - start_peak_rss_kb) / 1024, 1),
+                                  #peak resident memory of the process since it started, not of this render
+                                  "process_peak_rss_mb":round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)})
+
+    def convert(self, pdf_path, png_path):
+        if self.pdf is not None:
+            page = self.pdf.pages[self.page_number - 1]
+            self.render(page, self.pdf_hash, self.page_number, png_path)
+            page.close()
+        else:
+            #camelot passes a single page pdf of the page it is processing
+            with pdfplumber.open(pdf_path) as pdf:
+                self.render(pdf.pages[0], get_file_hash(pdf_path), 1, png_path)
+
+# COMMAND ----------
+
+def format_summary(summary_tables:[pd.DataFrame]) -> pd.DataFrame :
+    summary_df = summary_tables[0]
+    summary_df = summary_df.tail(-1)
+    summary_df.columns= ["Questions","Answer","Why this matters"] 
+    return summary_df
+
+def get_summary(pdf_name : str) -> pd.DataFrame :
+    #assuming first page is summary
+    tables = camelot.read_pdf(pdf_name,
+                              pages="1",
+                              backend=SBCConversionBackend(),
+                              flavor="lattice")
+    return format_summary([table.df for table in tables])
+
+def format_coverage_page(page_df:pd.DataFrame,skip_lines:int) -> pd.DataFrame :
+    if len(page_df.columns) == 5:
+        page_df.columns= ["Medical Event","Service","In Network Amount","Out of Network Amount", "Limitations,Exceptions and Important Information"] 
+        page_df=page_df.mask(page_df == '')
+        page_df=page_df.fillna(method='ffill')
+        return page_df
+    else:
+        return None
+
+def format_coverage(page_df_list:[pd.DataFrame], pdf_name : str, skip_tables : int = None) -> pd.DataFrame :
+    #There are custom processing that is needed for each PDF
+    #In a production usecase, you would have algorithms detect each characteristic and process accordingly
+    #clien1 pdf has two header lines we need to skip
+    #client2 pdf has an extra example tables at the end we need to skip
+    #skip_tables is 0 when the tables are only from pre-screened covered services pages
+    skip_lines = 2 if "client1" in pdf_name else 1
+    if skip_tables is None:
+        skip_tables = 8 if "client2" in pdf_name else 2
+
+    #we also need to process the excluded services and other covered services differently
+    #we are ignoring them for this example
+    covered_services = page_df_list[: len(page_df_list) - skip_tables]
+
+    #format covered services
+    page_df = pd.concat([df.tail(-skip_lines) for df in covered_services])
+    page_df_formatted = format_coverage_page(page_df, skip_lines)
+    
+    return page_df_formatted
+
+def get_coverage(pdf_name : str, summary_page = True) -> pd.DataFrame :
+    tables = camelot.read_pdf(pdf_name,
+                              pages="2-end" if summary_page else "1-end",                              
+                              backend=SBCConversionBackend(),
+                              flavor="lattice")
+    return format_coverage([table.df for table in tables], pdf_name)
+
+# COMMAND ----------
+
+def extract_tables_by_page(pdf_name : str, backend : SBCConversionBackend = None, page_numbers : [int] = None) -> dict[int, list[pd.DataFrame]] :
+    """
+    Extracts all the tables of the PDF (or only of `page_numbers`) in a single pass.
+    The PDF is opened once and each page is split and rendered once, instead of once per `camelot.read_pdf` call.
+    """
+    if backend is None:
+        backend = SBCConversionBackend()
+    tables_by_page = {}
+    with pdfplumber.open(pdf_name) as pdf, TemporaryDirectory() as tempdir:
+        backend.bind_document(pdf, get_file_hash(pdf_name))
+        parser = Lattice(backend=backend)
+        reader = PdfReader(pdf.stream, strict=False)
+        if page_numbers is None:
+            page_numbers = range(1, len(reader.pages) + 1)
+        for page_number in page_numbers:
+            page = reader.pages[page_number - 1]
+            #camelot lattice parser works on single page pdf files
+            page_path = os.path.join(tempdir, f"page-{page_number}.pdf")
+            writer = PdfWriter()
+            writer.add_page(page)
+            with open(page_path, "wb") as f:
+                writer.write(f)
+            backend.page_number = page_number
+            tables_by_page[page_number] = [table.df for table in parser.extract_tables(page_path, suppress_stdout=True)]
+        backend.bind_document(None, None)
+    return tables_by_page
+
+def classify_page(page) -> str :
+    """
+    Classifies a page using only its text and ruling line objects, without rendering it.
+    Returns one of summary, covered_services, excluded_services, examples or prose.
+    """
+    text = re.sub(r"\s+", " ", page.extract_text() or "").lower()
+    ruling_count = len(page.rects) + len(page.lines)
+    if "important questions" in text:
+        return "summary"
+    if "services you may need" in text and ruling_count >= 50:
+        return "covered_services"
+    if "does not cover" in text:
+        return "excluded_services"
+    if "coverage examples" in text:
+        return "examples"
+    return "prose"
+
+def prescreen_pages(pdf_name : str) -> dict[int, str] :
+    with pdfplumber.open(pdf_name) as pdf:
+        page_types = {}
+        for page_number, page in enumerate(pdf.pages, start=1):
+            page_types[page_number] = classify_page(page)
+            page.close()
+        return page_types
+
+def extract_page_tables(pdf_name : str, page_number : int, backend_kwargs : dict) -> (int, list[pd.DataFrame]) :
+    #runs in a worker process, so the backend is created in the worker
+    tables_by_page = extract_tables_by_page(pdf_name, SBCConversionBackend(**backend_kwargs), [page_number])
+    return page_number, tables_by_page[page_number]
+
+def extract_tables_by_page_parallel(pdf_name : str, max_workers : int = None, backend_kwargs : dict = None, page_numbers : [int] = None) -> dict[int, list[pd.DataFrame]] :
+    """
+    Extracts the tables of each page in a separate process, since lattice extraction is CPU bound.
+    The pool is sized to the available cores and the tables are returned in page order.
+    """
+    if backend_kwargs is None:
+        backend_kwargs = {}
+    if page_numbers is None:
+        with pdfplumber.open(pdf_name) as pdf:
+            page_numbers = list(range(1, len(pdf.pages) + 1))
+    if max_workers is None:
+        max_workers = os.cpu_count()
+    max_workers = max(1, min(max_workers, len(page_numbers)))
+    if max_workers == 1:
+        return extract_tables_by_page(pdf_name, SBCConversionBackend(**backend_kwargs), page_numbers)
+
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("fork")) as executor:
+        futures = [executor.submit(extract_page_tables, pdf_name, page_number, backend_kwargs) 
+                   for page_number in page_numbers]
+        page_tables = [future.result() for future in futures]
+    return {page_number:tables for page_number, tables in sorted(page_tables, key=lambda x: x[0])}
+
+# COMMAND ----------
+
+class CamelotLatticeEngine(object):
+    """
+    Table extraction engine that renders the pages and detects the ruling lines with camelot lattice.
+    With `max_workers` other than 1 the pages are extracted in parallel processes (`None` uses all cores).
+    """
+    name = "camelot"
+
+    def __init__(self, backend : SBCConversionBackend = None, max_workers : int = 1):
+        self.backend = backend
+        self.max_workers = max_workers
+
+    def get_settings(self) -> dict:
+        backend = self.backend if self.backend is not None else SBCConversionBackend()
+        #the location of the page cache does not change the extracted tables
+        backend_settings = {k:v for k, v in backend.get_settings().items() if k != "cache_dir"}
+        return {"engine":self.name, "version":camelot.__version__, **backend_settings}
+
+    def extract_tables_by_page(self, pdf_name : str, page_numbers : [int] = None) -> dict[int, list[pd.DataFrame]] :
+        if self.max_workers == 1:
+            return extract_tables_by_page(pdf_name, self.backend, page_numbers)
+        backend_kwargs = self.backend.get_settings() if self.backend is not None else {}
+        return extract_tables_by_page_parallel(pdf_name, self.max_workers, backend_kwargs, page_numbers)
+
+class PdfplumberEngine(object):
+    """
+    Raster free table extraction engine that builds the tables directly from the vector ruling lines with `pdfplumber`.
+    SBC ruling lines are drawn as thin filled rectangles, while the cell shading is drawn as wide rectangles.
+    The rectangles and lines thinner than `max_line_thickness` points are used as explicit table lines,
+    along with the top and bottom of dark filled bands (like header rows) that camelot would also see as lines on the rendered page.
+    The light shading is ignored so that it does not split the cells. Like camelot, the cells are stripped and the empty cells are empty strings.
+    """
+    name = "pdfplumber"
+
+    def __init__(self, max_line_thickness : float = 2.5, min_line_length : float = 3.0, max_fill_brightness : float = 0.5, snap_tolerance : float = 3.0):
+        self.max_line_thickness = max_line_thickness
+        self.min_line_length = min_line_length
+        self.max_fill_brightness = max_fill_brightness
+        self.snap_tolerance = snap_tolerance
+
+    def get_settings(self) -> dict:
+        return {"engine":self.name, 
+                "version":pdfplumber.__version__,
+                "max_line_thickness":self.max_line_thickness, 
+                "min_line_length":self.min_line_length, 
+                "max_fill_brightness":self.max_fill_brightness,
+                "snap_tolerance":self.snap_tolerance}
+
+    def get_brightness(self, color) -> float:
+        #gray, rgb or cmyk fill color between 0 (black) and 1 (white)
+        if color is None or not isinstance(color, (tuple, list)) or len(color) == 0:
+            return 1.0
+        if len(color) == 4:
+            return (1 - max(color[:3])) * (1 - color[3])
+        return sum(color) / len(color)
+
+    def get_ruling_lines(self, page) -> (list[dict], list[dict]) :
+        def vertical_line(x, top, bottom):
+            return {"x0":x, "x1":x, "top":top, "bottom":bottom, "width":0, "height":bottom - top, "orientation":"v", "object_type":"line"}
+
+        def horizontal_line(y, x0, x1):
+            return {"x0":x0, "x1":x1, "top":y, "bottom":y, "width":x1 - x0, "height":0, "orientation":"h", "object_type":"line"}
+
+        vertical_lines = []
+        horizontal_lines = []
+        dark_fills = []
+        for obj in page.rects + page.lines:
+            width = obj["x1"] - obj["x0"]
+            height = obj["bottom"] - obj["top"]
+            if width <= self.max_line_thickness and height >= self.min_line_length:
+                vertical_lines.append(vertical_line((obj["x0"] + obj["x1"]) / 2, obj["top"], obj["bottom"]))
+            elif height <= self.max_line_thickness and width >= self.min_line_length:
+                horizontal_lines.append(horizontal_line((obj["top"] + obj["bottom"]) / 2, obj["x0"], obj["x1"]))
+            elif (width > self.max_line_thickness and height > self.max_line_thickness 
+                  and obj.get("fill") and self.get_brightness(obj.get("non_stroking_color")) <= self.max_fill_brightness):
+                dark_fills.append(obj)
+
+        #dark bands are often tiled from several rectangles, only the outer edges of a band are visible
+        bands = []
+        for obj in sorted(dark_fills, key=lambda o: o["top"]):
+            if len(bands) > 0 and obj["top"] <= bands[-1]["bottom"] + self.snap_tolerance:
+                band = bands[-1]
+                band["bottom"] = max(band["bottom"], obj["bottom"])
+                band["x0"] = min(band["x0"], obj["x0"])
+                band["x1"] = max(band["x1"], obj["x1"])
+            else:
+                bands.append({"top":obj["top"], "bottom":obj["bottom"], "x0":obj["x0"], "x1":obj["x1"]})
+        for band in bands:
+            horizontal_lines += [horizontal_line(band["top"], band["x0"], band["x1"]), 
+                                 horizontal_line(band["bottom"], band["x0"], band["x1"])]
+        return vertical_lines, horizontal_lines
+
+    def extract_page_tables(self, page) -> list[pd.DataFrame] :
+        vertical_lines, horizontal_lines = self.get_ruling_lines(page)
+        #pages without ruling lines, like prose pages, have no tables
+        if len(vertical_lines) < 2 or len(horizontal_lines) < 2:
+            return []
+        table_settings = {"vertical_strategy":"explicit",
+                          "horizontal_strategy":"explicit",
+                          "explicit_vertical_lines":vertical_lines,
+                          "explicit_horizontal_lines":horizontal_lines,
+                          "snap_tolerance":self.snap_tolerance,
+                          #keep the spaces at the end of the lines, like camelot, so that words are not joined when the lines are
+                          "text_keep_blank_chars":True}
+        return [pd.DataFrame(table).fillna("").apply(lambda column: column.map(str.strip)) for table in page.extract_tables(table_settings)]
+
+    def extract_tables_by_page(self, pdf_name : str, page_numbers : [int] = None) -> dict[int, list[pd.DataFrame]] :
+        tables_by_page = {}
+        with pdfplumber.open(pdf_name) as pdf:
+            if page_numbers is None:
+                page_numbers = range(1, len(pdf.pages) + 1)
+            for page_number in page_numbers:
+                page = pdf.pages[page_number - 1]
+                tables_by_page[page_number] = self.extract_page_tables(page)
+                page.close()
+        return tables_by_page
+
+extraction_engines = {CamelotLatticeEngine.name:CamelotLatticeEngine, 
+                      PdfplumberEngine.name:PdfplumberEngine}
+
+class CachedExtractionEngine(object):
+    """
+    Wraps an extraction engine and persists the extracted tables of each page as Parquet files in `cache_dir`.
+    The files are keyed by (PDF content hash, engine name, hash of the engine settings), so the tables are extracted 
+    again when the PDF, the engine settings or the version of the engine library change.
+    """
+    def __init__(self, engine, cache_dir : str):
+        self.engine = engine
+        self.name = engine.name
+        self.cache_dir = cache_dir
+        self.cache_stats = []
+
+    def get_settings(self) -> dict:
+        return self.engine.get_settings()
+
+    def get_cache_path(self, pdf_hash : str) -> str :
+        settings = json.dumps(self.get_settings(), sort_keys=True, default=str)
+        settings_hash = hashlib.sha256(settings.encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.cache_dir, pdf_hash, f"{self.name}_{settings_hash}")
+
+    def write_page_tables(self, page_path : str, tables : list[pd.DataFrame]):
+        #tables of a page can have different number of columns, so the cells are stored in long format
+        cells_df = pd.DataFrame(columns=["table","row","column","value"])
+        if len(tables) > 0:
+            cells_df = pd.concat([df.reset_index(drop=True)
+                                    .rename_axis("row")
+                                    .reset_index()
+                                    .melt(id_vars="row", var_name="column", value_name="value")
+                                    .assign(table=table_index)
+                                  for table_index, df in enumerate(tables)])
+        cells_df = cells_df.astype({"table":"int64", "row":"int64", "column":"int64", "value":"str"})
+        #write and rename so that a partially written file is never read
+        cells_df[["table","row","column","value"]].to_parquet(f"{page_path}.tmp", index=False)
+        os.replace(f"{page_path}.tmp", page_path)
+
+    def read_page_tables(self, page_path : str) -> list[pd.DataFrame] :
+        cells_df = pd.read_parquet(page_path)
+        return [table_cells.pivot(index="row", columns="column", values="value").rename_axis(index=None, columns=None)
+                for _, table_cells in cells_df.groupby("table", sort=True)]
+
+    def extract_tables_by_page(self, pdf_name : str, page_numbers : [int] = None) -> dict[int, list[pd.DataFrame]] :
+        start_time = time.time()
+        pdf_hash = get_file_hash(pdf_name)
+        cache_path = self.get_cache_path(pdf_hash)
+        os.makedirs(cache_path, exist_ok=True)
+        settings_path = os.path.join(cache_path, "settings.json")
+        if not os.path.exists(settings_path):
+            with open(settings_path, "w") as f:
+                json.dump(self.get_settings(), f, sort_keys=True, default=str)
+
+        if page_numbers is None:
+            with pdfplumber.open(pdf_name) as pdf:
+                page_numbers = list(range(1, len(pdf.pages) + 1))
+        page_paths = {page_number:os.path.join(cache_path, f"page-{page_number}.parquet") for page_number in page_numbers}
+        missing_pages = [page_number for page_number, page_path in page_paths.items() if not os.path.exists(page_path)]
+
+        tables_by_page = {}
+        if len(missing_pages) > 0:
+            tables_by_page = self.engine.extract_tables_by_page(pdf_name, missing_pages)
+            for page_number, tables in tables_by_page.items():
+                self.write_page_tables(page_paths[page_number], tables)
+        for page_number in page_numbers:
+            if page_number not in tables_by_page:
+                tables_by_page[page_number] = self.read_page_tables(page_paths[page_number])
+
+        self.cache_stats.append({"pdf_hash":pdf_hash,
+                                 "engine":self.name,
+                                 "pages":len(page_numbers),
+                                 "cache_hits":len(page_numbers) - len(missing_pages),
+                                 "seconds":round(time.time() - start_time, 3)})
+        return {page_number:tables_by_page[page_number] for page_number in page_numbers}
+
+def parse_sbc_pdf(pdf_name : str, backend : SBCConversionBackend = None, max_workers : int = 1, prescreen : bool = True, engine = None) -> (pd.DataFrame, pd.DataFrame) :
+    """
+    Returns the summary and coverage of the SBC from a single parse of the PDF.
+    The tables are extracted with `engine`, by default camelot lattice with the given `backend` and `max_workers`.
+    With `prescreen` only the summary and covered services pages are extracted.
+    """
+    if engine is None:
+        engine = CamelotLatticeEngine(backend, max_workers)
+    page_numbers = None
+    skip_tables = None
+    if prescreen:
+        page_types = prescreen_pages(pdf_name)
+        covered_pages = [p for p, page_type in page_types.items() if page_type == "covered_services"]
+        #fallback to extracting all pages if the format is not recognized
+        if len(covered_pages) > 0:
+            page_numbers = [1] + covered_pages
+            skip_tables = 0
+
+    tables_by_page = engine.extract_tables_by_page(pdf_name, page_numbers)
+    #assuming first page is summary
+    summary_tables = tables_by_page[1]
+    coverage_tables = [df for page_number in sorted(tables_by_page) if page_number > 1 for df in tables_by_page[page_number]]
+    return format_summary(summary_tables), format_coverage(coverage_tables, pdf_name, skip_tables)
+
+# COMMAND ----------
+
+def clean(text):
+    return str(text).replace('\n','')
+
+def summarize_summary_row(row):
+    return f" {clean(row['Questions'])}\n Answer is {clean(row['Answer'])}. Why it matters to you is because {clean(row['Why this matters'])}"
+
+def get_extra_coverage_info(row):
+    extra = clean(row['Limitations,Exceptions and Important Information'])
+    return f"Also {extra}" if "none" not in extra.lower() else ""
+
+def summarize_coverage_row(row):
+    return f" {clean(row['Medical Event'])}, for {clean(row['Service'])} you will pay {clean(row['In Network Amount']) } In Network and {clean(row['Out of Network Amount'])} Out of Network. {get_extra_coverage_info(row)}"
+
+def summary_to_document(summary_df):
+    return summary_df.apply(summarize_summary_row, axis=1).values.tolist()
+
+def coverage_to_document(coverage_df):
+    return coverage_df.apply(summarize_coverage_row, axis=1).values.tolist()
+
+def pdf_to_document(pdf_file, backend : SBCConversionBackend = None, engine = None):
+    summary_df, coverage_df = parse_sbc_pdf(pdf_file, backend, engine=engine)
+    return summary_to_document(summary_df) + coverage_to_document(coverage_df)
@@ -0,0 +1,180 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC ##### Synthetic data at scale
+# MAGIC
+# MAGIC Utility methods to generate `member_enrolment`, `member_accumulators`, `procedure_cost` and `sbc_details` rows with Spark for millions of members and thousands of clients.
+# MAGIC - The number of members per client is skewed, a few large clients have most of the members
+# MAGIC - Each client offers a few plans and the deductibles, out of pocket limits and cost sharing come from the plan tier
+# MAGIC - The year to date spend of the members is log-normal, most members have spent little and a few have reached their limits
+# MAGIC - The SBC chunks of each client are generated from templates with the cost sharing of the client's plan tier
+# MAGIC - `sample_member_ids` picks the members for load tests, with a configurable share of requests going to a small set of hot members
+# MAGIC
+# MAGIC The synthetic member ids start with `S` and the synthetic procedure codes start with `X`, so they never collide with the demo data.
+# MAGIC
+# MAGIC **NOTE:** Expects `spark` to be defined by `./init`
+
+# COMMAND ----------
+
+import math
+import random
+import datetime
+from pyspark.sql import DataFrame
+from pyspark.sql import functions as F
+
+#(plan_id, member deductible, out of pocket max, coinsurance %, copay)
+plan_tiers = [
+    ("P1", 500.0, 2500.0, 20, 25),
+    ("P2", 1000.0, 3000.0, 20, 35),
+    ("P3", 2000.0, 5000.0, 30, 40),
+    ("P4", 3000.0, 6000.0, 40, 50),
+    ("P5", 6000.0, 8000.0, 50, 60),
+]
+
+def get_plan_tiers_df() -> DataFrame:
+    return spark.createDataFrame(plan_tiers, schema="plan_id string, mem_deductible double, oop_max double, coinsurance int, copay int")
+
+def get_num_files(num_rows:int, rows_per_file:int) -> int:
+    return max(1, math.ceil(num_rows / rows_per_file))
+
+def generate_member_enrolment(num_members:int, num_clients:int, client_skew:float=2.0, plans_per_client:int=2,
+                              inactive_fraction:float=0.03, seed:int=42) -> DataFrame:
+    """
+    Generates the enrolment of `num_members` members in `num_clients` clients.
+    With `client_skew` above 1, the members are concentrated in the first clients, like a few large employers.
+    """
+    return (spark
+            .range(num_members)
+            .withColumn("member_id", F.format_string("S%09d", F.col("id")))
+            .withColumn("client_index", F.floor(F.pow(F.rand(seed), client_skew) * num_clients).cast("int"))
+            .withColumn("client_id", F.format_string("client_%05d", F.col("client_index")))
+            #each client offers `plans_per_client` consecutive plan tiers
+            .withColumn("plan_index", (F.col("client_index") + F.floor(F.rand(seed + 1) * plans_per_client)) % len(plan_tiers))
+            .withColumn("plan_id", F.concat(F.lit("P"), (F.col("plan_index") + 1).cast("string")))
+            .withColumn("plan_start_date", F.lit(datetime.date(2024,1,1)))
+            .withColumn("plan_end_date", F.lit(datetime.date(2024,12,31)))
+            .withColumn("active_ind", F.when(F.rand(seed + 2) < inactive_fraction, "N").otherwise("Y"))
+            .select("member_id","client_id","plan_id","plan_start_date","plan_end_date","active_ind"))
+
+def generate_member_accumulators(member_df:DataFrame, zero_spend_fraction:float=0.25,
+                                 spend_mean_log:float=6.0, spend_sigma_log:float=1.2, seed:int=42) -> DataFrame:
+    """
+    Generates the year to date accumulators of the members from their plan tier.
+    The spend is log-normal (median of exp(`spend_mean_log`)), and `zero_spend_fraction` of the members have no spend.
+    """
+    def spend(spend_seed:int):
+        return F.exp(F.randn(spend_seed) * spend_sigma_log + spend_mean_log)
+
+    return (member_df
+            .join(F.broadcast(get_plan_tiers_df()), on="plan_id")
+            .withColumn("fam_deductible", F.col("mem_deductible") * 2)
+            .withColumn("spend", F.when(F.rand(seed) < zero_spend_fraction, 0.0).otherwise(spend(seed + 1)))
+            .withColumn("family_spend", F.when(F.rand(seed + 2) < 0.5, 0.0).otherwise(spend(seed + 3)))
+            .withColumn("mem_ded_agg", F.round(F.least(F.col("spend"), F.col("mem_deductible")), 2))
+            .withColumn("fam_ded_agg", F.round(F.least(F.col("mem_ded_agg") + F.col("family_spend"), F.col("fam_deductible")), 2))
+            #after the deductible, the member pays the coinsurance until the out of pocket max
+            .withColumn("oop_agg", F.round(F.least(F.col("mem_ded_agg") + F.greatest(F.col("spend") - F.col("mem_deductible"), F.lit(0.0)) * F.col("coinsurance") / 100,
+                                                   F.col("oop_max")), 2))
+            .select("member_id","oop_max","fam_deductible","mem_deductible","oop_agg","mem_ded_agg","fam_ded_agg"))
+
+def generate_procedure_cost(num_procedures:int, cost_mean_log:float=5.5, cost_sigma_log:float=1.0, seed:int=42) -> DataFrame:
+    """Generates `num_procedures` synthetic procedure codes with a log-normal cost"""
+    return (spark
+            .range(num_procedures)
+            .withColumn("procedure_code", F.format_string("X%05d", F.col("id")))
+            .withColumn("cost", F.round(F.exp(F.randn(seed) * cost_sigma_log + cost_mean_log) + 20, 2))
+            .select("procedure_code","cost"))
+
+#(medical event, service, in network cost sharing, limitations)
+#in network cost sharing is either copay or coinsurance of the plan tier
+sbc_coverage_templates = [
+    ("If you visit a health care provider's office or clinic", "Primary care visit to treat an injury or illness", "copay", ""),
+    ("If you visit a health care provider's office or clinic", "Specialist visit", "copay", ""),
+    ("If you visit a health care provider's office or clinic", "Preventive care/screening/immunization", "none", "You may have to pay for services that aren't preventive."),
+    ("If you have a test", "Diagnostic test (x-ray, blood work)", "coinsurance", ""),
+    ("If you have a test", "Imaging (CT/PET scans, MRIs)", "coinsurance", "Preauthorization is required."),
+    ("If you need drugs to treat your illness or condition", "Generic drugs", "copay", "Covers up to a 30-day supply."),
+    ("If you need drugs to treat your illness or condition", "Preferred brand drugs", "coinsurance", "Covers up to a 30-day supply."),
+    ("If you need drugs to treat your illness or condition", "Specialty drugs", "coinsurance", "Preauthorization is required."),
+    ("If you have outpatient surgery", "Facility fee (e.g., ambulatory surgery center)", "coinsurance", "Preauthorization is required."),
+    ("If you have outpatient surgery", "Physician/surgeon fees", "coinsurance", ""),
+    ("If you need immediate medical attention", "Emergency room care", "coinsurance", ""),
+    ("If you need immediate medical attention", "Urgent care", "copay", ""),
+    ("If you have a hospital stay", "Facility fee (e.g., hospital room)", "coinsurance", "Preauthorization is required."),
+    ("If you need mental health, behavioral health, or substance abuse services", "Outpatient services", "copay", ""),
+    ("If you are pregnant", "Office visits", "none", "Cost sharing does not apply for preventive services."),
+    ("If you need help recovering or have other special health needs", "Rehabilitation services", "coinsurance", "Limited to 35 visits/calendar year."),
+]
+
+def generate_sbc_chunks(num_clients:int) -> DataFrame:
+    """
+    Generates the `sbc_details` chunks of each synthetic client from the coverage templates and its plan tier,
+    in the same format as the chunks parsed from the SBC documents in `02_Parsing and Chunking Summary of Benefits`.
+    """
+    templates_df = spark.createDataFrame(sbc_coverage_templates, schema="medical_event string, service string, cost_sharing string, limitations string")
+    clients_df = (spark
+                  .range(num_clients)
+                  .withColumn("client", F.format_string("client_%05d", F.col("id")))
+                  #plan tier of the first plan offered by the client
+                  .withColumn("plan_id", F.concat(F.lit("P"), (F.col("id") % len(plan_tiers) + 1).cast("string")))
+                  .join(F.broadcast(get_plan_tiers_df()), on="plan_id"))
+
+    summary_chunks_df = (clients_df
+                         .withColumn("content", F.format_string(" What is the overall deductible?\n Answer is $%.0f/individual or $%.0f/family. Why it matters to you is because Generally, you must pay all of the costs from providers up to the deductible amount before this plan begins to pay.",
+                                                                F.col("mem_deductible"), F.col("mem_deductible") * 2))
+                         .unionByName(clients_df
+                                      .withColumn("content", F.format_string(" What is the out-of-pocket limit for this plan?\n Answer is $%.0f/individual or $%.0f/family. Why it matters to you is because The out-of-pocket limit is the most you could pay in a year for covered services.",
+                                                                             F.col("oop_max"), F.col("oop_max") * 2)))
+                         .select("client","content"))
+
+    coverage_chunks_df = (clients_df
+                          .crossJoin(F.broadcast(templates_df))
+                          .withColumn("in_network", F.when(F.col("cost_sharing") == "copay", F.format_string("$%d copay/visit", F.col("copay")))
+                                                    .when(F.col("cost_sharing") == "coinsurance", F.format_string("%d%% coinsurance", F.col("coinsurance")))
+                                                    .otherwise(F.lit("No charge")))
+                          .withColumn("extra", F.when(F.col("limitations") == "", F.lit("")).otherwise(F.concat(F.lit("Also "), F.col("limitations"))))
+                          .withColumn("content", F.format_string(" %s, for %s you will pay %s In Network and Not covered Out of Network. %s",
+                                                                 F.col("medical_event"), F.col("service"), F.col("in_network"), F.col("extra")))
+                          .select("client","content"))
+
+    return (summary_chunks_df
+            .unionByName(coverage_chunks_df)
+            .withColumn("id", F.xxhash64("client", F.lower(F.trim(F.regexp_replace("content", r"\s+", " ")))))
+            .select("id","client","content"))
+
+def append_synthetic_rows(df:DataFrame, fq_table_name:str, sort_column:str, num_rows:int, rows_per_file:int=2000000):
+    """
+    Appends the rows range partitioned by `sort_column`, so that each file holds a contiguous range of keys
+    of about `rows_per_file` rows and point lookups only read the files whose min/max stats match.
+    """
+    (df
+     .repartitionByRange(get_num_files(num_rows, rows_per_file), sort_column)
+     .sortWithinPartitions(sort_column)
+     .write
+     .mode("append")
+     .saveAsTable(fq_table_name))
+
+def sample_member_ids(fq_member_table_name:str, num_requests:int, hot_member_fraction:float=0.01,
+                      hot_request_fraction:float=0.8, min_members:int=10000, seed:int=42) -> [str]:
+    """
+    Returns `num_requests` member ids for a load test, where `hot_request_fraction` of the requests
+    go to `hot_member_fraction` of the members and the rest are spread over all the members.
+    With only the demo members, every request would go to the same few members, so the table must have at least `min_members` members,
+    for eg: the synthetic members appended by `generate_scale_data` in `01_Setup Data`.
+    """
+    members_df = spark.table(fq_member_table_name).select("member_id")
+    num_members = members_df.count()
+    if num_members < max(min_members, num_requests):
+        raise Exception(f"{fq_member_table_name} has {num_members} members, a load test of {num_requests} requests needs at least {max(min_members, num_requests)}. "
+                        "Append the synthetic members with `generate_scale_data` in `01_Setup Data`")
+    hot_member_ids = [r.member_id for r in members_df.sample(fraction=hot_member_fraction, seed=seed).collect()]
+    num_hot_requests = int(num_requests * hot_request_fraction) if len(hot_member_ids) > 0 else 0
+    num_cold_requests = num_requests - num_hot_requests
+
+    cold_fraction = min(1.0, 1.2 * num_cold_requests / max(1, num_members))
+    cold_member_ids = [r.member_id for r in members_df.sample(fraction=cold_fraction, seed=seed + 1).limit(num_cold_requests).collect()]
+
+    rng = random.Random(seed)
+    member_ids = [rng.choice(hot_member_ids) for _ in range(num_hot_requests)]
+    member_ids += cold_member_ids
+    rng.shuffle(member_ids)
+    return member_ids
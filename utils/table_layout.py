@@ -0,0 +1,105 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC ##### Lookup optimized layout of the serving source tables
+# MAGIC
+# MAGIC Utility methods to cluster the lookup tables on their primary keys with liquid clustering, to run and schedule `OPTIMIZE`
+# MAGIC and to benchmark the point lookup and batched join latency of a table.
+# MAGIC With the rows clustered on the key, a lookup or a join on the key only reads the files whose min/max statistics match, instead of scanning the table.
+# MAGIC
+# MAGIC **NOTE:** Expects `spark` and the table names to be defined by `./init`
+
+# COMMAND ----------
+
+import time
+import numpy as np
+from databricks.sdk import WorkspaceClient
+from databricks.sdk.service import jobs
+from pyspark.sql.functions import col, count
+
+#clustering columns of the lookup tables, the primary keys
+lookup_table_cluster_columns = {
+    member_table_name : ["member_id"],
+    member_accumulators_table_name : ["member_id"],
+    procedure_cost_table_name : ["procedure_code"],
+}
+
+def apply_liquid_clustering(fq_table_name:str, cluster_columns:[str]):
+    spark.sql(f"ALTER TABLE {fq_table_name} CLUSTER BY ({', '.join(cluster_columns)})")
+
+def optimize_table(fq_table_name:str) -> dict:
+    """Runs `OPTIMIZE`, which clusters the rows written since the last run"""
+    start_time = time.time()
+    metrics = spark.sql(f"OPTIMIZE {fq_table_name}").collect()[0]["metrics"]
+    return {"table_name":fq_table_name,
+            "files_added":metrics["numFilesAdded"],
+            "files_removed":metrics["numFilesRemoved"],
+            "seconds":round(time.time() - start_time, 2)}
+
+def schedule_optimize_job(job_name:str, fq_table_names:[str], notebook_path:str,
+                          quartz_cron_expression:str="0 0 2 * * ?", timezone_id:str="UTC", existing_cluster_id:str=None) -> int:
+    """
+    Creates or updates a job that runs the `optimize_tables` notebook on a schedule (daily at 2 AM by default).
+    Without `existing_cluster_id` the job runs on serverless compute.
+    """
+    workspace = WorkspaceClient()
+    job_settings = jobs.JobSettings(
+        name=job_name,
+        tasks=[jobs.Task(task_key="optimize_tables",
+                         notebook_task=jobs.NotebookTask(notebook_path=notebook_path,
+                                                         base_parameters={"table_names":",".join(fq_table_names)}),
+                         existing_cluster_id=existing_cluster_id)],
+        schedule=jobs.CronSchedule(quartz_cron_expression=quartz_cron_expression, timezone_id=timezone_id))
+
+    existing_jobs = list(workspace.jobs.list(name=job_name))
+    if len(existing_jobs) > 0:
+        job_id = existing_jobs[0].job_id
+        workspace.jobs.reset(job_id=job_id, new_settings=job_settings)
+        print(f"Optimize job {job_name} updated.")
+    else:
+        job_id = workspace.jobs.create(name=job_settings.name, tasks=job_settings.tasks, schedule=job_settings.schedule).job_id
+        print(f"Optimize job {job_name} created.")
+    return job_id
+
+def create_unclustered_copy(fq_table_name:str) -> str:
+    """Copies the table with the rows shuffled across files, like a table loaded without any clustering"""
+    unclustered_table_name = f"{fq_table_name}_unclustered"
+    spark.sql(f"CREATE OR REPLACE TABLE {unclustered_table_name} AS SELECT * FROM {fq_table_name} DISTRIBUTE BY rand()")
+    return unclustered_table_name
+
+def get_latency_stats(latencies_ms:[float]) -> dict:
+    return {"p50_ms":round(float(np.percentile(latencies_ms, 50)), 1),
+            "p95_ms":round(float(np.percentile(latencies_ms, 95)), 1),
+            "mean_ms":round(float(np.mean(latencies_ms)), 1)}
+
+def benchmark_table_lookups(fq_table_name:str, key_column:str, keys:[str], num_point_lookups:int=50, num_join_runs:int=5) -> dict:
+    """
+    Measures the latency of `num_point_lookups` point lookups of single keys and of `num_join_runs` joins of all the `keys` with the table.
+    The disk cache is disabled, so that each query reads the files again, and its previous setting is restored afterwards.
+    """
+    disk_cache_enabled = spark.conf.get("spark.databricks.io.cache.enabled", None)
+    spark.conf.set("spark.databricks.io.cache.enabled", "false")
+    try:
+        lookup_latencies = []
+        for key in keys[:num_point_lookups]:
+            start_time = time.time()
+            spark.table(fq_table_name).filter(col(key_column) == key).collect()
+            lookup_latencies.append((time.time() - start_time) * 1000)
+
+        keys_df = spark.createDataFrame([(k,) for k in set(keys)], schema=f"{key_column} string")
+        join_latencies = []
+        for _ in range(num_join_runs):
+            start_time = time.time()
+            keys_df.join(spark.table(fq_table_name), on=key_column).agg(count("*")).collect()
+            join_latencies.append((time.time() - start_time) * 1000)
+    finally:
+        if disk_cache_enabled is None:
+            spark.conf.unset("spark.databricks.io.cache.enabled")
+        else:
+            spark.conf.set("spark.databricks.io.cache.enabled", disk_cache_enabled)
+
+    num_files = spark.sql(f"DESCRIBE DETAIL {fq_table_name}").collect()[0]["numFiles"]
+    return {"table_name":fq_table_name,
+            "files":num_files,
+            "join_keys":len(set(keys)),
+            **{f"point_lookup_{k}":v for k, v in get_latency_stats(lookup_latencies).items()},
+            **{f"batched_join_{k}":v for k, v in get_latency_stats(join_latencies).items()}}
@@ -4,6 +4,9 @@
 # COMMAND ----------
 
 import time
+import threading
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from databricks.sdk import WorkspaceClient
 from databricks.sdk.service.catalog import OnlineTableSpec,OnlineTableSpecTriggeredSchedulingPolicy
 from databricks.feature_engineering import FeatureEngineeringClient, FeatureLookup
@@ -75,6 +78,79 @@ def create_feature_serving(fq_table_name : str, primary_key_columns : [str]):
         else:
             raise e
 
+def get_online_table_status(online_table_name:str) -> (bool, str):
+    """Returns whether the online table has synced its data and its detailed state"""
+    detailed_state = WorkspaceClient().online_tables.get(online_table_name).status.detailed_state
+    state = detailed_state.value if detailed_state is not None else "UNKNOWN"
+    if state.endswith("FAILED"):
+        raise Exception(f"Online table {online_table_name} failed with state {state}")
+    return state.startswith("ONLINE"), state
+
+def get_serving_endpoint_status(endpoint_name:str) -> (bool, str):
+    """Returns whether the endpoint is serving its latest config and its state"""
+    state = WorkspaceClient().serving_endpoints.get(endpoint_name).state
+    if state.config_update == EndpointStateConfigUpdate.UPDATE_FAILED:
+        raise Exception(f"Endpoint {endpoint_name} config update failed")
+    ready = state.ready == EndpointStateReady.READY and state.config_update != EndpointStateConfigUpdate.IN_PROGRESS
+    return ready, f"{state.ready.value if state.ready else None}/{state.config_update.value if state.config_update else None}"
+
+def wait_until_ready(status_fn, resource_name:str, start_time:float, timeout_seconds:int,
+                     initial_wait_seconds:float=5.0, max_wait_seconds:float=60.0, stop_event:threading.Event=None) -> float:
+    """
+    Polls `status_fn` with exponential backoff and returns the seconds since `start_time` when the resource was ready.
+    Stops polling when `stop_event` is set, for eg: because another resource failed.
+    """
+    stop_event = stop_event if stop_event is not None else threading.Event()
+    wait_seconds = initial_wait_seconds
+    while True:
+        ready, state = status_fn(resource_name)
+        elapsed_seconds = time.time() - start_time
+        if ready:
+            print(f"{resource_name} is ready after {elapsed_seconds:.0f}s")
+            return elapsed_seconds
+        if elapsed_seconds > timeout_seconds:
+            raise Exception(f"{resource_name} not ready after {elapsed_seconds:.0f}s, state {state}")
+        if stop_event.wait(wait_seconds):
+            raise Exception(f"Stopped waiting for {resource_name}, state {state}")
+        wait_seconds = min(wait_seconds * 1.5, max_wait_seconds)
+
+def provision_online_lookups(tables:[(str, [str])], timeout_minutes:int=60) -> pd.DataFrame:
+    """
+    Creates the online table, feature spec and feature serving endpoint of all `(fq_table_name, primary_key_columns)` concurrently,
+    then waits until all the online tables have synced and all the endpoints are ready.
+    Returns the time to ready of each resource, and raises if a resource failed or is not ready within `timeout_minutes`.
+    """
+    start_time = time.time()
+    def provision(table):
+        fq_table_name, primary_key_columns = table
+        create_online_table(fq_table_name, primary_key_columns)
+        create_feature_serving(fq_table_name, primary_key_columns)
+
+    with ThreadPoolExecutor(max_workers=len(tables)) as executor:
+        list(executor.map(provision, tables))
+
+    resources = []
+    for fq_table_name, _ in tables:
+        table_name = fq_table_name.split(".")[-1]
+        resources.append(("online_table", f"{fq_table_name}_online", get_online_table_status))
+        resources.append(("serving_endpoint", f"{table_name}_endpoint".replace('_','-'), get_serving_endpoint_status))
+
+    #the first failure is raised right away, and the other resources stop polling
+    stop_polling = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=len(resources))
+    try:
+        futures = {executor.submit(wait_until_ready, status_fn, resource_name, start_time, timeout_minutes * 60, stop_event=stop_polling):i
+                   for i, (_, resource_name, status_fn) in enumerate(resources)}
+        seconds_to_ready = [None] * len(resources)
+        for future in as_completed(futures):
+            seconds_to_ready[futures[future]] = future.result()
+    finally:
+        stop_polling.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    return pd.DataFrame([{"resource_type":resource_type, "resource_name":resource_name, "seconds_to_ready":round(seconds, 1)}
+                         for (resource_type, resource_name, _), seconds in zip(resources, seconds_to_ready)])
+
 # COMMAND ----------
 
 import requests
@@ -99,6 +175,34 @@ def get_data_from_online_table(fq_table_name, query_object):
 
 # COMMAND ----------
 
+import os
+
+def export_lookup_snapshot(fq_table_name:str, snapshot_path:str) -> dict:
+    """
+    Writes the table as Parquet to `<snapshot_path>/<table_name>` with its Delta version and commit time in `<snapshot_path>/<table_name>.json`.
+    The snapshots are the offline fallback of the agent lookups when the feature serving endpoints are cold.
+    """
+    table_name = fq_table_name.split(".")[-1]
+    last_commit = spark.sql(f"DESCRIBE HISTORY {fq_table_name} LIMIT 1").collect()[0]
+    (spark
+     .read
+     .option("versionAsOf", last_commit["version"])
+     .table(fq_table_name)
+     .coalesce(1)
+     .write
+     .mode("overwrite")
+     .parquet(f"{snapshot_path}/{table_name}"))
+
+    snapshot_info = {"table_name":fq_table_name,
+                     "delta_version":last_commit["version"],
+                     "as_of":last_commit["timestamp"].isoformat(timespec="seconds")}
+    os.makedirs(snapshot_path, exist_ok=True)
+    with open(f"{snapshot_path}/{table_name}.json", "w") as f:
+        json.dump(snapshot_info, f)
+    return snapshot_info
+
+# COMMAND ----------
+
 import mlflow 
 
 def start_mlflow_experiment(experiment_name):